@@ -47,6 +47,26 @@ from google.cloud.logging.handlers import CloudLoggingHandler
 import google
 import logging
 import google.cloud
+from afklm_common import list_json_files as list_page_files, list_page_partitions, open_json as open_page_json, register_file
+from afklm_common import client_storage as common_client_storage, page_path, page_locations
+from afklm_codecs import encode_page, page_extension
+from afklm_projection import project_page
+import afklm_tables
+from afklm_tables import extend_date_ranges, read_table, csv_table, typed_table, table_schema, parquet_name
+from afklm_retry import retry_decision, schedule_retry, retry_budget
+from afklm_logging import start_logging, logging_started, log_message, flush_logging
+from afklm_query_state import query_states_from_table, query_table
+from afklm_flight_stream import publish_page, stop_stream
+from afklm_refresh_policy import plan_refreshes, refresh_requested
+from afklm_query_planner import planned_parameter_file, covered_by_plan
+from afklm_memory_profile import profile_stage, start_memory_profiling, save_memory_report
+from afklm_pacing import (
+    update_pacing, wait_for_next_call, server_call_count, quota_nearly_exhausted, quota_exhausted, save_telemetry,
+    max_rate_limited_retries,
+)
+from afklm_page_cursor import (
+    build_page_catalog, stored_pages, known_total_pages, missing_pages, next_missing_page, page_kind, page_file_name,
+)
 
 
 ### GCP parameters
@@ -73,34 +93,35 @@ max_page_to_fetch = 10000000000
 pageNumberStart = 0
 page_max = 100000  # Will auto-adjust after first page retrieved
 refresh_stats = False
+memory_profiling = False # tracemalloc + RSS report per stage, written to reports/ at the end of the run
+page_format = "json" # "json" or "msgpack" (binary, same dict structure, faster to parse when reprocessing)
+page_projection = False # keep only the JSON paths of afklm_projection.projection_spec (full payload for a sample of pages)
+page_codec = "gzip" # "gzip" or "zstd" (dictionary trained with afklm_codecs.py train), existing pages keep their codec
+publish_flights = False # stream every flight as NDJSON to the sink of afklm_flight_stream.py as the pages arrive
+refresh_policy = False # reopen the complete windows worth a refresh today, from the change rate of their route (afklm_refresh_policy.py)
 time_delay_query = 0 # to increase time between queries. If 0, will anyway check for 1.1 seconds between calls
+state_checkpoint_pages = 20 # pages retrieved between two saves of the state CSV (always saved at the end of a query and on failures)
 
 non_parameters = [
     "call_parameters", "response", "message", "timestamp",
-    "nb_of_pages_already_retrieved", "totalPages", "completion", "totalFlights"
+    "nb_of_pages_already_retrieved", "totalPages", "completion", "totalFlights",
+    "retry_count", "next_retry"
 ]
 
 pd.options.mode.chained_assignment = None  # suppress warnings
 
-# configure logger
-
+# configure logger (queue-based, see afklm_logging.py)
 
-console_handler = logging.StreamHandler()
-formatter = logging.Formatter(
-    fmt='[%(levelname)s] %(asctime)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-console_handler.setFormatter(formatter)
-logger = logging.getLogger("extraction_app_logger")
-logger.setLevel(logging.INFO)
+log_handlers = []
 
 try:
-    client = google.cloud.logging.Client(project=PROJECT_ID)
-    cloud_handler = CloudLoggingHandler(client)
-    logger.addHandler(cloud_handler)
+    # the listener and its handlers are kept when the script is re-run in the same process (afklm_collector_daemon.py)
+    if not logging_started():
+        client = google.cloud.logging.Client(project=PROJECT_ID)
+        log_handlers.append(CloudLoggingHandler(client))
 
-    # Initialisation GCS client
-    client_storage = storage.Client()
+    # Initialisation GCS client (the one of afklm_common when it could be created)
+    client_storage = common_client_storage or storage.Client()
     bucket = client_storage.bucket(bucket_name)
 
     # loading envirement variables
@@ -114,41 +135,87 @@ except:
     bucket = None
 
 
-logger.addHandler(console_handler)
-logger.propagate = False
 
 
 
 
 
+### general functions for GCP/local handling
 
+# Cache of the CSV files read / written by the process: {(folder, file): {'generation', 'csv', 'table'}}
+# A file is only downloaded (and parsed) again if its object generation changed since we last read or wrote it.
+# The tables are kept typed (afklm_tables.py), every caller gets a copy in the form read from the CSV.
+table_cache = {}
 
-### general functions for GCP/local handling
 
-def import_csv(path_folder:str,path_file:str, bucket = bucket):
+def table_generation(path_folder:str,path_file:str, bucket = bucket):
     if in_cloud:
-        csv_blob = bucket.blob(path_file)
-        csv_data = csv_blob.download_as_bytes()         
+        csv_blob = bucket.get_blob(path_file)
+        return csv_blob.generation if csv_blob is not None else None
+    
+    try:
+        return os.stat('/'.join([path_folder,path_file])).st_mtime_ns
+    except OSError:
+        return None
 
-        data =  pd.read_csv(BytesIO(csv_data),encoding="utf-8",low_memory=False)
 
-    else:    
+def import_csv(path_folder:str,path_file:str, bucket = bucket):
+    with profile_stage("parameter load"):
+        generation = table_generation(path_folder, path_file, bucket)
+        cached = table_cache.get((path_folder, path_file))
 
-        data =  pd.read_csv('/'.join([path_folder,path_file]),low_memory=False)
-    return data
+        if (generation is not None) and (cached is not None) and (cached['generation'] == generation):
+            # parsed once per generation
+            if 'table' not in cached:
+                cached['table'] = read_table(cached.pop('csv'), path_file)
+            return csv_table(cached['table'], path_file)
 
+        # typed Parquet copy, when it is at least as recent as the CSV
+        read_format, read_file = "csv", path_file
+        if (afklm_tables.table_format == "parquet") and (table_schema(path_file) is not None) and (generation is not None):
+            parquet_generation = table_generation(path_folder, parquet_name(path_file), bucket)
+            if (parquet_generation is not None) and (parquet_generation >= generation):
+                read_format, read_file = "parquet", parquet_name(path_file)
 
-def save_csv(df, path_folder:str,path_file:str, bucket = bucket) -> None:
-    if in_cloud:
+        if in_cloud:
+            csv_blob = bucket.blob(read_file)
+            csv_data = csv_blob.download_as_bytes()         
 
-        csv_blob = bucket.blob(path_file)
-        csv_buffer = BytesIO(bytes(df.to_csv(index=False), encoding='utf-8'))
-        
-        csv_blob.upload_from_string(csv_buffer.getvalue(), content_type="text/csv")
-        # logger.info(f"{path_file} updated")
-       
-    else:    
-        df.to_csv('/'.join([path_folder,path_file]),index = 0)
+        else:    
+            with open('/'.join([path_folder,read_file]), 'rb') as f:
+                csv_data = f.read()
+
+        data = read_table(csv_data, path_file, read_format)
+        table_cache[(path_folder, path_file)] = {'generation': generation, 'table': data}
+    return csv_table(data, path_file)
+
+
+def save_csv(df, path_folder:str,path_file:str, bucket = bucket) -> None:
+    with profile_stage("state save"):
+        csv_data = bytes(df.to_csv(index=False), encoding='utf-8')
+        if in_cloud:
+
+            csv_blob = bucket.blob(path_file)
+            csv_blob.upload_from_string(csv_data, content_type="text/csv")
+            generation = csv_blob.generation
+            # logger.info(f"{path_file} updated")
+           
+        else:    
+            with open('/'.join([path_folder,path_file]), 'wb') as f:
+                f.write(csv_data)
+            generation = table_generation(path_folder, path_file)
+
+        # what we wrote is what the next import_csv of this run reads
+        table_cache[(path_folder, path_file)] = {'generation': generation, 'csv': csv_data}
+
+        # typed Parquet copy, written after the CSV so that its generation is the most recent
+        if (afklm_tables.table_format == "parquet") and (table_schema(path_file) is not None):
+            parquet_data = typed_table(df, table_schema(path_file)).to_parquet(index=False)
+            if in_cloud:
+                bucket.blob(parquet_name(path_file)).upload_from_string(parquet_data, content_type="application/octet-stream")
+            else:
+                with open('/'.join([path_folder,parquet_name(path_file)]), 'wb') as f:
+                    f.write(parquet_data)
     return None
 
 
@@ -172,46 +239,31 @@ def append_to_csv(row, path_folder:str,path_file:str, bucket = bucket) -> None:
         # logger.info(f"{path_file} updated")
 
     else:
-        with open(f"{path_folder + "/" + path_file}","a") as f:
+        with open(f"{path_folder}/{path_file}","a") as f:
             row_new.to_csv(f, header=False,index = 0, lineterminator='\n')
     
     return None
 
 
 
-def info_message(text:str, color:str=None, level_info:str=None) -> None:
+def info_message(text:str, color:str=None, level_info:str=None, sample:str=None, **fields) -> None:
+    
+    # level gating and sampling here, output by the logging thread (console, JSON lines, Cloud Logging)
+    log_message(text, color, level_info, sample, **fields)
     
-    if color is None:
-        print(Fore.RESET + text)
-    else:
-        print(eval(f'Fore.{color.upper()}') + text)
-    '''
-    if in_cloud:
-
-        match level_info:
-            case 'info':
-                logger.info(text)
-            case 'warning':
-                logger.warning(text)
-            case 'error':
-                logger.error(text)
-            case _:
-                logger.info(text)
-    '''
     return None
 
 
 
 
-def list_json_files(path_data_storage:str, bucket = bucket) -> list:
-    if in_cloud:
-        json_list_blobs = client_storage.list_blobs(bucket, prefix=path_data_storage)
-        json_list = [val.name for val in json_list_blobs if 'json' in val.name]
-    
+def list_json_files(path_data_storage:str, bucket = bucket, dates:list = None) -> list:
+    # loose page blobs and pages packed in daily archives (afklm_page_archive.py), names relative to path_data_storage
+    # only the pages of the given days when dates is set (their date= prefixes in the partitioned layout)
+    if dates is None:
+        pages = list_page_files(path_data_storage, bucket = bucket)
     else:
-        json_list = os.listdir(path_data_storage)
-        json_list = [val for val in json_list if 'json' in val]
-
+        pages = list_page_partitions(dates, path_data_storage = path_data_storage, bucket = bucket)
+    json_list = [val['name'] for val in pages]
     
     json_list.sort()
 
@@ -219,40 +271,36 @@ def list_json_files(path_data_storage:str, bucket = bucket) -> list:
 
 
 
-def save_and_compress_json(path_data_storage:str,json_to_make:str, bucket = bucket) -> None:
+def save_and_compress_json(path_data_storage:str,json_to_make:str, data:dict, bucket = bucket) -> str:
+
+    # page serialized with page_format and compressed with page_codec (see afklm_codecs.py), returns the stored file name
+    file_name = json_to_make.removesuffix(".json") + page_extension(page_format, page_codec)
+    path_file = page_path(file_name) # under its date=/route= prefix in the partitioned layout (afklm_common.page_layout)
+    with profile_stage("encode"):
+        payload = encode_page(project_page(data, file_name) if page_projection else data, page_codec, page_format)
 
     if in_cloud:
 
-        gzip_blob_name = f"{path_data_storage}/{json_to_make}.gz"    
-        gzip_blob = bucket.blob(gzip_blob_name)
-        buffer=BytesIO()
-        with gzip.GzipFile(fileobj=buffer, mode='wb') as gzip_file:
-            gzip_file.write(json.dumps(data,ensure_ascii=False,indent=4).encode("utf-8"))
-        
-        gzip_blob.upload_from_file(BytesIO(buffer.getvalue()))
-        # logger.info(f"blob:'{gzip_blob_name}' uploaded")
+        blob = bucket.blob(f"{path_data_storage}/{path_file}")
+        with profile_stage("upload"):
+            blob.upload_from_file(BytesIO(payload))
+        register_file(path_data_storage, path_file, blob.size, blob.generation)
+        # logger.info(f"blob:'{path_data_storage}/{path_file}' uploaded")
 
     else:
-        with gzip.open(f"{path_data_storage}/{json_to_make}.gz", 'wt', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.makedirs(os.path.dirname(f"{path_data_storage}/{path_file}"), exist_ok=True)
+        with open(f"{path_data_storage}/{path_file}", 'wb') as f:
+            f.write(payload)
+        register_file(path_data_storage, path_file)
+    page_locations[file_name] = path_file
     
-    return None
-
+    return file_name
 
-def open_json(path_data_storage:str,file_to_open:str, bucket = bucket) -> None:
 
-    if in_cloud:
-
-        gzip_blob_name = f"{path_data_storage}/{json_to_make}.gz"    
-        gzip_blob = bucket.blob(gzip_blob_name)
-        gzip_data = gzip_blob.download_as_bytes()
-        buffer=BytesIO(gzip_data)
-        with gzip.GzipFile(fileobj=buffer) as gz :
-            data = json.load(gz)
+def open_json(path_data_storage:str,file_to_open:str, bucket = bucket) -> dict:
 
-    else:
-        with gzip.open(f"{path_data_storage}/" + file_to_open) as json_file:
-            data = json.load(json_file)
+    # loose blob or ranged read of the archive the page was packed into
+    data = open_page_json(path_data_storage, file_to_open, bucket)
     
     return data
 
@@ -289,10 +337,32 @@ def list_call_parameters(path_call_parameter_file_folder:str, bucket = bucket) -
 
     return call_parameter_csv_list
 
+
+
+def dates_to_process(call_parameter_csv_list:list, dates:list = None, reopen_complete:bool = False) -> list:
+    # days of the windows the loop will query (complete rows skipped), the only page partitions to list
+    if dates is not None:
+        return sorted(dates)
+
+    dates = set()
+    for call_parameter_csv in call_parameter_csv_list:
+        df_call_parameters = import_csv(path_call_parameter_file_folder, call_parameter_csv).fillna('')
+        if skip_complete and (not reopen_complete) and ('completion' in df_call_parameters.columns):
+            df_call_parameters = df_call_parameters[pd.to_numeric(df_call_parameters['completion'], errors='coerce') != 100]
+        dates.update(df_call_parameters['startRange'].astype(str).str[:10])
+
+    return sorted(dates)
+
     
 
 
 
+### Opt-in memory instrumentation of the stages (see afklm_memory_profile.py)
+
+if memory_profiling:
+    start_memory_profiling()
+
+
 ### Working directory adjustments
 
 if not in_cloud:
@@ -309,448 +379,507 @@ if not in_cloud:
     ### Create folder for retrieved data
     os.makedirs(path_data_storage, exist_ok=True)
 
-### List of already retrieved data and parameter CSV files
+# after the working directory change: the JSON lines of path_logs go next to the collected data
+logger = start_logging(log_handlers)
 
-call_parameter_csv_list = list_call_parameters(path_call_parameter_file_folder=path_call_parameter_file_folder,bucket=bucket)
-json_list = list_json_files(path_data_storage,bucket)
 
 
 
-### To update with functions that append results
+def run_collection(daily_steps:bool = True, dates:list = None, reopen_complete:bool = False, retries_only:bool = False) -> None:
+    # One collection run; the module state (CSV cache, clients, logging) is kept between the runs of a process
+    # (afklm_collector_daemon.py). daily_steps: date extension and refresh planning, dates: only the windows of
+    # these days, reopen_complete: complete rows queried again for the page kind of today, retries_only: only
+    # the queries whose retry is due.
 
+    ### List of already retrieved data and parameter CSV files
 
-if add_new_dates_csv_parameters :
-    for call_parameter_csv in call_parameter_csv_list:
+    with profile_stage("listing"):
+        call_parameter_csv_list = list_call_parameters(path_call_parameter_file_folder=path_call_parameter_file_folder,bucket=bucket)
 
 
-    
-    ### Update with new dates when all pages of current parameter file retrieved or failed
-        info_message(f"adding missing dates to {call_parameter_csv}")
 
-        df_call_parameters = import_csv(path_folder = path_call_parameter_file_folder, path_file = call_parameter_csv).fillna('').sort_values(['endRange','completion'])
-        
-        df_call_parameters_root = df_call_parameters.drop(non_parameters,axis =1 ,errors='ignore').drop_duplicates()
-        
-        params = list(df_call_parameters_root.columns)
-        params.remove('startRange')
-        params.remove('endRange')
-        
-        df_call_parameters_root = df_call_parameters_root.drop('startRange',axis=1).groupby(params).max().reset_index()
-        
-        for index, row in df_call_parameters_root.iterrows():
-            
-            endRange = str(row.endRange)
-            endRange = endRange.replace('Z','')
-
-            
-            while ((datetime.datetime.fromisoformat(endRange).date() - datetime.datetime.now().date() ).days) < future_days_to_retrieve :
-            
-                row_new =  df_call_parameters_root.iloc[[index]].copy()
-                row_new['startRange'] = (datetime.datetime.fromisoformat(endRange) + datetime.timedelta(seconds=1)).isoformat() + "Z"
-                endRange = (datetime.datetime.fromisoformat(endRange) + datetime.timedelta(days=1)).isoformat()
-                row_new['endRange'] = endRange + "Z"
-                
-
-                df_call_parameters = pd.concat([df_call_parameters, row_new], ignore_index=True)
-
-                endRange = row_new['endRange'].item().replace('Z','')
-                
-        
-        save_csv(df_call_parameters,
-            path_folder = path_call_parameter_file_folder,
-            path_file = call_parameter_csv)
+    ### To update with functions that append results
 
 
-        info_message(f"adding missing dates to {call_parameter_csv} over")
-        
+    if add_new_dates_csv_parameters & daily_steps:
+        for call_parameter_csv in call_parameter_csv_list:
+
+            # broad queries are only written by afklm_query_planner.py, for the route-days it covers
+            if call_parameter_csv == planned_parameter_file:
+                continue
 
 
 
+        ### Update with new dates when all pages of current parameter file retrieved or failed
+            info_message(f"adding missing dates to {call_parameter_csv}")
 
-### Load API keys
+            df_call_parameters = import_csv(path_folder = path_call_parameter_file_folder, path_file = call_parameter_csv).fillna('').sort_values(['endRange','completion'])
 
+            df_call_parameters_root = df_call_parameters.drop(non_parameters,axis =1 ,errors='ignore').drop_duplicates()
 
+            params = list(df_call_parameters_root.columns)
+            params.remove('startRange')
+            params.remove('endRange')
 
+            df_call_parameters_root = df_call_parameters_root.drop('startRange',axis=1).groupby(params).max().reset_index()
 
-if in_cloud:
+            # all the missing daily windows at once (dates parsed once per column, see afklm_tables.py)
+            with profile_stage("date extension"):
+                df_call_parameters = pd.concat([df_call_parameters, extend_date_ranges(df_call_parameters_root, future_days_to_retrieve)], ignore_index=True)
+
+
+            save_csv(df_call_parameters,
+                path_folder = path_call_parameter_file_folder,
+                path_file = call_parameter_csv)
 
-    API_key_file_list = list_api_files(api_key_list_folder=api_key_list_folder,bucket=bucket)[0]
-    API_key_list_cleaned = import_csv(path_folder = api_key_list_folder,path_file = API_key_file_list)
 
+            info_message(f"adding missing dates to {call_parameter_csv} over")
 
 
-    api_key_list = os.getenv("API_KEYS")
 
-    api_key_list = api_key_list_test.split(',')
 
-    for key in api_key_list_test:
-        key_desc = key.split(":")[0]
-        key_value = key.split(":")[1]
 
-        API_key_list_cleaned["api_key"] = API_key_list_cleaned.apply(
-            lambda row: key_value
-            if row["key_desc"] == key_desc
-            else row["api_key"],
+    ### Load API keys
+
+
+
+
+    if in_cloud:
+
+        API_key_file_list = list_api_files(api_key_list_folder=api_key_list_folder,bucket=bucket)[0]
+        API_key_list_cleaned = import_csv(path_folder = api_key_list_folder,path_file = API_key_file_list)
+
+
+
+        api_key_list = os.getenv("API_KEYS")
+
+        api_key_list = api_key_list_test.split(',')
+
+        for key in api_key_list_test:
+            key_desc = key.split(":")[0]
+            key_value = key.split(":")[1]
+
+            API_key_list_cleaned["api_key"] = API_key_list_cleaned.apply(
+                lambda row: key_value
+                if row["key_desc"] == key_desc
+                else row["api_key"],
+                axis=1,
+            )
+    else:
+
+
+        API_key_list_cleaned = pd.DataFrame()
+        for file in os.listdir(api_key_list_folder):
+            if file.endswith(".csv"):
+                API_key_list = import_csv(api_key_list_folder, file)
+                API_key_list_cleaned = pd.concat([API_key_list_cleaned, API_key_list], ignore_index=True)
+
+        API_key_list_cleaned = (
+            API_key_list_cleaned.sort_values("timestamp")
+            .drop_duplicates(subset="key_desc", keep="last")
+        )
+
+        API_key_list_cleaned["timestamp"] = API_key_list_cleaned["timestamp"].fillna(datetime.datetime.now().isoformat())
+
+        API_key_list_cleaned["nb_calls_today"] = API_key_list_cleaned.apply(
+            lambda row: 0
+            if (datetime.datetime.now().date() - datetime.datetime.fromisoformat(row["timestamp"]).date()).days > 0
+            else row["nb_calls_today"],
+            axis=1,
+        )
+        API_key_list_cleaned["timestamp"] = API_key_list_cleaned.apply(
+            lambda row: datetime.datetime.now().isoformat()
+            if (datetime.datetime.now().date() - datetime.datetime.fromisoformat(row["timestamp"]).date()).days > 0
+            else row["timestamp"],
             axis=1,
         )
-else:
 
 
-    API_key_list_cleaned = pd.DataFrame()
-    for file in os.listdir(api_key_list_folder):
-        if file.endswith(".csv"):
-            API_key_list = import_csv(api_key_list_folder, file)
-            API_key_list_cleaned = pd.concat([API_key_list_cleaned, API_key_list], ignore_index=True)
 
-    API_key_list_cleaned = (
-        API_key_list_cleaned.sort_values("timestamp")
-        .drop_duplicates(subset="key_desc", keep="last")
-    )
 
-    API_key_list_cleaned["timestamp"] = API_key_list_cleaned["timestamp"].fillna(datetime.datetime.now().isoformat())
+    ### Refresh of the complete windows of today, within the calls left on the keys
+    if refresh_policy & daily_steps:
+        nb_calls_left = (max_daily_api_call - pd.to_numeric(API_key_list_cleaned['nb_calls_today'], errors='coerce').fillna(0)).clip(lower=0).sum()
+        plan_refreshes(int(nb_calls_left))
 
-    API_key_list_cleaned["nb_calls_today"] = API_key_list_cleaned.apply(
-        lambda row: 0
-        if (datetime.datetime.now().date() - datetime.datetime.fromisoformat(row["timestamp"]).date()).days > 0
-        else row["nb_calls_today"],
-        axis=1,
-    )
-    API_key_list_cleaned["timestamp"] = API_key_list_cleaned.apply(
-        lambda row: datetime.datetime.now().isoformat()
-        if (datetime.datetime.now().date() - datetime.datetime.fromisoformat(row["timestamp"]).date()).days > 0
-        else row["timestamp"],
-        axis=1,
-    )
 
+    ### Pages already retrieved, listed for the days still to query only (after the date extension and the refreshes)
+    with profile_stage("listing"):
+        json_list = list_json_files(path_data_storage, bucket, dates_to_process(call_parameter_csv_list, dates, reopen_complete))
+        page_catalog = build_page_catalog(json_list)
 
 
+    last_call_time = datetime.datetime.now()
+    char = " "
+    backed_up_csv = set()
 
 
 
-last_call_time = datetime.datetime.now()
-char = " "
+    for index, record in API_key_list_cleaned.iterrows():
 
 
 
-for index, record in API_key_list_cleaned.iterrows():
-    
-    
-        
-    API_key = record['api_key']
-    nb_calls_today = record['nb_calls_today']
-    key_desc = record['key_desc']
+        API_key = record['api_key']
+        nb_calls_today = record['nb_calls_today']
+        key_desc = record['key_desc']
 
-    
-    
-    print("")
-    info_message(f"{key_desc}")
-    
-    if nb_calls_today == max_daily_api_call:
-        info_message(f"-> Daily call quota reached. Trying next API key",color='yellow',level_info='warning')
-        
-        continue
-    
-    info_message(f"{max_daily_api_call - nb_calls_today} / 100 API calls left for today",'green')
-    print("")
-    for call_parameter_csv in call_parameter_csv_list:
 
-        
-        
-        info_message("#"*90+ "\n"+call_parameter_csv+ "\n"+"#"*90+ "\n")
 
-        
-        ### Import query parameters
-        df_call_parameters = import_csv(
-            path_call_parameter_file_folder ,call_parameter_csv
-        ).fillna('')
-
-        call_parameters_list = []
-
-        for i in range(len(df_call_parameters)):
-            df_subset_parameter = df_call_parameters.iloc[[i]].to_dict(orient="list")
-            call_parameters_url = "&".join(
-                [key + "=" + str(val[0]) for key, val in df_subset_parameter.items()
-                if val[0] != '' and val[0] != '[nan]']
-            )
-            call_parameters_list.append(call_parameters_url)
+        info_message("")
+        info_message(f"{key_desc}")
 
-        df_call_parameters['call_parameters'] = call_parameters_list
-        
+        if nb_calls_today == max_daily_api_call:
+            info_message(f"-> Daily call quota reached. Trying next API key",color='yellow',level_info='warning')
 
-        ### Loading API keys to use
-        
-        
+            continue
+
+        info_message(f"{max_daily_api_call - nb_calls_today} / 100 API calls left for today",'green')
+        retry_calls = 0
+        retry_calls_max = retry_budget(max_daily_api_call - nb_calls_today)
+        info_message("")
+        for call_parameter_csv in call_parameter_csv_list:
+
+
+
+            info_message("#"*90+ "\n"+call_parameter_csv+ "\n"+"#"*90+ "\n")
+
+
+            ### Import query parameters
+            df_call_parameters = import_csv(
+                path_call_parameter_file_folder ,call_parameter_csv
+            ).fillna('')
+
+            call_parameters_list = []
+
+            for i in range(len(df_call_parameters)):
+                df_subset_parameter = df_call_parameters.iloc[[i]].to_dict(orient="list")
+                call_parameters_url = "&".join(
+                    [key + "=" + str(val[0]) for key, val in df_subset_parameter.items()
+                    if val[0] != '' and val[0] != '[nan]']
+                )
+                call_parameters_list.append(call_parameters_url)
+
+            df_call_parameters['call_parameters'] = call_parameters_list
 
-        ### Definition of base URLs for API call
-        base_url = "https://api.airfranceklm.com/opendata/flightstatus/?"
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-
-        ### Definition of default parameters for API call
-        dict_call_parameters = {
-            "aircraftRegistration": '',  # string Registration code of the aircraft
-            "aircraftType": '',  # string Filter by a type of aircraft
-            "arrivalCity": '',  # string Filter by airport code of arrival city
-            "carrierCode": [],  # array[string] Airline code
-            "consumerHost": '',  # string System info from which request is launched
-            "departureCity": '',  # string IATA departure city code
-            "destination": '',  # string Destination airport
-            "flightNumber": '',  # string Filter by flight number
-            "movementType": '',  # string Focus (Departure/Arrival)
-            "operatingAirlineCode": [],  # array[string] Operating airline code
-            "operationalSuffix": '',  # string Operational suffix
-            "origin": '',  # string Departure airport
-            "serviceType": [],  # array[string] IATA service type code
-            "timeOriginType": '',  # string S/M/I/P
-            "timeType": '',  # string U/L
-            "endRange": '2025-07-23T23:59:59Z',  # string<date-time>
-            "startRange": '2025-07-21T09:00:00Z',  # string<date-time>
-            "call_parameters": '',  # repopulated after request
-            'response': '',  # repopulated after request
-            'message': '',  # repopulated after request
-            'timestamp': '',  # repopulated after request
-            'nb_of_pages_already_retrieved': '',  # repopulated after request
-            'totalPages': '',  # repopulated after request
-            'completion': ''  # repopulated after request
-        }
-
-        dict_call_parameters["carrierCode"] = ",".join(dict_call_parameters['carrierCode'])
-        dict_call_parameters["operatingAirlineCode"] = ",".join(dict_call_parameters['operatingAirlineCode'])
-        dict_call_parameters["serviceType"] = ",".join(dict_call_parameters['serviceType'])
-
-        df_call_parameters_defaults = pd.DataFrame(dict_call_parameters, index=[0])  # from defaults
-
-        try:
-            df_call_parameters = import_csv(path_call_parameter_file_folder,call_parameter_csv).fillna('')
-            save_csv(df_call_parameters,
-            path_folder = path_call_parameter_file_folder,
-            path_file = call_parameter_csv.replace(".csv",".bak"))
 
-        except:
+            ### Loading API keys to use
+
+
+
+            ### Definition of base URLs for API call
+            base_url = "https://api.airfranceklm.com/opendata/flightstatus/?"
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+            ### Definition of default parameters for API call
+            dict_call_parameters = {
+                "aircraftRegistration": '',  # string Registration code of the aircraft
+                "aircraftType": '',  # string Filter by a type of aircraft
+                "arrivalCity": '',  # string Filter by airport code of arrival city
+                "carrierCode": [],  # array[string] Airline code
+                "consumerHost": '',  # string System info from which request is launched
+                "departureCity": '',  # string IATA departure city code
+                "destination": '',  # string Destination airport
+                "flightNumber": '',  # string Filter by flight number
+                "movementType": '',  # string Focus (Departure/Arrival)
+                "operatingAirlineCode": [],  # array[string] Operating airline code
+                "operationalSuffix": '',  # string Operational suffix
+                "origin": '',  # string Departure airport
+                "serviceType": [],  # array[string] IATA service type code
+                "timeOriginType": '',  # string S/M/I/P
+                "timeType": '',  # string U/L
+                "endRange": '2025-07-23T23:59:59Z',  # string<date-time>
+                "startRange": '2025-07-21T09:00:00Z',  # string<date-time>
+                "call_parameters": '',  # repopulated after request
+                'response': '',  # repopulated after request
+                'message': '',  # repopulated after request
+                'timestamp': '',  # repopulated after request
+                'nb_of_pages_already_retrieved': '',  # repopulated after request
+                'totalPages': '',  # repopulated after request
+                'completion': ''  # repopulated after request
+            }
+
+            dict_call_parameters["carrierCode"] = ",".join(dict_call_parameters['carrierCode'])
+            dict_call_parameters["operatingAirlineCode"] = ",".join(dict_call_parameters['operatingAirlineCode'])
+            dict_call_parameters["serviceType"] = ",".join(dict_call_parameters['serviceType'])
+
+            df_call_parameters_defaults = pd.DataFrame(dict_call_parameters, index=[0])  # from defaults
+
             try:
-                df_call_parameters = import_csv(path_call_parameter_file_folder,call_parameter_csv.replace(".csv",".bak")).fillna('')
-                save_csv(df_call_parameters,
+                df_call_parameters = import_csv(path_call_parameter_file_folder,call_parameter_csv).fillna('')
+                # one backup per file and per run, before its first query
+                if call_parameter_csv not in backed_up_csv:
+                    save_csv(df_call_parameters,
                     path_folder = path_call_parameter_file_folder,
-                    path_file = call_parameter_csv)
+                    path_file = call_parameter_csv.replace(".csv",".bak"))
+                    backed_up_csv.add(call_parameter_csv)
+
             except:
-                df_call_parameters = df_call_parameters_defaults
-        
+                try:
+                    df_call_parameters = import_csv(path_call_parameter_file_folder,call_parameter_csv.replace(".csv",".bak")).fillna('')
+                    save_csv(df_call_parameters,
+                        path_folder = path_call_parameter_file_folder,
+                        path_file = call_parameter_csv)
+                except:
+                    df_call_parameters = df_call_parameters_defaults
 
 
 
-        info_message( f"Max number of pages to retrieve: {max_page_to_fetch} ")
 
+            info_message( f"Max number of pages to retrieve: {max_page_to_fetch} ")
 
-        info_message( f"Number of API call parameters to process = {len(df_call_parameters)}")
 
-            
-    
-        i = 0
-        df_call_parameters_new = df_call_parameters.copy(deep=True)  # to update the CSV after each query
+            info_message( f"Number of API call parameters to process = {len(df_call_parameters)}")
 
 
 
-        ### Loop over the CSV file containing the parameter list to send to the API
-        for i in range(0, len(df_call_parameters)):
-            to_test = float(df_call_parameters.iloc[[i]]['completion'].replace('','0').item())
-            
-            if skip_complete & (to_test == 100):
-                continue
-            print("")
-            df_subset = df_call_parameters.iloc[[i]].copy(deep=True).reset_index().drop(['index'], axis=1)
-            pageNumber = pageNumberStart  # first page is 1; page 0 returns same results
-
-            ### Check if query parameter already tested and skip previously failed if chosen
-            text_response = str(df_subset['response'])
-            match_error = re.search("\\d\\d\\d", text_response)
-            if match_error is None:
-                match_error = "000"
-            else:
-                match_error = match_error[0]
+            # one record per row, updated in place and turned back into a DataFrame only to save the CSV
+            query_states = query_states_from_table(df_call_parameters, non_parameters)
 
-            ### Cleaning of empty parameter calls
-            parameter_list = df_subset.drop(non_parameters, axis=1, errors='ignore').columns.to_list()
-            dict_call_parameters = df_subset.drop(non_parameters, axis=1, errors='ignore').to_dict(orient="list")
-            call_parameters_url = "&".join([key + "=" + str(val[0])
-                                            for key, val in dict_call_parameters.items()
-                                            if val[0] != '' and val[0] != '[nan]'])
 
-            info_message(f"{call_parameters_url}")
 
-            
+            ### Loop over the CSV file containing the parameter list to send to the API
+            for query in query_states:
+                to_test = float(query.completion if query.completion != '' else 0)
 
-            if skip_previously_failed_serverError & int(match_error) > 200:
-                if int(match_error) >= 500:
-                    message = f"skipped because previously failed due to server error"
+                if skip_complete & (to_test == 100) & (not reopen_complete):
+                    continue
 
-                if int(match_error) == 404:
-                    message = f"skipped because previously obtained 'FLIGHT NOT FOUND'"
-                
-                if int(match_error) > 200:
-                    message = f"skipped because previously obtained another error"
+                if (dates is not None) and (str(query.parameters['startRange'])[:10] not in dates):
+                    continue
 
-                info_message(f"skipped because previously failed due to server error",'magenta','warning')
-                continue
-                
-            
+                # route-days retrieved through a broad query of afklm_query_planner.py
+                if covered_by_plan(query.message):
+                    continue
+                info_message("")
+                pageNumber = pageNumberStart  # first page is 1; page 0 returns same results
+
+                ### Check if query parameter already tested and skip previously failed if chosen (unless a retry is due)
+                skip_query, retry_message = retry_decision(
+                    query.response,
+                    query.retry_count,
+                    query.next_retry,
+                    skip_failed = {
+                        "server_error": skip_previously_failed_serverError,
+                        "rate_limited": skip_previously_failed_serverError,
+                        "flight_not_found": skip_previously_failed_flightNotFound,
+                        "other_error": skip_previously_failed_otherErrors,
+                    })
+                is_retry = (retry_message != "") & (not skip_query)
+
+                if retries_only & (not is_retry):
+                    continue
 
-            url = (base_url + call_parameters_url).replace(" ", "")
+                ### Cleaning of empty parameter calls
+                call_parameters_url = "&".join([key + "=" + str(val)
+                                                for key, val in query.parameters.items()
+                                                if val != '' and val != '[nan]'])
 
-            ### Check date query coherence
-            if df_subset['endRange'].item() < df_subset['startRange'].item():
-                info_message("ERROR: endRange < startRange",'red','error')
-                break
+                info_message(f"{call_parameters_url}", sample="query")
 
-            ### Loop until desired number of pages or max pages reached
-            while (pageNumber + 1 <= page_max) & (pageNumber + 1 <= max_page_to_fetch) & (nb_calls_today < 101):
-
-                json_to_make_root = f"afklm_api_data_collection_{re.sub(':', '_', call_parameters_url)}"
-                
-                
-                date_diff = (datetime.datetime.fromisoformat(df_subset['startRange'].item()).date() - datetime.datetime.date(datetime.datetime.now())).days
-                
-                if date_diff > 0:
-                    json_to_make = json_to_make_root + f"_{pageNumber}_sched.json"
-                elif date_diff == 0:
-                    json_to_make = json_to_make_root + f"_{pageNumber}_updSchedD1.json"
-                else:
-                    json_to_make = json_to_make_root + f"_{pageNumber}.json"
-                    
-
-                df_totalPages = df_subset['totalPages']
-                df_item = df_subset['totalPages'].item()
-                df_values = df_subset['totalPages'].values
-                time_analysis = datetime.datetime.now().isoformat()
-
-                # Skip current query if file already exists
-                if (json_to_make in json_list) | (json_to_make + '.gz' in json_list):
-                    if df_item == '':
-                        info_message("loading page info from already retrieved files",'blue')
-                        file_to_open = [file for file in json_list if json_to_make in file][0]
-                        data = open_json(path_data_storage,file_to_open,bucket)
-                        page_max = data['page']['totalPages']
-                        df_subset.loc[0, ['totalPages']] = page_max
-                    else:
-                        page_max = df_item
-
-                    info_message(f"Page {pageNumber} : skipped because already retrieved",'blue','info')
-                    if (page_max == pageNumber + 1):
-                        info_message(f"All pages already retrieved",'blue','info')
-                        df_subset.loc[0, ['nb_of_pages_already_retrieved']] = df_subset.loc[0, ['totalPages']].item()
-                        df_subset.loc[0, ['completion']] = 100
-                        df_subset.loc[0, ['timestamp']] = time_analysis
-
-                        df_subset.loc[0, ['call_parameters']] = call_parameters_url
-                        df_call_parameters_new = pd.concat([df_call_parameters_new, df_subset], ignore_index=True)
-                        df_call_parameters_new = df_call_parameters_new.drop_duplicates(subset=parameter_list, keep='last')
-                        df_call_parameters_new = df_call_parameters_new.fillna('').sort_values(['endRange','completion'])
-                        save_csv(
 
-                            
-                            df_call_parameters_new, path_folder=path_call_parameter_file_folder,path_file=call_parameter_csv, bucket = bucket
-                             
-                            )
-                    pageNumber += 1
-                    continue
 
-                # Main API request logic
-                
-                headers['API-Key'] = API_key
-                url_page = (url + f"&{pageNumber=}").replace("?&", "?")
-                
-                
-                while (datetime.datetime.now() - last_call_time).seconds < 1.1:
-                    time.sleep(0.1)
-                    
-                time.sleep(time_delay_query)
-                
-                response = requests.get(url_page, headers=headers)
-                
-                last_call_time = datetime.datetime.now()
-                
-                
-                nb_calls_today = nb_calls_today + 1
-                
-                API_key_list_cleaned['nb_calls_today'] = API_key_list_cleaned.apply(lambda row: nb_calls_today if row['key_desc'] == key_desc else row['nb_calls_today'] , axis=1)
-
-                if in_cloud:
-                    API_key_list_cleaned['api_key'] = API_key_list_cleaned.apply(lambda row: 'SECRET' , axis=1)
-
-                save_csv(API_key_list_cleaned,
-                         path_folder=api_key_list_folder,
-                         path_file="afklm_api_keys.csv",
-                        bucket = bucket)
-                
+                if skip_query:
+                    info_message(retry_message,'magenta','warning')
+                    continue
 
-                
-                df_subset.loc[0, ['timestamp']] = time_analysis
-                df_subset.loc[0, ['call_parameters']] = call_parameters_url
+                if is_retry & (retry_calls >= retry_calls_max):
+                    info_message(f"retry postponed: share of today's calls for retries used",'magenta','warning')
+                    continue
 
-                if response.__bool__():
-                    data = response.json()
-                    page_max = data['page']['totalPages']
-                    fullCount = data['page']['fullCount']
+                if is_retry:
+                    info_message(retry_message,'magenta','warning')
 
-                    save_and_compress_json(path_data_storage,json_to_make, bucket)
-                    
-                    info_message(f"Page {pageNumber} : retrieval OK    Total: {page_max}",'green','info')
 
-                    if df_subset['nb_of_pages_already_retrieved'].item() == '':
-                        df_subset.loc[0, ['nb_of_pages_already_retrieved']] = 0
 
-                    if int(pageNumber + 1) > int(df_subset['nb_of_pages_already_retrieved'].item()):
-                        df_subset.loc[0, ['nb_of_pages_already_retrieved']] = float(f"{(pageNumber+1):.0f}")
+                url = (base_url + call_parameters_url).replace(" ", "")
 
-                    df_subset.loc[0, ['response']] = str(response)
-                    df_subset.loc[0, ['totalPages']] = float(f"{(page_max):.0f}")
-                    df_subset.loc[0, ['totalFlights']] = float(f"{(fullCount):.0f}")
-                    df_subset.loc[0, ['completion']] = float(f"{100*(pageNumber+1)/page_max:.0f}")
-                    df_subset.loc[0, ['message']] = ""
+                ### Check date query coherence
+                if query.parameters['endRange'] < query.parameters['startRange']:
+                    info_message("ERROR: endRange < startRange",'red','error')
+                    break
 
-                    df_call_parameters_new = pd.concat([df_call_parameters_new, df_subset], ignore_index=True)
-                    df_call_parameters_new = df_call_parameters_new.drop_duplicates(subset=parameter_list, keep='last')
-                    df_call_parameters_new = df_call_parameters_new.fillna('')
+                # same startRange for every page of the query
+                date_diff = (datetime.datetime.fromisoformat(query.parameters['startRange']).date() - datetime.datetime.date(datetime.datetime.now())).days
+                kind = page_kind(date_diff)
+                stored = stored_pages(page_catalog, call_parameters_url, kind)
+                if refresh_requested(query.message):
+                    # reopened by the refresh policy: the stored pages of this kind are retrieved again
+                    info_message(f"{query.message}: {len(stored)} stored pages retrieved again",'blue','info')
+                    stored = {}
+
+                ### Pages still missing for this query, from the catalog and the state instead of walking the retrieved ones
+                total_pages = known_total_pages(query.totalPages)
+                if (total_pages is None) & (len(stored) > 0):
+                    info_message("loading page info from already retrieved files",'blue')
+                    data = open_json(path_data_storage,next(iter(stored.values())),bucket)
+                    total_pages = data['page']['totalPages']
+                    query.totalPages = total_pages
+
+                if len(stored) > 0:
+                    info_message(f"{len(stored)} pages skipped because already retrieved",'blue','info')
+
+                if (total_pages is not None) and (len(missing_pages(stored, total_pages, pageNumberStart)) == 0):
+                    info_message(f"All pages already retrieved",'blue','info')
+                    query.nb_of_pages_already_retrieved = query.totalPages
+                    query.completion = 100
+                    query.timestamp = datetime.datetime.now().isoformat()
+
+                    query.call_parameters = call_parameters_url
                     save_csv(
-                        df_call_parameters_new, path_folder=path_call_parameter_file_folder,path_file=call_parameter_csv,
-                        bucket = bucket)
+                        query_table(query_states, df_call_parameters.columns), path_folder=path_call_parameter_file_folder,path_file=call_parameter_csv, bucket = bucket
+                        )
+                    continue
+
+                pageNumber = next_missing_page(stored, total_pages, pageNumberStart, max_page_to_fetch)
+                rate_limited_calls = 0  # consecutive 429 on the current page
+                pages_since_checkpoint = 0  # pages of the query stored since the last save of the state CSV
+
+                ### Loop over the missing pages (holes left by earlier failures included) until max pages reached
+                while (pageNumber is not None) & (nb_calls_today < 101):
+
+                    json_to_make = page_file_name(call_parameters_url, pageNumber, kind)
+                    time_analysis = datetime.datetime.now().isoformat()
+
+                    # rotate before the key is exhausted when the gateway headers tell its remaining quota
+                    if quota_nearly_exhausted(key_desc):
+                        info_message("API daily quota nearly consumed according to the gateway, switching key",'yellow','warning')
+                        nb_calls_today = 100
+                        API_key_list_cleaned['nb_calls_today'] = API_key_list_cleaned.apply(lambda row: 100 if row['key_desc'] == key_desc else row['nb_calls_today'] , axis=1)
+                        save_csv(API_key_list_cleaned, api_key_list_folder, "afklm_api_keys.csv")
+                        break
+
+                    # Main API request logic
 
+                    headers['API-Key'] = API_key
+                    url_page = (url + f"&{pageNumber=}").replace("?&", "?")
 
-                    pageNumber += 1
 
-                elif ("Developer" in response.text):
-                    info_message("API daily quota consumed",'red','warning')
+                    # interval adapted to the allotted QPS of the key and to 429 responses (see afklm_pacing.py)
+                    wait_for_next_call(key_desc, last_call_time, time_delay_query)
 
-                    nb_calls_today = 100
-                    
+                    with profile_stage("fetch"):
+                        response = requests.get(url_page, headers=headers)
 
-                    API_key_list_cleaned['nb_calls_today'] = API_key_list_cleaned.apply(lambda row: 100 if row['key_desc'] == key_desc else row['nb_calls_today'] , axis=1)
-                    API_key_list_cleaned['timestamp'] = API_key_list_cleaned.apply(lambda row: time_analysis if row['key_desc'] == key_desc else row['timestamp'] , axis=1)
+                    last_call_time = datetime.datetime.now()
+                    update_pacing(key_desc, response, response.elapsed.total_seconds())
 
-                    API_key_list_cleaned = API_key_list_cleaned.drop_duplicates(subset='api_key',keep='last')
+                    # server's count of the calls of the key when the gateway returns it
+                    nb_calls_today = server_call_count(key_desc, nb_calls_today + 1)
+                    if is_retry:
+                        retry_calls = retry_calls + 1
+
+                    API_key_list_cleaned['nb_calls_today'] = API_key_list_cleaned.apply(lambda row: nb_calls_today if row['key_desc'] == key_desc else row['nb_calls_today'] , axis=1)
 
                     if in_cloud:
                         API_key_list_cleaned['api_key'] = API_key_list_cleaned.apply(lambda row: 'SECRET' , axis=1)
 
-                    save_csv(API_key_list_cleaned, api_key_list_folder, "afklm_api_keys.csv")
-                    
+                    save_csv(API_key_list_cleaned,
+                             path_folder=api_key_list_folder,
+                             path_file="afklm_api_keys.csv",
+                            bucket = bucket)
 
-                    break
 
-                else:
-                    info_message(f"Issues with the call: {response} {response.text}",'red','warning')
-                    df_subset.loc[0, ['response']] = str(response)
-                    df_subset.loc[0, ['message']] = str(response.text)
-                    df_call_parameters_new = pd.concat([df_call_parameters_new, df_subset], ignore_index=True)
-                    df_call_parameters_new = df_call_parameters_new.drop_duplicates(subset=['call_parameters'], keep='last')
-                    df_call_parameters_new = df_call_parameters_new.fillna('').sort_values(['endRange','completion'])
-                    
+
+                    query.timestamp = time_analysis
+                    query.call_parameters = call_parameters_url
+
+                    if response.__bool__():
+                        data = response.json()
+                        page_max = data['page']['totalPages']
+                        fullCount = data['page']['fullCount']
+
+                        if publish_flights:
+                            publish_page(data, json_to_make, kind, call_parameters_url)
+
+                        stored[pageNumber] = save_and_compress_json(path_data_storage,json_to_make, data, bucket)
+
+                        info_message(f"Page {pageNumber} : retrieval OK    Total: {page_max}",'green','info',
+                                     sample="page", call_parameters=call_parameters_url, page=pageNumber, total_pages=page_max)
+
+                        query.nb_of_pages_already_retrieved = float(f"{len(stored):.0f}")
+                        query.response = str(response)
+                        query.totalPages = float(f"{(page_max):.0f}")
+                        query.totalFlights = float(f"{(fullCount):.0f}")
+                        query.completion = float(f"{100*len(stored)/page_max:.0f}")
+                        query.message = ""
+                        query.retry_count = ''
+                        query.next_retry = ''
+
+                        pageNumber = next_missing_page(stored, page_max, pageNumberStart, max_page_to_fetch)
+                        rate_limited_calls = 0
+
+                        # the stored pages are found again from the catalog if the run stops between two checkpoints
+                        pages_since_checkpoint = pages_since_checkpoint + 1
+                        if (pageNumber is None) or (pages_since_checkpoint >= state_checkpoint_pages):
+                            save_csv(
+                                query_table(query_states, df_call_parameters.columns), path_folder=path_call_parameter_file_folder,path_file=call_parameter_csv,
+                                bucket = bucket)
+                            pages_since_checkpoint = 0
+
+                    elif quota_exhausted(response):
+                        info_message("API daily quota consumed",'red','warning')
+
+                        nb_calls_today = 100
+
+
+                        API_key_list_cleaned['nb_calls_today'] = API_key_list_cleaned.apply(lambda row: 100 if row['key_desc'] == key_desc else row['nb_calls_today'] , axis=1)
+                        API_key_list_cleaned['timestamp'] = API_key_list_cleaned.apply(lambda row: time_analysis if row['key_desc'] == key_desc else row['timestamp'] , axis=1)
+
+                        API_key_list_cleaned = API_key_list_cleaned.drop_duplicates(subset='api_key',keep='last')
+
+                        if in_cloud:
+                            API_key_list_cleaned['api_key'] = API_key_list_cleaned.apply(lambda row: 'SECRET' , axis=1)
+
+                        save_csv(API_key_list_cleaned, api_key_list_folder, "afklm_api_keys.csv")
+
+
+                        break
+
+                    elif (response.status_code == 429) & (rate_limited_calls < max_rate_limited_retries):
+                        rate_limited_calls = rate_limited_calls + 1
+                        info_message(f"Rate limited: page {pageNumber} retried after backoff ({rate_limited_calls}/{max_rate_limited_retries})",'yellow','warning')
+                        continue
+
+                    else:
+                        # failed calls, and pages still rate limited after max_rate_limited_retries attempts
+                        info_message(f"Issues with the call: {response} {response.text}",'red','warning',
+                                     call_parameters=call_parameters_url, page=pageNumber, status=response.status_code)
+                        query.response = str(response)
+                        query.message = str(response.text)
+
+                        # transient failures are rescheduled in a later run instead of being skipped forever
+                        retry_count, next_retry = schedule_retry(response.status_code, query.retry_count)
+                        query.retry_count = retry_count
+                        query.next_retry = next_retry
+                        if next_retry != '':
+                            info_message(f"retry {retry_count} scheduled at {next_retry}",'yellow','warning')
+                        save_csv(
+                            query_table(query_states, df_call_parameters.columns), path_folder=path_call_parameter_file_folder,path_file=call_parameter_csv,
+                            bucket = bucket)
+                        pages_since_checkpoint = 0
+                        break
+
+                # pages retrieved before a quota stop
+                if pages_since_checkpoint > 0:
                     save_csv(
-                        df_call_parameters_new, path_folder=path_call_parameter_file_folder,path_file=call_parameter_csv,
+                        query_table(query_states, df_call_parameters.columns), path_folder=path_call_parameter_file_folder,path_file=call_parameter_csv,
                         bucket = bucket)
+
+                if nb_calls_today == 100:
                     break
-            
-            if nb_calls_today == 100:
+
+            if nb_calls_today >= max_daily_api_call:
                 break
 
-        
-            
+        save_telemetry()
+
+
+    save_memory_report()
+    if publish_flights:
+        stop_stream()
+    flush_logging()
+
+
 
+if __name__ == "__main__":
+    run_collection()
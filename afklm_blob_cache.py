@@ -0,0 +1,173 @@
+"""
+Local read-through disk cache of the GCS blobs, bounded in size with LRU eviction.
+
+afklm_common.read_bytes / read_range go through this cache in the cloud:
+- entries are keyed by blob name and generation as known from the listings (or the writes of this process),
+  so a blob rewritten by another process is only seen once the listing is refreshed. Reads of a blob whose
+  generation is not known are not cached.
+- a ranged read (page of an archive) caches the range only, unless cache_whole_archives is set
+- the cache directory is bounded to cache_max_bytes, least recently used entries evicted first
+- hits, misses, downloaded / served bytes and evictions are counted in cache_stats
+
+Entries are files named <sha1 of the blob name>_<generation>[_<start>_<length>], written atomically, so several
+processes can share the cache directory.
+
+Usage:
+    python afklm_blob_cache.py [stats|clear]
+"""
+
+### Library import
+import collections
+import hashlib
+import mmap
+import os
+import sys
+import threading
+
+
+### Script parameters
+cache_enabled = True
+cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "afklm_blobs")
+cache_max_bytes = 2 * 1024**3
+cache_whole_archives = False  # a ranged read of an archive not cached yet downloads (and caches) the whole archive
+
+cache_stats = {'hits': 0, 'misses': 0, 'bytes_served': 0, 'bytes_downloaded': 0, 'evictions': 0}
+cache_index = None  # OrderedDict entry file -> size, least recently used first
+cache_lock = threading.Lock()
+
+
+
+def entry_file(blob_name:str, generation, start:int = None, length:int = None) -> str:
+    blob_range = f"_{start}_{length}" if start is not None else ""
+    return f"{hashlib.sha1(blob_name.encode()).hexdigest()}_{generation}{blob_range}"
+
+
+def load_index() -> collections.OrderedDict:
+    global cache_index
+    if cache_index is None:
+        os.makedirs(cache_dir, exist_ok=True)
+        entries = [entry for entry in os.scandir(cache_dir) if entry.is_file() and not entry.name.endswith(".tmp")]
+        entries.sort(key=lambda entry: entry.stat().st_atime)
+        cache_index = collections.OrderedDict((entry.name, entry.stat().st_size) for entry in entries)
+    return cache_index
+
+
+def evict(needed:int = 0) -> None:
+    index = load_index()
+    total = sum(index.values())
+    while index and total + needed > cache_max_bytes:
+        name, size = index.popitem(last=False)
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
+        total -= size
+        cache_stats['evictions'] += 1
+    return None
+
+
+def get(blob_name:str, generation, start:int = None, length:int = None) -> bytes:
+    # Cached content (or the range start:start+length of it, from the whole blob or the range entry), None on a miss
+    if generation is None:
+        return None
+    name = entry_file(blob_name, generation)
+    with cache_lock:
+        index = load_index()
+        if name not in index and start is not None and entry_file(blob_name, generation, start, length) in index:
+            name, start = entry_file(blob_name, generation, start, length), None
+        if name not in index:
+            cache_stats['misses'] += 1
+            return None
+        index.move_to_end(name)
+        cache_stats['hits'] += 1
+
+    path = os.path.join(cache_dir, name)
+    try:
+        os.utime(path)
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                payload = mm[start:start + length] if start is not None else mm[:]
+    except OSError:
+        # evicted by another process sharing the cache directory
+        with cache_lock:
+            load_index().pop(name, None)
+            cache_stats['hits'] -= 1
+            cache_stats['misses'] += 1
+        return None
+    cache_stats['bytes_served'] += len(payload)
+    return payload
+
+
+def put(blob_name:str, generation, payload:bytes, start:int = None, length:int = None) -> None:
+    if generation is None or len(payload) > cache_max_bytes:
+        return None
+    name = entry_file(blob_name, generation, start, length)
+    path = os.path.join(cache_dir, name)
+    with cache_lock:
+        evict(len(payload))
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        load_index()[name] = len(payload)
+        cache_stats['bytes_downloaded'] += len(payload)
+    return None
+
+
+def cached_download(blob, generation = None, start:int = None, length:int = None) -> bytes:
+    # Read-through download of a google.cloud.storage blob (or of the range start:start+length of it)
+    if not cache_enabled:
+        if start is not None:
+            return blob.download_as_bytes(start=start, end=start + length - 1)
+        return blob.download_as_bytes()
+
+    # generation not known: the entry could never be looked up
+    if generation is None:
+        if start is not None:
+            return blob.download_as_bytes(start=start, end=start + length - 1)
+        return blob.download_as_bytes()
+
+    payload = get(blob.name, generation, start, length)
+    if payload is not None:
+        return payload
+
+    # cached under the generation actually downloaded (the blob may have been rewritten since it was listed)
+    if start is not None and not cache_whole_archives:
+        payload = blob.download_as_bytes(start=start, end=start + length - 1)
+        put(blob.name, blob.generation or generation, payload, start, length)
+        return payload
+
+    content = blob.download_as_bytes()
+    put(blob.name, blob.generation or generation, content)
+    return content[start:start + length] if start is not None else content
+
+
+def clear_cache() -> None:
+    global cache_index
+    with cache_lock:
+        for name in list(load_index()):
+            os.remove(os.path.join(cache_dir, name))
+        cache_index = None
+    return None
+
+
+def cache_summary() -> dict:
+    index = load_index()
+    lookups = cache_stats['hits'] + cache_stats['misses']
+    return cache_stats | {
+        'entries': len(index),
+        'cached_bytes': sum(index.values()),
+        'hit_rate': round(cache_stats['hits'] / lookups, 3) if lookups else None,
+    }
+
+
+def main():
+    if sys.argv[1:] == ["clear"]:
+        clear_cache()
+    print(cache_summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Pluggable formats and codecs for the stored pages.
+
+Format (serialization): JSON text (default) or MessagePack, which keeps the same dict structure but is parsed
+several times faster than JSON by every consumer re-reading the pages.
+Codec (compression): gzip (default) or zstd with a dictionary trained on our own pages.
+
+Flight-status pages repeat the same keys, airport and carrier structures, which a zstd dictionary trained on
+a sample of stored pages captures much better than gzip on each small page. Dictionaries are versioned next
+to the data (path_codecs/zstd_dict_<dict_id>.bin): the dictionary id is written in every zstd frame, so a page
+is always decoded with the dictionary it was encoded with, whatever the current one. The ids are content
+hashes, not counters: the current dictionary is the one named in path_codecs/zstd_dict_latest.txt, read again
+every latest_dictionary_max_age seconds so that a long-running process (afklm_collector_daemon.py) picks up a
+dictionary trained elsewhere.
+
+decode_page detects the codec from the magic bytes (gzip, zstd or none) and the format from the first byte of the
+payload (a JSON page starts with '{'), so old .json.gz pages keep opening whatever the current settings.
+File names end with <format extension><codec extension>, e.g. _0.msgpack.zst.
+zstandard and msgpack are only needed to write or read the pages using them.
+
+Usage:
+    python afklm_codecs.py train  # trains a new dictionary and compares it with gzip on the sample
+    python afklm_codecs.py benchmark  # size and parse time of every format / codec on a sample of pages
+"""
+
+### Library import
+import pandas as pd
+import gzip
+import json
+import random
+import sys
+import time
+
+from afklm_common import info_message, list_files, list_json_files, read_bytes, read_page_bytes, write_bytes, path_data_storage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+### Script parameters
+path_codecs = "codecs"
+zstd_level = 19
+zstd_dict_size = 112640
+training_sample_size = 2000
+json_indent = 4  # indentation of the stored JSON, as written by the collector
+
+magic_bytes = {
+    "gzip": b'\x1f\x8b',
+    "zstd": b'\x28\xb5\x2f\xfd',
+}
+codec_extensions = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+format_extensions = {"json": ".json", "msgpack": ".msgpack"}
+latest_dictionary_file = "zstd_dict_latest.txt"
+latest_dictionary_max_age = 3600  # seconds before the pointer file is read again
+
+dictionaries = {}  # dict_id -> zstandard.ZstdCompressionDict, None -> current one (None when not trained yet)
+latest_checked_at = None  # time.monotonic() of the last read of the pointer file
+
+
+
+def detect_codec(payload:bytes) -> str:
+    for codec, magic in magic_bytes.items():
+        if payload.startswith(magic):
+            return codec
+    return "none"
+
+
+def page_extension(page_format:str = "json", codec:str = "gzip") -> str:
+    return format_extensions[page_format] + codec_extensions[codec]
+
+
+def serialize(data:dict, page_format:str = "json") -> bytes:
+    if page_format == "msgpack":
+        return msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data, ensure_ascii=False, indent=json_indent).encode("utf-8")
+
+
+def detect_format(payload:bytes) -> str:
+    # format of a decompressed page
+    return "json" if payload.lstrip()[:1] in (b'{', b'[') else "msgpack"
+
+
+def deserialize(payload:bytes):
+    if detect_format(payload) == "json":
+        return json.loads(payload)
+    return msgpack.unpackb(payload, raw=False)
+
+
+def load_dictionary(dict_id:int = None):
+    # Dictionary with the given id, or the latest trained one when dict_id is None
+    global latest_checked_at
+    if dict_id is not None:
+        if dict_id not in dictionaries:
+            dictionaries[dict_id] = zstandard.ZstdCompressionDict(read_bytes(path_codecs, f"zstd_dict_{dict_id}.bin"))
+        return dictionaries[dict_id]
+
+    if (None in dictionaries) and (latest_checked_at is not None) and (time.monotonic() - latest_checked_at < latest_dictionary_max_age):
+        return dictionaries[None]
+
+    files = {val['name']: val['updated'] for val in list_files(path_codecs)}
+    if latest_dictionary_file in files:
+        dictionary = load_dictionary(int(read_bytes(path_codecs, latest_dictionary_file).decode().strip()))
+    else:
+        # dictionaries stored before the pointer file: the last one written
+        files = {name: updated for name, updated in files.items() if name.startswith("zstd_dict_") and name.endswith(".bin")}
+        dictionary = None
+        if files:
+            dictionary = zstandard.ZstdCompressionDict(read_bytes(path_codecs, max(files, key=files.get)))
+            dictionaries[dictionary.dict_id()] = dictionary
+
+    dictionaries[None] = dictionary
+    latest_checked_at = time.monotonic()
+    return dictionary
+
+
+def encode_page(data:dict, codec:str = "gzip", page_format:str = "json") -> bytes:
+    payload = serialize(data, page_format)
+    if codec == "gzip":
+        return gzip.compress(payload)
+    if codec == "zstd":
+        dictionary = load_dictionary()
+        compressor = zstandard.ZstdCompressor(level=zstd_level, dict_data=dictionary) if dictionary is not None else zstandard.ZstdCompressor(level=zstd_level)
+        return compressor.compress(payload)
+    return payload
+
+
+def decode_bytes(payload:bytes) -> bytes:
+    codec = detect_codec(payload)
+    if codec == "gzip":
+        return gzip.decompress(payload)
+    if codec == "zstd":
+        dict_id = zstandard.get_frame_parameters(payload).dict_id
+        dictionary = load_dictionary(dict_id) if dict_id else None
+        decompressor = zstandard.ZstdDecompressor(dict_data=dictionary) if dictionary is not None else zstandard.ZstdDecompressor()
+        return decompressor.decompress(payload)
+    return payload
+
+
+def decode_page(payload:bytes) -> dict:
+    return deserialize(decode_bytes(payload))
+
+
+def store_dictionary(dictionary) -> None:
+    # Stores a dictionary and makes it the current one (pointer written after the dictionary)
+    global latest_checked_at
+    write_bytes(dictionary.as_bytes(), path_codecs, f"zstd_dict_{dictionary.dict_id()}.bin")
+    write_bytes(str(dictionary.dict_id()).encode(), path_codecs, latest_dictionary_file, content_type="text/plain")
+    dictionaries[dictionary.dict_id()] = dictionary
+    dictionaries[None] = dictionary
+    latest_checked_at = time.monotonic()
+    return None
+
+
+def train_dictionary() -> tuple:
+    # Trains and stores a new dictionary on a sample of the stored pages, returns (dictionary, samples)
+    names = [val['name'] for val in list_json_files(path_data_storage)]
+    names = random.sample(names, min(training_sample_size, len(names)))
+    samples = [serialize(decode_page(read_page_bytes(path_data_storage, name))) for name in names]
+
+    dictionary = zstandard.train_dictionary(zstd_dict_size, samples)
+    store_dictionary(dictionary)
+    info_message(f"zstd dictionary {dictionary.dict_id()} trained on {len(samples)} pages", 'green')
+    return dictionary, samples
+
+
+def compare_codecs(samples:list, combinations:tuple = (("json", "gzip"), ("json", "zstd"))) -> pd.DataFrame:
+    # Stored size and decode + parse time of the sample pages (JSON bytes) for each (format, codec)
+    pages = [json.loads(sample) for sample in samples]
+    results = []
+    for page_format, codec in combinations:
+        encoded = [encode_page(page, codec, page_format) for page in pages]
+        start = time.perf_counter()
+        for payload in encoded:
+            decode_page(payload)
+        results.append({
+            'format': page_format,
+            'codec': codec,
+            'raw_bytes': sum(len(sample) for sample in samples),
+            'stored_bytes': sum(len(payload) for payload in encoded),
+            'decode_seconds': time.perf_counter() - start,
+        })
+    df = pd.DataFrame(results)
+    df['ratio'] = df['raw_bytes'] / df['stored_bytes']
+    df['speedup'] = df['decode_seconds'].iloc[0] / df['decode_seconds']
+    return df
+
+
+def benchmark() -> pd.DataFrame:
+    names = [val['name'] for val in list_json_files(path_data_storage)]
+    names = random.sample(names, min(training_sample_size, len(names)))
+    samples = [serialize(decode_page(read_page_bytes(path_data_storage, name))) for name in names]
+    combinations = [(page_format, codec) for page_format in format_extensions for codec in codec_extensions]
+    if load_dictionary() is None:
+        combinations = [val for val in combinations if val[1] != "zstd"]
+    df = compare_codecs(samples, combinations)
+    info_message(f"{len(samples)} pages, relative to gzip JSON:")
+    info_message(df.to_string())
+    return df
+
+
+def main():
+    if sys.argv[1:] == ["train"]:
+        _, samples = train_dictionary()
+        info_message(compare_codecs(samples).to_string())
+    elif sys.argv[1:] == ["benchmark"]:
+        benchmark()
+
+
+if __name__ == "__main__":
+    main()
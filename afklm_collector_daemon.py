@@ -0,0 +1,180 @@
+"""
+Long-running collector daemon with warm clients and an internal scheduler.
+
+Imports afklm_api_data_collection_gcp_v1.py once and calls its run_collection in the same process, so the
+clients, the logging thread, the parameter CSV cache and the pacing state of the keys (afklm_pacing.py) are
+kept between runs. The page listing is kept warm (keep_listing_warm) and listed again after
+warm_listing_max_age seconds to see the blobs written by other processes.
+
+Scheduled jobs (UTC times):
+- quota_reset (daily at quota_reset_time): full listing refresh, pacing reset and a full collection run (date
+  extension, refresh planning, every pending query)
+- d1_refresh (daily at d1_refresh_time): the windows of today only, complete ones included, retrieved again as
+  _updSchedD1 pages
+- retry_sweep (every retry_sweep_hours): only the queries whose retry became due (afklm_retry.py)
+
+A local status endpoint (GET http://127.0.0.1:<health_port>/health) returns the jobs and the last runs as JSON.
+
+Usage:
+    python afklm_collector_daemon.py
+"""
+
+### Library import
+import datetime
+import http.server
+import json
+import signal
+import threading
+import time
+import traceback
+
+import afklm_common
+import afklm_pacing
+import afklm_api_data_collection_gcp_v1 as collector
+from afklm_common import info_message
+
+
+### Script parameters
+quota_reset_time = "00:05"
+d1_refresh_time = "18:00"
+retry_sweep_hours = 4
+health_port = 8765
+poll_interval = 30  # seconds
+warm_listing_max_age = 3600  # seconds
+
+daemon_status = {
+    'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    'state': 'starting',
+    'runs': 0,
+    'last_run': None,
+    'last_error': None,
+    'jobs': {},
+}
+stop_event = threading.Event()
+
+
+
+def utc_now() -> datetime.datetime:
+    # naive UTC time of the scheduler (the job times are UTC)
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def next_daily_run(at:str, now:datetime.datetime) -> datetime.datetime:
+    hour, minute = (int(val) for val in at.split(':'))
+    run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return run if run > now else run + datetime.timedelta(days=1)
+
+
+def reset_daily_state() -> None:
+    afklm_common.refresh_listings()
+    afklm_pacing.pacing_state.clear()
+    info_message("daily quota reset: listings refreshed, pacing state cleared", 'blue')
+    return None
+
+
+def run_collector(job:str, **run_options) -> None:
+    # run_options: arguments of collector.run_collection (full collection run by default)
+    daemon_status['state'] = f'running {job}'
+    start = time.perf_counter()
+    run = {'job': job, 'started_at': utc_now().isoformat()}
+    try:
+        collector.run_collection(**run_options)
+        run['status'] = 'ok'
+    except Exception as e:
+        run['status'] = 'error'
+        daemon_status['last_error'] = {'job': job, 'error': repr(e), 'traceback': traceback.format_exc()}
+        info_message(f"collection run '{job}' failed: {e}", 'red', 'error')
+
+    run['duration'] = round(time.perf_counter() - start, 1)
+    daemon_status['runs'] += 1
+    daemon_status['last_run'] = run
+    daemon_status['state'] = 'idle'
+    return None
+
+
+jobs = {
+    'quota_reset': {
+        'action': lambda: (reset_daily_state(), run_collector('quota_reset')),
+        'schedule': lambda now: next_daily_run(quota_reset_time, now),
+    },
+    'd1_refresh': {
+        'action': lambda: run_collector('d1_refresh', daily_steps=False, dates=[utc_now().date().isoformat()], reopen_complete=True),
+        'schedule': lambda now: next_daily_run(d1_refresh_time, now),
+    },
+    'retry_sweep': {
+        'action': lambda: run_collector('retry_sweep', daily_steps=False, retries_only=True),
+        'schedule': lambda now: now + datetime.timedelta(hours=retry_sweep_hours),
+    },
+}
+
+
+class HealthHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip('/') not in ('/health', '/status'):
+            self.send_error(404)
+            return
+        listing = afklm_common.listing_cache.get(afklm_common.path_data_storage, {})
+        body = json.dumps(daemon_status | {'pages_in_warm_listing': len(listing)}, default=str).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return None
+
+
+def start_health_server() -> http.server.ThreadingHTTPServer:
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", health_port), HealthHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    info_message(f"status endpoint on http://127.0.0.1:{health_port}/health", 'blue')
+    return server
+
+
+def schedule_jobs(now:datetime.datetime) -> None:
+    for name, job in jobs.items():
+        daemon_status['jobs'][name] = {'next_run': job['schedule'](now), 'last_run': None}
+    return None
+
+
+def run_due_jobs(now:datetime.datetime) -> float:
+    # runs the jobs whose time has come, returns the seconds to wait before the next check
+    for name, job in jobs.items():
+        if daemon_status['jobs'][name]['next_run'] <= now:
+            info_message(f"job '{name}' started", 'blue')
+            job['action']()
+            daemon_status['jobs'][name] = {'next_run': job['schedule'](now), 'last_run': now}
+
+    next_run = min(val['next_run'] for val in daemon_status['jobs'].values())
+    return min(poll_interval, max((next_run - now).total_seconds(), 0))
+
+
+def run_daemon(run_at_start:bool = True) -> None:
+    afklm_common.keep_listing_warm = True
+    afklm_common.listing_max_age = warm_listing_max_age
+    server = start_health_server()
+
+    for signal_name in ('SIGTERM', 'SIGINT'):
+        signal.signal(getattr(signal, signal_name), lambda *args: stop_event.set())
+
+    schedule_jobs(utc_now())
+    if run_at_start:
+        run_collector('startup')
+
+    daemon_status['state'] = 'idle'
+    while not stop_event.is_set():
+        stop_event.wait(run_due_jobs(utc_now()))
+
+    server.shutdown()
+    info_message("collector daemon stopped", 'blue')
+    return None
+
+
+def main():
+    run_daemon()
+
+
+if __name__ == "__main__":
+    main()
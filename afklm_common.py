@@ -0,0 +1,447 @@
+"""
+Shared GCP/local helpers for the Air France KLM flightstatus data collection.
+
+Used by the processing stages built on top of the stored pages (diffs, indexes, reports...). Every function
+works either against the GCS bucket (when a storage client can be created) or against the local folders.
+
+File names passed to and returned by these helpers are always relative to their folder (e.g. "data" +
+"afklm_api_data_collection_..._0.json.gz"), in both the cloud and the local case. Pages are named by their
+page name whatever their folder in the page layout, read_page_bytes finds where they are stored.
+"""
+
+### Library import
+import pandas as pd
+import re
+import os
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from google.cloud import storage
+from dotenv import load_dotenv
+
+from afklm_blob_cache import cached_download
+from afklm_logging import log_message
+
+
+### GCP parameters
+PROJECT_ID = "trusty-anchor-473006-u9"
+bucket_name = "airfrance-bucket"
+
+### Script parameters
+path_data_storage = "data"
+path_call_parameter_file_folder = "call_parameter_lists"
+path_archive_storage = "archives"
+json_root = "afklm_api_data_collection_"
+
+# Listings kept in memory and updated by the writes of this process (set by afklm_collector_daemon.py)
+keep_listing_warm = False
+listing_max_age = None  # seconds before a warm listing is listed again (blobs written by other processes), None: kept until refresh_listings
+listing_cache = {}
+listing_times = {}  # folder -> time.monotonic() of its last full listing
+blob_generations = {}  # blob path -> generation, from the listings and the writes (key of the disk cache)
+
+# Suffix added to the page file name depending on the date of the query (see the collector)
+page_kinds = {"sched": 0, "updSchedD1": 1, "": 2}
+
+# Layout of the page blobs under path_data_storage (see afklm_page_layout.py), the only setting of it: the
+# collector writes and the listings read with it. "flat" (<page name>) or "partitioned"
+# (date=YYYY-MM-DD/route=ORIGIN-DESTINATION/<page name>)
+page_layout = "flat"
+page_locations = {}  # page name -> path relative to path_data_storage, filled by the listings
+listing_workers = 8
+
+# Window days listed by the incremental stages (snapshot diff, flight state, OTP aggregates): pages written for
+# older days after scan_days_back days are not seen (None lists every page, as a full rebuild)
+scan_days_back = 30
+scan_days_ahead = 31
+
+# Blob metadata keeping the identity of a page rewritten in place (see rewrite_page)
+version_metadata = "afklm_version"
+observed_at_metadata = "afklm_observed_at"
+
+
+try:
+    # Initialisation GCS client
+    client_storage = storage.Client()
+    bucket = client_storage.bucket(bucket_name)
+
+    # loading envirement variables
+    load_dotenv()
+
+    in_cloud = True
+
+except:
+    in_cloud = False
+    client_storage = None
+    bucket = None
+
+
+
+### Messages
+
+def info_message(text:str, color:str=None, level_info:str=None) -> None:
+
+    # output by the logging thread, so the stage messages also reach the JSON lines of the run
+    log_message(text, color, level_info)
+    return None
+
+
+
+### Raw object access
+
+def blob_path(path_folder:str, path_file:str) -> str:
+    if path_folder in ('', None):
+        return path_file
+    return '/'.join([path_folder, path_file])
+
+
+def read_bytes(path_folder:str, path_file:str, bucket = bucket) -> bytes:
+    if in_cloud:
+        # local disk cache keyed by name and generation (afklm_blob_cache.py)
+        path = blob_path(path_folder, path_file)
+        return cached_download(bucket.blob(path), blob_generations.get(path))
+
+    with open(blob_path(path_folder, path_file), 'rb') as f:
+        return f.read()
+
+
+def read_range(path_folder:str, path_file:str, start:int, length:int, bucket = bucket) -> bytes:
+    if in_cloud:
+        path = blob_path(path_folder, path_file)
+        return cached_download(bucket.blob(path), blob_generations.get(path), start, length)
+
+    with open(blob_path(path_folder, path_file), 'rb') as f:
+        f.seek(start)
+        return f.read(length)
+
+
+def write_bytes(payload:bytes, path_folder:str, path_file:str, content_type:str = "application/octet-stream", bucket = bucket) -> None:
+    if in_cloud:
+        blob = bucket.blob(blob_path(path_folder, path_file))
+        blob.upload_from_string(payload, content_type=content_type)
+        register_file(path_folder, path_file, blob.size, blob.generation)
+
+    else:
+        os.makedirs(os.path.dirname(blob_path(path_folder, path_file)) or '.', exist_ok=True)
+        with open(blob_path(path_folder, path_file), 'wb') as f:
+            f.write(payload)
+        register_file(path_folder, path_file)
+    return None
+
+
+def exists(path_folder:str, path_file:str, bucket = bucket) -> bool:
+    if in_cloud:
+        return bucket.blob(blob_path(path_folder, path_file)).exists()
+    return os.path.exists(blob_path(path_folder, path_file))
+
+
+def register_file(path_folder:str, path_file:str, size:int = None, generation = None, metadata:dict = None) -> None:
+    # Keeps the warm listings of path_folder and of its parent / sub folders in line with a file written by this process
+    full_path = blob_path(path_folder, path_file)
+    if generation is not None:
+        blob_generations[full_path] = generation
+    folders = [folder for folder in listing_cache if full_path.startswith(folder + "/")]
+    if not folders:
+        return None
+
+    if not in_cloud and os.path.exists(full_path):
+        stat = os.stat(full_path)
+        size, generation = stat.st_size, stat.st_mtime_ns
+    for folder in folders:
+        name = full_path[len(folder) + 1:]
+        listing_cache[folder][name] = {
+            'name': name,
+            'size': size,
+            'updated': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'generation': generation,
+            'metadata': metadata or {},
+        }
+    return None
+
+
+def refresh_listings() -> None:
+    global archive_catalog
+    listing_cache.clear()
+    listing_times.clear()
+    archive_catalog = None
+    return None
+
+
+def list_files(path_folder:str, bucket = bucket) -> list:
+    # [{'name', 'size', 'updated', 'generation'}] with names relative to path_folder
+    listing_age = time.monotonic() - listing_times.get(path_folder, 0)
+    if keep_listing_warm and path_folder in listing_cache and (listing_max_age is None or listing_age < listing_max_age):
+        return sorted(listing_cache[path_folder].values(), key=lambda val: val['name'])
+
+    files = []
+    if in_cloud:
+        for val in client_storage.list_blobs(bucket, prefix=path_folder + "/"):
+            blob_generations[val.name] = val.generation
+            files.append({
+                'name': val.name[len(path_folder) + 1:],
+                'size': val.size,
+                'updated': val.updated.isoformat() if val.updated is not None else '',
+                'generation': val.generation,
+                'metadata': val.metadata or {},
+            })
+
+    elif os.path.isdir(path_folder):
+        for root, _, names in os.walk(path_folder):
+            for name in names:
+                full_path = os.path.join(root, name)
+                stat = os.stat(full_path)
+                files.append({
+                    'name': os.path.relpath(full_path, path_folder).replace(os.sep, '/'),
+                    'size': stat.st_size,
+                    'updated': datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc).isoformat(),
+                    'generation': stat.st_mtime_ns,
+                })
+
+    files.sort(key=lambda val: val['name'])
+    if keep_listing_warm:
+        listing_cache[path_folder] = {val['name']: val for val in files}
+        listing_times[path_folder] = time.monotonic()
+    return files
+
+
+
+### Tables
+
+def import_csv(path_folder:str, path_file:str, bucket = bucket) -> pd.DataFrame:
+    return pd.read_csv(BytesIO(read_bytes(path_folder, path_file, bucket)), encoding="utf-8", low_memory=False)
+
+
+def save_csv(df, path_folder:str, path_file:str, bucket = bucket) -> None:
+    write_bytes(bytes(df.to_csv(index=False), encoding='utf-8'), path_folder, path_file, "text/csv", bucket)
+    return None
+
+
+def import_parquet(path_folder:str, path_file:str, bucket = bucket) -> pd.DataFrame:
+    return pd.read_parquet(BytesIO(read_bytes(path_folder, path_file, bucket)))
+
+
+def save_parquet(df, path_folder:str, path_file:str, bucket = bucket) -> None:
+    buffer = BytesIO()
+    df.to_parquet(buffer, index=False)
+    write_bytes(buffer.getvalue(), path_folder, path_file, bucket=bucket)
+    return None
+
+
+
+### Page archives (see afklm_page_archive.py)
+
+archive_catalog = None
+
+
+def load_archive_catalog(path_archive_storage:str = path_archive_storage, refresh:bool = False, bucket = bucket) -> dict:
+    # {page name: {'archive', 'offset', 'length', 'updated', 'generation'}} read from the archive sidecar indexes
+    global archive_catalog
+    if (archive_catalog is not None) and not refresh:
+        return archive_catalog
+
+    archive_catalog = {}
+    for index_file in list_files(path_archive_storage, bucket):
+        if not index_file['name'].endswith(".index.csv"):
+            continue
+        df_index = import_csv(path_archive_storage, index_file['name'], bucket)
+        archive = index_file['name'].removesuffix(".index.csv")
+        for row in df_index.itertuples():
+            archive_catalog[row.name] = {
+                'archive': archive, 'offset': int(row.offset), 'length': int(row.length),
+                'updated': str(row.updated), 'generation': str(row.generation),
+            }
+
+    return archive_catalog
+
+
+def read_archived_page(file_to_open:str, path_archive_storage:str = path_archive_storage, bucket = bucket) -> bytes:
+    entry = load_archive_catalog(path_archive_storage, bucket=bucket)[file_to_open]
+    return read_range(path_archive_storage, entry['archive'], entry['offset'], entry['length'], bucket)
+
+
+
+### Pages
+
+def is_page_file(name:str) -> bool:
+    return '.json' in name or '.msgpack' in name
+
+
+def page_partition(page_info:dict) -> str:
+    return f"date={page_info['date'] or 'unknown'}/route={page_info.get('origin', '')}-{page_info.get('destination', '')}"
+
+
+def page_path(file_name:str, layout:str = None) -> str:
+    # Path of a page relative to path_data_storage in the given layout (page_layout by default)
+    page_info = parse_page_name(file_name)
+    if (layout or page_layout) == "flat" or page_info is None:
+        return file_name
+    return f"{page_partition(page_info)}/{file_name}"
+
+
+def loose_pages(files:list) -> list:
+    # Listing entries of the page blobs named by their page name whatever their folder, so both layouts
+    # (and a page found in both during a migration) give the same names. The generation and updated time are
+    # those of the page as first stored, kept through the rewrites of rewrite_page.
+    pages = {}
+    for val in files:
+        name = val['name'].rsplit('/', 1)[-1]
+        if not is_page_file(name):
+            continue
+        page_locations[name] = val['name']
+        metadata = val.get('metadata') or {}
+        pages[name] = val | {
+            'name': name, 'path': val['name'],
+            'generation': metadata.get(version_metadata, val['generation']),
+            'updated': metadata.get(observed_at_metadata, val['updated']),
+        }
+    return sorted(pages.values(), key=lambda val: val['name'])
+
+
+def archived_pages(exclude:set = frozenset(), bucket = bucket) -> list:
+    # Pages packed in archives, in the format of the loose page entries
+    return [
+        {'name': name, 'size': entry['length'], 'updated': entry['updated'],
+         'generation': entry['generation'], 'archive': entry['archive']}
+        for name, entry in load_archive_catalog(bucket=bucket).items()
+        if name not in exclude
+    ]
+
+
+def list_json_files(path_data_storage:str = path_data_storage, include_archives:bool = True, bucket = bucket) -> list:
+    # Loose page blobs plus (optionally) the pages packed in archives, loose blobs first
+    json_list = loose_pages(list_files(path_data_storage, bucket))
+
+    if include_archives:
+        json_list += archived_pages(exclude=set(val['name'] for val in json_list), bucket=bucket)
+        json_list.sort(key=lambda val: val['name'])
+
+    return json_list
+
+
+def list_page_partitions(dates:list, routes:list = None, path_data_storage:str = path_data_storage, include_archives:bool = True, layout:str = None, bucket = bucket) -> list:
+    # Pages of the given days (and ORIGIN-DESTINATION routes), in the format of list_json_files. In the
+    # partitioned layout only their prefixes are listed, in parallel; in the flat layout (or with a warm
+    # listing) the full listing is filtered. layout: page_layout by default.
+    dates = set(dates)
+
+    def in_partitions(name:str) -> bool:
+        page_info = parse_page_name(name)
+        return page_info is not None and page_info['date'] in dates and (routes is None or page_partition(page_info).split('route=')[1] in routes)
+
+    if (layout or page_layout) == "flat" or (keep_listing_warm and path_data_storage in listing_cache):
+        pages = [val for val in loose_pages(list_files(path_data_storage, bucket)) if in_partitions(val['name'])]
+
+    else:
+        prefixes = [f"date={date}" + (f"/route={route}" if route else "") for date in sorted(dates) for route in (routes or [None])]
+
+        def list_prefix(prefix:str) -> list:
+            return [val | {'name': f"{prefix}/{val['name']}"} for val in list_files(blob_path(path_data_storage, prefix), bucket)]
+
+        with ThreadPoolExecutor(max_workers=listing_workers) as executor:
+            listings = list(executor.map(list_prefix, prefixes))
+        pages = loose_pages([val for listing in listings for val in listing])
+
+    if include_archives:
+        pages += [val for val in archived_pages(set(val['name'] for val in pages), bucket) if in_partitions(val['name'])]
+        pages.sort(key=lambda val: val['name'])
+    return pages
+
+
+def scan_dates(today:datetime.date = None) -> list:
+    # Days of the windows listed by the incremental stages (scan_days_back days ago to scan_days_ahead days ahead)
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    return [(today + datetime.timedelta(days=day)).isoformat() for day in range(-scan_days_back, scan_days_ahead + 1)]
+
+
+def list_scan_pages(path_data_storage:str = path_data_storage, include_archives:bool = True, bucket = bucket) -> list:
+    # Pages of the scan window of the incremental stages, every page when scan_days_back is None
+    if scan_days_back is None:
+        return list_json_files(path_data_storage, include_archives, bucket)
+    return list_page_partitions(scan_dates(), path_data_storage=path_data_storage, include_archives=include_archives, bucket=bucket)
+
+
+def read_page_bytes(path_data_storage:str, file_to_open:str, bucket = bucket) -> bytes:
+    # Packed pages are read with a ranged read of their archive, even if the loose blob was kept
+    if file_to_open in load_archive_catalog(bucket=bucket):
+        return read_archived_page(file_to_open, bucket=bucket)
+
+    location = page_locations.get(file_to_open)
+    if location is None and '/' in file_to_open:
+        location = file_to_open
+    elif location is None:
+        # page not listed by this process: current layout first, then the other one
+        location = page_path(file_to_open)
+        if not exists(path_data_storage, location, bucket):
+            location = page_path(file_to_open, "flat" if page_layout == "partitioned" else "partitioned")
+    return read_bytes(path_data_storage, location, bucket)
+
+
+def rewrite_page(payload:bytes, page:dict, bucket = bucket) -> None:
+    # Rewrites a listed loose page (list_json_files entry) without changing the generation and updated time the
+    # incremental stages see: blob metadata in the cloud, modification time restored locally
+    if in_cloud:
+        metadata = {version_metadata: str(page['generation']), observed_at_metadata: str(page['updated'])}
+        blob = bucket.blob(blob_path(path_data_storage, page['path']))
+        blob.metadata = metadata
+        blob.upload_from_string(payload, content_type="application/octet-stream")
+        register_file(path_data_storage, page['path'], blob.size, blob.generation, metadata)
+
+    else:
+        path = blob_path(path_data_storage, page['path'])
+        with open(path, 'wb') as f:
+            f.write(payload)
+        os.utime(path, ns=(time.time_ns(), int(page['generation'])))
+        register_file(path_data_storage, page['path'])
+    return None
+
+
+def open_json(path_data_storage:str, file_to_open:str, bucket = bucket) -> dict:
+    # format and codec detected from the payload (afklm_codecs imports this module)
+    from afklm_codecs import decode_page
+
+    return decode_page(read_page_bytes(path_data_storage, file_to_open, bucket))
+
+
+page_name_pattern = re.compile(
+    "^" + json_root + r"(?P<call_parameters>.*)_(?P<pageNumber>\d+)(?:_(?P<kind>sched|updSchedD1))?\.(?:json|msgpack)(?:\.gz|\.gzip|\.zst)?$"
+)
+
+
+def parse_page_name(file_name:str) -> dict:
+    # Call parameters, page number and kind encoded in a page file name, None if not a page
+    match = page_name_pattern.match(os.path.basename(file_name))
+    if match is None:
+        return None
+
+    page_info = dict(
+        val.split('=', 1) for val in match['call_parameters'].split('&') if '=' in val
+    )
+    page_info['call_parameters'] = match['call_parameters']
+    page_info['pageNumber'] = int(match['pageNumber'])
+    page_info['kind'] = match['kind'] or ''
+    page_info['date'] = page_info.get('startRange', '')[:10]
+    return page_info
+
+
+
+### Processed pages of the incremental stages (afklm_snapshot_diff.py, afklm_flight_state.py, afklm_otp_aggregates.py)
+
+def load_processed_pages(path_folder:str, path_file:str, bucket = bucket) -> pd.DataFrame:
+    if exists(path_folder, path_file, bucket):
+        return import_csv(path_folder, path_file, bucket).astype({'name': str, 'generation': str})
+    return pd.DataFrame(columns=['name', 'generation', 'processed_at'])
+
+
+def unprocessed_pages(pages:pd.DataFrame, processed:pd.DataFrame) -> pd.DataFrame:
+    # pages whose (name, generation) is not in processed: new pages and pages stored again
+    pages = pages.astype({'generation': str}).merge(processed[['name', 'generation']], how='left', on=['name', 'generation'], indicator=True)
+    return pages[pages['_merge'] == 'left_only'].drop('_merge', axis=1)
+
+
+def save_processed_pages(processed:pd.DataFrame, pages:pd.DataFrame, processed_at:str, path_folder:str, path_file:str, bucket = bucket) -> pd.DataFrame:
+    # to be saved after the outputs of the stage: a crash before only processes the pages again
+    processed = pd.concat([processed, pages[['name', 'generation']].assign(processed_at=processed_at)], ignore_index=True)
+    processed = processed.drop_duplicates(['name'], keep='last')
+    save_csv(processed, path_folder, path_file, bucket)
+    return processed
@@ -0,0 +1,121 @@
+"""
+Route x date coverage report computed from the page names and the state CSVs, without opening any page.
+
+For every route (origin-destination) and day of the call-parameter files, the status is:
+- complete: all the pages of the query are stored (or the state says completion = 100)
+- partial: some pages are stored
+- failed: the last call failed (response other than 200) and no page is stored
+- missing: nothing retrieved yet
+
+Only the days of the call-parameter files are listed, and the listing and the state CSVs are processed in
+one vectorized pass each. Outputs (under path_reports):
+- afklm_coverage.csv / .parquet: one row per route and day (pages stored, totalPages, status...)
+- afklm_coverage_matrix.csv: route x date matrix of the status initials (C, P, F, M, empty when not queried)
+and a summary printed in the terminal.
+"""
+
+### Library import
+import pandas as pd
+
+from afklm_common import (
+    info_message, list_files, list_page_partitions, save_csv, save_parquet, page_name_pattern,
+    path_data_storage, path_call_parameter_file_folder,
+)
+from afklm_tables import import_table
+
+
+### Script parameters
+path_reports = "reports"
+status_initials = {"complete": "C", "partial": "P", "failed": "F", "missing": "M"}
+
+
+
+def stored_pages_by_query(dates:list) -> pd.DataFrame:
+    # Number of stored pages per query (route, day, kind) of the given days, from the page names only
+    names = pd.Series([val['name'] for val in list_page_partitions(dates, path_data_storage=path_data_storage)], dtype=str)
+    pages = names.str.extract(page_name_pattern)
+    pages = pages[pages['call_parameters'].notna()]
+
+    pages['origin'] = pages['call_parameters'].str.extract(r"(?:^|&)origin=([^&]*)", expand=False).fillna('')
+    pages['destination'] = pages['call_parameters'].str.extract(r"(?:^|&)destination=([^&]*)", expand=False).fillna('')
+    pages['date'] = pages['call_parameters'].str.extract(r"(?:^|&)startRange=(\d{4}-\d{2}-\d{2})", expand=False)
+    pages['kind'] = pages['kind'].fillna('')
+
+    return (
+        pages.groupby(['origin', 'destination', 'date', 'kind'])['pageNumber'].nunique()
+        .rename('pages_stored').reset_index()
+    )
+
+
+def call_parameters_state() -> pd.DataFrame:
+    files = [
+        val['name'] for val in list_files(path_call_parameter_file_folder)
+        if 'df_call_parameters' in val['name'] and val['name'].endswith(".csv")
+    ]
+    columns = ['origin', 'destination', 'startRange', 'response', 'totalPages', 'completion']
+    df_state = pd.concat(
+        [import_table(path_call_parameter_file_folder, name, typed=False).reindex(columns=columns) for name in files] or [pd.DataFrame(columns=columns)],
+        ignore_index=True,
+    )
+    df_state[['origin', 'destination', 'response']] = df_state[['origin', 'destination', 'response']].fillna('').astype(str)
+    df_state['date'] = df_state['startRange'].astype(str).str[:10]
+    df_state['totalPages'] = pd.to_numeric(df_state['totalPages'], errors='coerce')
+    df_state['completion'] = pd.to_numeric(df_state['completion'].astype(str).str.rstrip('%'), errors='coerce')
+
+    # best known state of each route-day over the parameter files
+    df_state = df_state.sort_values(['completion', 'totalPages'], na_position='first')
+    return df_state.drop_duplicates(['origin', 'destination', 'date'], keep='last').drop('startRange', axis=1)
+
+
+def coverage_table() -> pd.DataFrame:
+    df_state = call_parameters_state()
+    df_pages = stored_pages_by_query(df_state['date'].unique().tolist())
+    # past window pages (kind '') are the final ones; fall back on the latest snapshot kind otherwise
+    df_pages['kind_rank'] = df_pages['kind'].map({'sched': 0, 'updSchedD1': 1, '': 2})
+    df_pages = df_pages.sort_values('kind_rank').drop_duplicates(['origin', 'destination', 'date'], keep='last')
+
+    df = df_state.merge(
+        df_pages.drop('kind_rank', axis=1), how='outer', on=['origin', 'destination', 'date']
+    )
+    df['pages_stored'] = df['pages_stored'].fillna(0).astype(int)
+    df['kind'] = df['kind'].fillna('')
+    df['route'] = df['origin'] + "-" + df['destination']
+
+    is_complete = (df['completion'] == 100) | (df['pages_stored'] >= df['totalPages'])
+    is_failed = (df['response'] != '') & ~df['response'].str.contains('200') & (df['pages_stored'] == 0)
+    df['status'] = "missing"
+    df.loc[df['pages_stored'] > 0, 'status'] = "partial"
+    df.loc[is_failed, 'status'] = "failed"
+    df.loc[is_complete, 'status'] = "complete"
+
+    return df.sort_values(['route', 'date']).reset_index(drop=True)[
+        ['route', 'origin', 'destination', 'date', 'kind', 'pages_stored', 'totalPages', 'completion', 'response', 'status']
+    ]
+
+
+def coverage_matrix(df:pd.DataFrame) -> pd.DataFrame:
+    return df.assign(status=df['status'].map(status_initials)).pivot_table(
+        index='route', columns='date', values='status', aggfunc='first', fill_value='',
+    )
+
+
+def run_coverage_report() -> pd.DataFrame:
+    df = coverage_table()
+    save_csv(df, path_reports, "afklm_coverage.csv")
+    save_parquet(df, path_reports, "afklm_coverage.parquet")
+    save_csv(coverage_matrix(df).reset_index(), path_reports, "afklm_coverage_matrix.csv")
+
+    info_message(f"{df['route'].nunique()} routes x {df['date'].nunique()} days, {df['pages_stored'].sum()} pages stored")
+    info_message(df['status'].value_counts().reindex(list(status_initials), fill_value=0).to_string(), 'green')
+    info_message(
+        df.pivot_table(index='date', columns='status', values='route', aggfunc='count', fill_value=0).tail(10).to_string()
+    )
+    return df
+
+
+def main():
+    run_coverage_report()
+
+
+if __name__ == "__main__":
+    main()
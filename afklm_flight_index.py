@@ -0,0 +1,191 @@
+"""
+Memory-mapped lookup index of the stored flights by flight number, aircraft registration and route.
+
+Page names only encode the query parameters, not the flights inside. This script scans the stored pages once
+and writes, for each key type, a sorted array of (key, date, page, position) entries saved as .npy files that
+are opened with numpy memory mapping. A lookup is then a binary search in the mapped array and only the pages
+holding the requested flights are opened.
+
+Index layout (local folder path_index):
+- pages.csv: page_id, name, generation of every indexed page
+- <key_type>_<segment>.npy: sorted entries of the pages indexed by one build run
+
+Each build run only scans the pages not yet listed in pages.csv and writes a new segment; segments are merged
+back into one when there are more than max_segments of them. A page stored again (new generation) gets a new
+page_id and its former one is dropped from pages.csv: its entries are ignored by the lookups and removed at the
+next merge. Page ids are never reused. Keys longer than key_size bytes are not indexed.
+
+Usage:
+    python afklm_flight_index.py build
+    python afklm_flight_index.py lookup flight KL1234 --date 2025-07-21
+    python afklm_flight_index.py lookup registration PHBEF
+"""
+
+### Library import
+import pandas as pd
+import numpy as np
+import argparse
+import glob
+import os
+
+from afklm_common import info_message, list_json_files, open_json, path_data_storage
+from afklm_flights import get_path
+
+
+### Script parameters
+path_index = "index"
+max_segments = 8
+
+key_types = ["flight", "registration", "route"]
+
+entry_dtype = np.dtype([('key', 'S12'), ('date', 'M8[D]'), ('page', '<i4'), ('position', '<i2')])
+key_size = entry_dtype['key'].itemsize
+
+
+
+def flight_keys(flight:dict) -> dict:
+    # key type -> list of keys of an operational flight
+    legs = flight.get('flightLegs', []) or []
+    return {
+        "flight": [f"{get_path(flight, 'airline.code')}{get_path(flight, 'flightNumber')}"],
+        "registration": sorted(set(get_path(leg, 'aircraft.registration') for leg in legs) - {''}),
+        "route": [
+            f"{get_path(leg, 'departureInformation.airport.code')}-{get_path(leg, 'arrivalInformation.airport.code')}"
+            for leg in legs
+        ],
+    }
+
+
+def load_pages() -> pd.DataFrame:
+    if os.path.exists(f"{path_index}/pages.csv"):
+        return pd.read_csv(f"{path_index}/pages.csv", dtype={'name': str, 'generation': str})
+    return pd.DataFrame({'page_id': pd.Series(dtype='int32'), 'name': pd.Series(dtype=str), 'generation': pd.Series(dtype=str)})
+
+
+def segment_files(key_type:str) -> list:
+    return sorted(glob.glob(f"{path_index}/{key_type}_*.npy"))
+
+
+def next_page_id(pages:pd.DataFrame) -> int:
+    # above every id of pages.csv and of the segments (an interrupted build leaves ids in the segments only)
+    ids = [int(pages['page_id'].max())] if len(pages) else []
+    for key_type in key_types:
+        ids += [int(entries['page'].max()) for entries in (np.load(file, mmap_mode='r') for file in segment_files(key_type)) if len(entries)]
+    return max(ids, default=-1) + 1
+
+
+def scan_pages(pages:pd.DataFrame) -> dict:
+    entries = {key_type: [] for key_type in key_types}
+    too_long = set()
+
+    for page in pages.itertuples():
+        data = open_json(path_data_storage, page.name)
+        for position, flight in enumerate(data.get('operationalFlights', []) or []):
+            date = get_path(flight, 'flightScheduleDate') or 'NaT'
+            for key_type, keys in flight_keys(flight).items():
+                keys = [key.encode() for key in keys]
+                too_long.update(key for key in keys if len(key) > key_size)
+                entries[key_type] += [(key, date, page.page_id, position) for key in keys if len(key) <= key_size]
+
+    if too_long:
+        info_message(f"{len(too_long)} keys longer than {key_size} bytes not indexed: {sorted(too_long)[:5]}", 'yellow', 'warning')
+    return {key_type: np.sort(np.array(rows, dtype=entry_dtype), order=['key', 'date']) for key_type, rows in entries.items()}
+
+
+def write_segment(key_type:str, entries:np.ndarray, page_ids:np.ndarray) -> None:
+    # page_ids: pages still indexed, the entries of the others are dropped when the segments are merged
+    files = segment_files(key_type)
+    segment = int(files[-1].rsplit('_', 1)[1].removesuffix('.npy')) + 1 if files else 0
+    np.save(f"{path_index}/{key_type}_{segment:06d}.npy", entries)
+
+    # merge the segments back into one once they accumulate
+    files = segment_files(key_type)
+    if len(files) > max_segments:
+        merged = np.concatenate([np.load(file) for file in files])
+        merged = np.sort(merged[np.isin(merged['page'], page_ids)], order=['key', 'date'])
+        np.save(files[-1], merged)
+        for file in files[:-1]:
+            os.remove(file)
+    return None
+
+
+def build_index() -> None:
+    os.makedirs(path_index, exist_ok=True)
+    pages = load_pages()
+
+    stored = pd.DataFrame(list_json_files(path_data_storage), columns=['name', 'generation'])
+    stored['generation'] = stored['generation'].astype(str)
+    new_pages = stored.merge(pages, how='left', on=['name', 'generation'], indicator=True)
+    new_pages = new_pages[new_pages['_merge'] == 'left_only'][['name', 'generation']].reset_index(drop=True)
+    new_pages['page_id'] = np.arange(len(new_pages), dtype='int32') + next_page_id(pages)
+
+    info_message(f"{len(new_pages)} new pages to index")
+    if len(new_pages) == 0:
+        return None
+
+    # former generations of the pages stored again
+    pages = pages[~pages['name'].isin(new_pages['name'])]
+    page_ids = np.concatenate([pages['page_id'].to_numpy(), new_pages['page_id'].to_numpy()])
+    for key_type, entries in scan_pages(new_pages).items():
+        write_segment(key_type, entries, page_ids)
+
+    # pages.csv last: the entries of an interrupted build have no page in it and are ignored by the lookups
+    pages = pd.concat([pages, new_pages[['page_id', 'name', 'generation']]], ignore_index=True)
+    pages.to_csv(f"{path_index}/pages.csv", index=False)
+    info_message(f"{len(pages)} pages indexed", 'green')
+    return None
+
+
+def lookup(key_type:str, key:str, date:str = None) -> pd.DataFrame:
+    # Matching (name, date, position) without opening any page
+    key = key.encode()
+    if len(key) > key_size:
+        raise ValueError(f"keys longer than {key_size} bytes are not indexed: {key}")
+    matches = []
+    for file in segment_files(key_type):
+        entries = np.load(file, mmap_mode='r')
+        keys = entries['key']
+        start, end = np.searchsorted(keys, key, 'left'), np.searchsorted(keys, key, 'right')
+        found = np.array(entries[start:end])
+        if date is not None:
+            found = found[found['date'] == np.datetime64(date, 'D')]
+        matches.append(found)
+
+    found = np.concatenate(matches) if matches else np.array([], dtype=entry_dtype)
+    pages = load_pages().set_index('page_id')['name']
+    df = pd.DataFrame({
+        'name': pages.reindex(found['page']).values,
+        'date': found['date'],
+        'position': found['position'],
+    })
+    # entries of superseded pages (or of an interrupted build) have no name
+    return df[df['name'].notna()].drop_duplicates().sort_values(['date', 'name']).reset_index(drop=True)
+
+
+def lookup_flights(key_type:str, key:str, date:str = None) -> list:
+    # Operational flights matching the key, opening only the pages that hold them
+    flights = []
+    for name, rows in lookup(key_type, key, date).groupby('name', sort=False):
+        data = open_json(path_data_storage, name)
+        flights += [data['operationalFlights'][position] | {'page': name} for position in rows['position']]
+    return flights
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flight lookup index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build")
+    parser_lookup = subparsers.add_parser("lookup")
+    parser_lookup.add_argument("key_type", choices=key_types)
+    parser_lookup.add_argument("key")
+    parser_lookup.add_argument("--date", default=None)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index()
+    else:
+        info_message(lookup(args.key_type, args.key, args.date).to_string())
+
+
+if __name__ == "__main__":
+    main()
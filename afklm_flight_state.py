@@ -0,0 +1,109 @@
+"""
+Deduplicated "latest known state" table of the flight legs.
+
+The same flight leg is stored many times: in overlapping startRange / endRange windows, in the route queries of
+both directions and in every snapshot (_sched, _updSchedD1, past window). This stage compacts them into one row
+per flight leg (flight identity of afklm_flights.py) holding its most recently observed state, so that the
+analyses read one typed row per leg instead of scanning and deduplicating every page.
+
+The table is merged incrementally: only the pages not processed yet are opened, and only the partitions of the
+schedule months they touch are rewritten. A leg is replaced when the new observation is more recent
+(time of storage of the page, then sched < updSchedD1 < past window), so a late page never overwrites a
+newer state.
+
+Outputs (under path_flight_state):
+- month=YYYY-MM.parquet: one row per flight leg of the schedule month, typed columns
+- afklm_flight_state_processed.csv: pages already merged (name + generation)
+"""
+
+### Library import
+import pandas as pd
+import datetime
+
+from afklm_common import info_message, list_files, import_parquet, save_parquet, exists, page_kinds, load_processed_pages, save_processed_pages
+from afklm_flights import flight_fields, leg_fields
+from afklm_snapshot_diff import list_new_pages, load_page_legs
+
+
+### Script parameters
+path_flight_state = "derived/flight_state"
+processed_file = "afklm_flight_state_processed.csv"
+
+category_columns = ["airlineCode", "origin", "destination", "flightStatusPublic", "legStatusPublic", "aircraftTypeCode", "kind"]
+time_columns = [
+    "scheduledDeparture", "latestPublishedDeparture", "actualDeparture",
+    "scheduledArrival", "latestPublishedArrival", "actualArrival",
+]
+state_columns = ["flight_key"] + list(flight_fields) + list(leg_fields) + ["page", "kind", "observed_at"]
+
+
+
+def typed_state(df:pd.DataFrame) -> pd.DataFrame:
+    df = df[state_columns].copy()
+    for col in time_columns:
+        df[col] = pd.to_datetime(df[col].replace('', None), utc=True, errors='coerce', format='ISO8601')
+    df['flightScheduleDate'] = pd.to_datetime(df['flightScheduleDate'], errors='coerce')
+    df['observed_at'] = pd.to_datetime(df['observed_at'], utc=True, errors='coerce', format='ISO8601')
+    return df.astype({col: 'category' for col in category_columns} | {'flight_key': str, 'flightNumber': str, 'page': str})
+
+
+def partition_name(month:str) -> str:
+    return f"month={month}.parquet"
+
+
+def load_flight_state(months:list = None) -> pd.DataFrame:
+    # Latest state of the legs of the given schedule months (YYYY-MM), all months by default
+    partitions = sorted(
+        val['name'] for val in list_files(path_flight_state)
+        if val['name'].startswith("month=") and val['name'].endswith(".parquet")
+    )
+    if months is not None:
+        partitions = [name for name in partitions if name in set(partition_name(month) for month in months)]
+    tables = [import_parquet(path_flight_state, name) for name in partitions]
+    if len(tables) == 0:
+        return typed_state(pd.DataFrame(columns=state_columns))
+    return pd.concat(tables, ignore_index=True)
+
+
+def merge_state(current:pd.DataFrame, legs:pd.DataFrame) -> pd.DataFrame:
+    # Most recent observation of every leg; on equal observations the new legs win
+    combined = pd.concat([current, legs], ignore_index=True)
+    combined['_kind_rank'] = combined['kind'].astype(str).map(page_kinds)
+    combined = combined.sort_values(['flight_key', 'observed_at', '_kind_rank'], kind='stable')
+    combined = combined.drop_duplicates('flight_key', keep='last').drop('_kind_rank', axis=1)
+    return typed_state(combined.sort_values(['flightScheduleDate', 'flight_key']).reset_index(drop=True))
+
+
+def run_flight_state() -> pd.DataFrame:
+    processed = load_processed_pages(path_flight_state, processed_file)
+    pages = list_new_pages(processed)
+    info_message(f"{len(pages)} new pages to merge into the flight state")
+    if len(pages) == 0:
+        return pd.DataFrame(columns=['month', 'legs', 'new_observations'])
+
+    legs = load_page_legs(pages).merge(pages[['name', 'kind']], how='left', left_on='page', right_on='name').drop('name', axis=1)
+    legs = typed_state(legs)
+    legs['_month'] = legs['flightScheduleDate'].dt.strftime('%Y-%m').fillna('unknown')
+
+    summary = []
+    for month, month_legs in legs.groupby('_month'):
+        current = import_parquet(path_flight_state, partition_name(month)) if exists(path_flight_state, partition_name(month)) else legs.iloc[0:0].drop('_month', axis=1)
+        state = merge_state(current, month_legs.drop('_month', axis=1))
+        save_parquet(state, path_flight_state, partition_name(month))
+        summary.append({'month': month, 'legs': len(state), 'new_observations': len(month_legs)})
+
+    # Partitions first, then the processed pages: a crash before the end only merges pages again
+    processed_at = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    save_processed_pages(processed, pages, processed_at, path_flight_state, processed_file)
+
+    summary = pd.DataFrame(summary)
+    info_message(summary.to_string(), 'green')
+    return summary
+
+
+def main():
+    run_flight_state()
+
+
+if __name__ == "__main__":
+    main()
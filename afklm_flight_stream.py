@@ -0,0 +1,270 @@
+"""
+Streaming of the collected flights to local consumers, as the pages arrive.
+
+With publish_flights set in the collector, every page retrieved successfully is handed to publish_page right
+after the API call: every operational flight of the page becomes one NDJSON record
+    {"page": ..., "kind": ..., "call_parameters": ..., "fetched_at": ..., "flight": {...raw flight...}}
+written to a pluggable sink:
+- "file": appended to path_stream (a consumer follows it with tail -f)
+- "socket": sent to the Unix socket socket_path (python afklm_flight_stream.py listen prints what it receives);
+  nothing is sent while no consumer listens
+- "broker": published record by record on a topic through a Kafka / PubSub-like publisher (any object with
+  publish(topic, data:bytes)); LocalTopicPublisher is the local stand-in, writing every topic to
+  path_topics/<topic>.ndjson
+
+The fetch loop only puts the page on a bounded queue; a background thread serializes the flights and writes
+them by batches of batch_size records (or every flush_interval seconds). When the queue is full (sink slower
+than the API), backpressure decides: "drop" drops the page (counted in stream_stats), "block" waits up to
+block_timeout seconds before dropping it. The stream never fails the collection: sink errors are counted and
+the records lost.
+
+Usage:
+    python afklm_flight_stream.py listen  # consumer of the "socket" sink
+"""
+
+### Library import
+import atexit
+import datetime
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+from afklm_common import info_message
+
+
+### Script parameters
+stream_sink = "file"  # "file", "socket" or "broker"
+path_stream = "stream/afklm_flights.ndjson"
+socket_path = "/tmp/afklm_flights.sock"
+stream_topic = "afklm-flights"
+path_topics = "stream/topics"
+
+batch_size = 500  # records per write
+flush_interval = 1.0  # seconds before a partial batch is written
+queue_max_pages = 1000
+backpressure = "drop"  # "drop" or "block"
+block_timeout = 5.0
+
+stream_stats = {'pages': 0, 'records': 0, 'batches': 0, 'dropped_pages': 0, 'sink_errors': 0}
+stream_queue = None
+stream_thread = None
+stream_publisher = None  # publisher of the "broker" sink, LocalTopicPublisher when not set
+exit_hook_registered = False
+end_of_stream = object()
+
+
+
+class FileSink:
+
+    def __init__(self, path:str = path_stream):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, 'ab')
+
+    def write(self, lines:list) -> None:
+        self.file.write(b"".join(lines))
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class UnixSocketSink:
+
+    def __init__(self, path:str = socket_path):
+        self.path = path
+        self.connection = None
+
+    def write(self, lines:list) -> None:
+        # (re)connects lazily, the batch is lost while no consumer listens
+        if self.connection is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.connect(self.path)
+            except OSError:
+                connection.close()
+                raise
+            self.connection = connection
+        try:
+            self.connection.sendall(b"".join(lines))
+        except OSError:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class LocalTopicPublisher:
+    # Local stand-in of a Kafka / PubSub publisher: one NDJSON file per topic, offsets are line numbers
+
+    def __init__(self, path:str = path_topics):
+        self.path = path
+        self.files = {}
+        self.offsets = {}
+
+    def publish(self, topic:str, data:bytes) -> int:
+        if topic not in self.files:
+            os.makedirs(self.path, exist_ok=True)
+            self.files[topic] = open(os.path.join(self.path, f"{topic}.ndjson"), 'ab')
+            self.offsets[topic] = 0
+        self.files[topic].write(data if data.endswith(b"\n") else data + b"\n")
+        self.offsets[topic] += 1
+        return self.offsets[topic] - 1
+
+    def flush(self) -> None:
+        for file in self.files.values():
+            file.flush()
+
+    def close(self) -> None:
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+
+class BrokerSink:
+
+    def __init__(self, publisher = None, topic:str = stream_topic):
+        self.publisher = publisher if publisher is not None else LocalTopicPublisher()
+        self.topic = topic
+
+    def write(self, lines:list) -> None:
+        for line in lines:
+            self.publisher.publish(self.topic, line.rstrip(b"\n"))
+        if hasattr(self.publisher, 'flush'):
+            self.publisher.flush()
+
+    def close(self) -> None:
+        if hasattr(self.publisher, 'close'):
+            self.publisher.close()
+
+
+sinks = {
+    "file": lambda: FileSink(path_stream),
+    "socket": lambda: UnixSocketSink(socket_path),
+    "broker": lambda: BrokerSink(stream_publisher if stream_publisher is not None else LocalTopicPublisher(path_topics), stream_topic),
+}
+
+
+
+def page_records(data:dict, meta:dict) -> list:
+    return [
+        (json.dumps(meta | {'flight': flight}, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        for flight in data.get('operationalFlights', []) or []
+    ]
+
+
+def write_batch(sink, batch:list) -> None:
+    try:
+        sink.write(batch)
+        stream_stats['batches'] += 1
+    except Exception as error:
+        stream_stats['sink_errors'] += 1
+        if stream_stats['sink_errors'] == 1:
+            info_message(f"flight stream: {len(batch)} records lost ({error})", 'yellow', 'warning')
+    return None
+
+
+def stream_worker(sink) -> None:
+    batch, last_write = [], time.monotonic()
+    while True:
+        try:
+            item = stream_queue.get(timeout=max(0.01, last_write + flush_interval - time.monotonic()))
+        except queue.Empty:
+            item = None
+
+        if item is not None and item is not end_of_stream:
+            data, meta = item
+            records = page_records(data, meta)
+            stream_stats['records'] += len(records)
+            batch.extend(records)
+
+        due = item is end_of_stream or len(batch) >= batch_size or time.monotonic() >= last_write + flush_interval
+        if due:
+            if batch:
+                write_batch(sink, batch)
+            batch, last_write = [], time.monotonic()
+        if item is end_of_stream:
+            sink.close()
+            return None
+
+
+def start_stream(sink = None) -> None:
+    # sink: any object with write(lines) and close(), the stream_sink one by default
+    global stream_queue, stream_thread, exit_hook_registered
+    if stream_thread is not None:
+        return None
+    stream_queue = queue.Queue(maxsize=queue_max_pages)
+    stream_thread = threading.Thread(target=stream_worker, args=(sink if sink is not None else sinks[stream_sink](),), daemon=True)
+    stream_thread.start()
+    if not exit_hook_registered:
+        # one hook for every stream started in the process (the daemon restarts it on each run)
+        atexit.register(stop_stream)
+        exit_hook_registered = True
+    return None
+
+
+def publish_page(data:dict, file_name:str, kind:str = "", call_parameters:str = "") -> bool:
+    # Queues a page for the stream without waiting for the sink, False when dropped by backpressure
+    if stream_thread is None:
+        start_stream()
+    meta = {
+        'page': file_name, 'kind': kind, 'call_parameters': call_parameters,
+        'fetched_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    try:
+        if backpressure == "block":
+            stream_queue.put((data, meta), timeout=block_timeout)
+        else:
+            stream_queue.put_nowait((data, meta))
+    except queue.Full:
+        stream_stats['dropped_pages'] += 1
+        return False
+    stream_stats['pages'] += 1
+    return True
+
+
+def stop_stream() -> dict:
+    # Writes the pages still queued and closes the sink
+    global stream_queue, stream_thread
+    if stream_thread is None:
+        return stream_stats
+    stream_queue.put(end_of_stream)
+    stream_thread.join()
+    stream_queue, stream_thread = None, None
+    return stream_stats
+
+
+def listen(path:str = None) -> None:
+    # Consumer of the "socket" sink: prints the NDJSON records received
+    path = path or socket_path
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    info_message(f"listening on {path}", 'blue')
+    try:
+        while True:
+            connection, _ = server.accept()
+            with connection, connection.makefile('rb') as stream:
+                for line in stream:
+                    sys.stdout.write(line.decode("utf-8"))
+                    sys.stdout.flush()
+    finally:
+        server.close()
+        os.remove(path)
+
+
+def main():
+    if sys.argv[1:] == ["listen"]:
+        listen()
+
+
+if __name__ == "__main__":
+    main()
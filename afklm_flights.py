@@ -0,0 +1,78 @@
+"""
+Flattening of the flightstatus API pages into one record per flight leg.
+
+A page contains a list of "operationalFlights", each with one or more "flightLegs". The functions below turn
+a page into flat leg records carrying a stable flight identity (schedule date, airline, flight number and leg
+route) and the attributes that change between snapshots (times, status, aircraft).
+"""
+
+### Library import
+import pandas as pd
+
+
+flight_identity = ["flightScheduleDate", "airlineCode", "flightNumber", "origin", "destination"]
+
+# Leg attributes: name -> path in the leg
+leg_fields = {
+    "origin": "departureInformation.airport.code",
+    "destination": "arrivalInformation.airport.code",
+    "legStatusPublic": "legStatusPublic",
+    "scheduledDeparture": "departureInformation.times.scheduled",
+    "latestPublishedDeparture": "departureInformation.times.latestPublished",
+    "actualDeparture": "departureInformation.times.actual",
+    "scheduledArrival": "arrivalInformation.times.scheduled",
+    "latestPublishedArrival": "arrivalInformation.times.latestPublished",
+    "actualArrival": "arrivalInformation.times.actual",
+    "aircraftRegistration": "aircraft.registration",
+    "aircraftTypeCode": "aircraft.typeCode",
+}
+
+# Flight attributes: name -> path in the operational flight
+flight_fields = {
+    "flightScheduleDate": "flightScheduleDate",
+    "airlineCode": "airline.code",
+    "flightNumber": "flightNumber",
+    "flightStatusPublic": "flightStatusPublic",
+}
+
+state_fields = [
+    "flightStatusPublic", "legStatusPublic",
+    "scheduledDeparture", "latestPublishedDeparture", "actualDeparture",
+    "scheduledArrival", "latestPublishedArrival", "actualArrival",
+    "aircraftRegistration", "aircraftTypeCode",
+]
+
+
+def get_path(obj, path:str, default=''):
+    for key in path.split('.'):
+        if not isinstance(obj, dict) or key not in obj:
+            return default
+        obj = obj[key]
+    return default if obj is None else obj
+
+
+def flight_key(row) -> str:
+    return "+".join(str(row[col]) for col in flight_identity)
+
+
+def flight_legs_from_page(data:dict) -> list:
+    legs = []
+    for flight in data.get('operationalFlights', []) or []:
+        flight_values = {name: get_path(flight, path) for name, path in flight_fields.items()}
+        flight_values['flightNumber'] = str(flight_values['flightNumber'])
+
+        for leg in flight.get('flightLegs', []) or []:
+            leg_values = {name: get_path(leg, path) for name, path in leg_fields.items()}
+            legs.append(flight_values | leg_values)
+
+    return legs
+
+
+def flight_legs_dataframe(data:dict, **page_columns) -> pd.DataFrame:
+    # page_columns (e.g. page=..., observed_at=...) are repeated on every leg
+    df = pd.DataFrame(flight_legs_from_page(data), columns=list(flight_fields) + list(leg_fields))
+    df = df.astype(str)
+    for name, value in page_columns.items():
+        df[name] = value
+    df['flight_key'] = df[flight_identity].agg('+'.join, axis=1) if len(df) else pd.Series(dtype=str)
+    return df
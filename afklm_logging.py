@@ -0,0 +1,131 @@
+"""
+Structured, non-blocking logging for the collector fetch loop.
+
+log_message only checks the level, samples and puts a record on a queue (a few microseconds); a listener
+thread does the I/O off the hot path:
+- console lines in the colour of the message
+- JSON lines (time, level, message, structured fields) written by batches of batch_size to path_logs
+- Cloud Logging (batched by its background transport) when a handler is given by the collector
+
+High-volume messages (one per query or per page) are given a sample kind: only one in sample_every[kind] of
+their info messages is kept, warnings and errors are always kept.
+The listener is started once per process (the collector daemon runs the collector several times in the same
+process), flush_logging writes the pending records at the end of a run. The log folder is resolved when the
+listener starts: start it after any change of working directory.
+"""
+
+### Library import
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from colorama import Fore
+
+
+### Script parameters
+log_level = "info"
+path_logs = "logs"
+json_lines = True
+batch_size = 200  # records buffered before being written to the JSON lines file (errors are written at once)
+sample_every = {"query": 1, "page": 10}
+
+levels = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+logger = logging.getLogger("extraction_app_logger")
+listener = None
+sample_counters = {}
+
+
+
+class ColorFormatter(logging.Formatter):
+
+    def format(self, record):
+        color = getattr(record, 'color', None)
+        return (getattr(Fore, color.upper()) if color else Fore.RESET) + record.getMessage()
+
+
+class JsonLinesFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'message': record.getMessage(),
+        }
+        return json.dumps(entry | getattr(record, 'fields', {}), ensure_ascii=False, default=str)
+
+
+
+def logging_started() -> bool:
+    return listener is not None
+
+
+def start_logging(extra_handlers:list = None) -> logging.Logger:
+    global listener
+    if listener is not None:
+        return logger
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(ColorFormatter())
+    handlers = [console_handler] + list(extra_handlers or [])
+
+    if json_lines:
+        os.makedirs(path_logs, exist_ok=True)
+        run_id = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        file_handler = logging.FileHandler(os.path.join(path_logs, f"afklm_collection_{run_id}.jsonl"), encoding="utf-8")
+        file_handler.setFormatter(JsonLinesFormatter())
+        handlers.append(logging.handlers.MemoryHandler(batch_size, flushLevel=logging.ERROR, target=file_handler))
+
+    log_queue = queue.SimpleQueue()
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(levels[log_level])
+    logger.propagate = False
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+    return logger
+
+
+def log_message(text:str, color:str = None, level_info:str = None, sample:str = None, **fields) -> None:
+    level = levels.get(level_info, logging.INFO)
+    if not logger.isEnabledFor(level):
+        return None
+
+    if sample is not None and level <= logging.INFO:
+        count = sample_counters.get(sample, 0)
+        sample_counters[sample] = count + 1
+        if count % sample_every.get(sample, 1):
+            return None
+
+    if listener is None:
+        start_logging()
+    logger.log(level, text, extra={'color': color, 'fields': fields})
+    return None
+
+
+def flush_logging() -> None:
+    # Writes the records still queued or buffered, the listener keeps running
+    if listener is None:
+        return None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.flush()
+    listener.start()
+    return None
+
+
+def stop_logging() -> None:
+    global listener
+    if listener is None:
+        return None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.flush()
+        handler.close()
+    listener = None
+    return None
@@ -0,0 +1,165 @@
+"""
+Opt-in memory instrumentation of the collector stages.
+
+Set memory_profiling = True in the collector to wrap its named stages (listing, parameter load, date
+extension, fetch, encode, upload, state save) with profile_stage. For each occurrence of a stage, this records:
+- the Python allocations traced by tracemalloc (net change and peak during the stage)
+- the process RSS, sampled in a background thread every rss_sample_interval seconds (max during the stage)
+- every snapshot_every occurrences, the allocation sites that grew the most since the previous snapshot
+
+save_memory_report writes one row per stage occurrence and a per-stage summary under path_reports, then
+starts the records of the next run (the daemon reports every run of a long-lived process).
+The summary flags the stages whose net allocations keep accumulating with the number of occurrences,
+i.e. with the length of the run.
+Stages may be nested (e.g. encode inside fetch): the peak of the enclosing stage includes the nested one.
+When memory_profiling is False the stages cost a single flag check.
+"""
+
+### Library import
+import pandas as pd
+import numpy as np
+import contextlib
+import datetime
+import threading
+import tracemalloc
+import time
+import os
+
+from afklm_common import info_message, save_csv
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+### Script parameters
+memory_profiling = False
+path_reports = "reports"
+rss_sample_interval = 0.5  # seconds
+snapshot_every = 50
+top_allocations = 3
+growth_threshold = 1024  # bytes of traced memory kept per occurrence to flag a stage as growing
+
+stage_records = []
+stage_occurrences = {}
+current_stage = {'name': None, 'rss_max': 0}
+active_stages = []  # peaks of the enclosing stages, kept while a nested stage resets the tracemalloc peak
+last_snapshot = {}
+sampler = None
+
+
+
+def rss() -> int:
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def sample_rss() -> None:
+    while memory_profiling:
+        current_stage['rss_max'] = max(current_stage['rss_max'], rss())
+        time.sleep(rss_sample_interval)
+
+
+def start_memory_profiling() -> None:
+    global memory_profiling, sampler
+    memory_profiling = True
+    tracemalloc.start()
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    return None
+
+
+def top_growth(stage:str) -> str:
+    # Allocation sites that grew the most since the previous snapshot of the same stage
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    previous = last_snapshot.get(stage)
+    last_snapshot[stage] = snapshot
+    if previous is None:
+        return ""
+    stats = snapshot.compare_to(previous, 'lineno')[:top_allocations]
+    return " | ".join(f"{stat.traceback[0].filename.rsplit('/', 1)[-1]}:{stat.traceback[0].lineno} {stat.size_diff / 1e6:+.2f} MB" for stat in stats)
+
+
+@contextlib.contextmanager
+def profile_stage(stage:str):
+    if not memory_profiling:
+        yield
+        return
+
+    occurrence = stage_occurrences.get(stage, 0)
+    stage_occurrences[stage] = occurrence + 1
+    traced_before, peak_before = tracemalloc.get_traced_memory()
+    if active_stages:
+        # the enclosing stage keeps its peak and RSS so far, reset_peak below clears them
+        enclosing = active_stages[-1]
+        enclosing['peak'] = max(enclosing['peak'], peak_before)
+        enclosing['rss_max'] = max(enclosing['rss_max'], current_stage['rss_max'])
+    tracemalloc.reset_peak()
+    frame = {'name': stage, 'peak': 0, 'rss_max': 0}
+    active_stages.append(frame)
+    current_stage.update({'name': stage, 'rss_max': rss()})
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        traced_after, traced_peak = tracemalloc.get_traced_memory()
+        active_stages.pop()
+        traced_peak = max(traced_peak, frame['peak'])
+        rss_max = max(current_stage['rss_max'], frame['rss_max'], rss())
+        stage_records.append({
+            'stage': stage,
+            'occurrence': occurrence,
+            'duration': time.perf_counter() - start,
+            'traced_after': traced_after,
+            'traced_delta': traced_after - traced_before,
+            'traced_peak': traced_peak,
+            'rss_after': rss(),
+            'rss_max': rss_max,
+            'top_growth': top_growth(stage) if occurrence % snapshot_every == 0 else "",
+        })
+        if active_stages:
+            # back to the enclosing stage, with the peaks of the nested one
+            enclosing = active_stages[-1]
+            enclosing['peak'] = max(enclosing['peak'], traced_peak)
+            current_stage.update({'name': enclosing['name'], 'rss_max': max(enclosing['rss_max'], rss_max)})
+
+
+def memory_summary(df_records:pd.DataFrame) -> pd.DataFrame:
+    summary = df_records.groupby('stage').agg(
+        occurrences=('occurrence', 'count'),
+        duration=('duration', 'sum'),
+        traced_delta_total=('traced_delta', 'sum'),
+        traced_peak_max=('traced_peak', 'max'),
+        rss_max=('rss_max', 'max'),
+    )
+    # slope of the memory retained by the stage itself (cumulated net allocations) vs its occurrence number
+    summary['growth_per_occurrence'] = df_records.groupby('stage')[['occurrence', 'traced_delta']].apply(
+        lambda df: np.polyfit(df['occurrence'], df['traced_delta'].cumsum(), 1)[0] if len(df) > 2 else 0.0
+    )
+    summary['growing'] = summary['growth_per_occurrence'] > growth_threshold
+    return summary.reset_index()
+
+
+def save_memory_report() -> pd.DataFrame:
+    if not stage_records:
+        return None
+
+    run_id = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    df_records = pd.DataFrame(stage_records)
+    summary = memory_summary(df_records)
+    save_csv(df_records, path_reports, f"afklm_memory_stages_{run_id}.csv")
+    save_csv(summary, path_reports, f"afklm_memory_summary_{run_id}.csv")
+
+    info_message(summary.to_string(), 'blue')
+    for stage in summary.loc[summary['growing'], 'stage']:
+        info_message(f"memory of stage '{stage}' grows with the run length", 'red', 'warning')
+
+    stage_records.clear()
+    stage_occurrences.clear()
+    return summary
@@ -0,0 +1,133 @@
+"""
+On-time performance aggregates per day, carrier and route, maintained incrementally.
+
+Each flight leg contributes once to the aggregates of its schedule day, carrier and route: flights, cancelled,
+departed / arrived legs, departure and arrival delay sums (minutes) and an arrival delay histogram.
+The contribution of every leg is kept (contributions/month=YYYY-MM.parquet). When a newer snapshot of a leg
+arrives (same ordering as afklm_flight_state.py: time of storage, then sched < updSchedD1 < past window), its
+previous contribution is retracted from the aggregates and replaced by the new one; an older snapshot arriving
+late is ignored. Only the pages not processed yet are opened.
+
+Outputs (under path_otp):
+- afklm_otp_route_day.parquet: the aggregates, a few rows per route and day, read directly by the dashboards
+- contributions/month=YYYY-MM.parquet: the contribution of every leg
+- afklm_otp_processed.csv: pages already processed (name + generation)
+"""
+
+### Library import
+import pandas as pd
+import numpy as np
+import datetime
+
+from afklm_common import info_message, import_parquet, save_parquet, exists, page_kinds, load_processed_pages, save_processed_pages
+from afklm_flight_state import typed_state
+from afklm_snapshot_diff import list_new_pages, load_page_legs
+
+
+### Script parameters
+path_otp = "derived/otp"
+path_contributions = "derived/otp/contributions"
+aggregates_file = "afklm_otp_route_day.parquet"
+processed_file = "afklm_otp_processed.csv"
+
+cancelled_status = "CANCELLED"
+on_time_threshold = 15  # minutes
+delay_bins = [-np.inf, 0, 15, 30, 60, 120, 180, np.inf]
+delay_labels = ["early", "0_15", "15_30", "30_60", "60_120", "120_180", "180_plus"]
+
+grain = ["flightScheduleDate", "airlineCode", "origin", "destination"]
+metric_columns = [
+    "flights", "cancelled", "departed", "arrived", "on_time_arrivals", "dep_delay_minutes", "arr_delay_minutes",
+] + [f"arr_delay_{label}" for label in delay_labels]
+
+
+
+def delay_minutes(actual:pd.Series, scheduled:pd.Series) -> pd.Series:
+    return ((actual - scheduled).dt.total_seconds() / 60).round()
+
+
+def leg_contributions(legs:pd.DataFrame) -> pd.DataFrame:
+    # One contribution row per leg observation (metrics of the grain it falls into)
+    df = legs[['flight_key'] + grain + ['observed_at']].copy()
+    df['flightScheduleDate'] = df['flightScheduleDate'].dt.date.astype(str)
+    df[['airlineCode', 'origin', 'destination']] = df[['airlineCode', 'origin', 'destination']].astype(str)
+    df['kind_rank'] = legs['kind'].astype(str).map(page_kinds)
+
+    dep_delay = delay_minutes(legs['actualDeparture'], legs['scheduledDeparture'])
+    arr_delay = delay_minutes(legs['actualArrival'], legs['scheduledArrival'])
+    df['flights'] = 1
+    df['cancelled'] = ((legs['legStatusPublic'].astype(str) == cancelled_status) | (legs['flightStatusPublic'].astype(str) == cancelled_status)).astype(int)
+    df['departed'] = dep_delay.notna().astype(int)
+    df['arrived'] = arr_delay.notna().astype(int)
+    df['on_time_arrivals'] = (arr_delay <= on_time_threshold).astype(int)
+    df['dep_delay_minutes'] = dep_delay.fillna(0).astype(int)
+    df['arr_delay_minutes'] = arr_delay.fillna(0).astype(int)
+
+    bins = pd.cut(arr_delay, delay_bins, labels=delay_labels, right=False)
+    for label in delay_labels:
+        df[f"arr_delay_{label}"] = (bins == label).astype(int)
+    return df.reset_index(drop=True)
+
+
+def signed_aggregates(contributions:pd.DataFrame, sign:int) -> pd.DataFrame:
+    return contributions.groupby(grain)[metric_columns].sum().mul(sign).reset_index()
+
+
+def merge_contributions(current:pd.DataFrame, new:pd.DataFrame) -> tuple:
+    # Returns (contributions kept, delta to apply to the aggregates): the newest observation of every leg wins,
+    # the contributions it replaces are retracted
+    combined = pd.concat([current.assign(_new=False), new.assign(_new=True)], ignore_index=True)
+    combined = combined.sort_values(['flight_key', 'observed_at', 'kind_rank'], kind='stable')
+    latest = combined.drop_duplicates('flight_key', keep='last')
+
+    added = latest[latest['_new']]
+    retracted = current[current['flight_key'].isin(added['flight_key'])]
+    delta = pd.concat([signed_aggregates(added, 1), signed_aggregates(retracted, -1)], ignore_index=True)
+
+    return latest.drop('_new', axis=1).reset_index(drop=True), delta
+
+
+def load_aggregates() -> pd.DataFrame:
+    if exists(path_otp, aggregates_file):
+        return import_parquet(path_otp, aggregates_file)
+    return pd.DataFrame(columns=grain + metric_columns)
+
+
+def run_otp_aggregates() -> pd.DataFrame:
+    processed = load_processed_pages(path_otp, processed_file)
+    pages = list_new_pages(processed)
+    info_message(f"{len(pages)} new pages to aggregate")
+    if len(pages) == 0:
+        return load_aggregates()
+
+    legs = load_page_legs(pages).merge(pages[['name', 'kind']], how='left', left_on='page', right_on='name').drop('name', axis=1)
+    new = leg_contributions(typed_state(legs))
+    new['_month'] = new['flightScheduleDate'].str[:7]
+
+    deltas = []
+    for month, month_new in new.groupby('_month'):
+        partition = f"month={month}.parquet"
+        current = import_parquet(path_contributions, partition) if exists(path_contributions, partition) else month_new.iloc[0:0].drop('_month', axis=1)
+        contributions, delta = merge_contributions(current, month_new.drop('_month', axis=1))
+        save_parquet(contributions, path_contributions, partition)
+        deltas.append(delta)
+
+    # retract-and-replace applied to the aggregates, rows left without flights are dropped
+    aggregates = pd.concat([load_aggregates()] + deltas, ignore_index=True)
+    aggregates = aggregates.groupby(grain)[metric_columns].sum().reset_index()
+    aggregates = aggregates[aggregates['flights'] > 0].astype({col: 'int64' for col in metric_columns})
+    save_parquet(aggregates.reset_index(drop=True), path_otp, aggregates_file)
+
+    processed_at = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    save_processed_pages(processed, pages, processed_at, path_otp, processed_file)
+
+    info_message(f"{len(aggregates)} route-days in the on-time performance aggregates", 'green')
+    return aggregates
+
+
+def main():
+    run_otp_aggregates()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Quota telemetry and adaptive pacing of the API calls.
+
+The gateway returns the plan limits and the current usage in the response headers (X-Plan-QPS-*,
+X-Plan-Quota-*, X-RateLimit-* and Retry-After on 429). The functions below read them after each call to:
+- keep the key's call count in line with the server (quota_current)
+- rotate to the next key before the quota is exhausted (quota_reserve calls left)
+- adjust the interval between calls: the lowest safe value given the allotted QPS, doubled on 429 and
+  slowly decreased back after successful calls
+- record one telemetry row per call (saved to path_telemetry) for later tuning
+
+Only the daily headers (X-Plan-Quota-*, X-RateLimit-*-Day) are read as quota: the generic X-RateLimit-Limit /
+X-RateLimit-Remaining may describe the per-second limit and would rotate keys far too early. A 429 is retried
+at most max_rate_limited_retries times in a row for a page, then the query is failed (rate_limited, see
+afklm_retry.py); a 429 telling the daily quota is consumed (quota_exhausted) rotates the key at once.
+"""
+
+### Library import
+import pandas as pd
+import datetime
+import time
+
+from afklm_common import import_csv, save_csv, exists
+
+
+### Script parameters
+path_telemetry = "telemetry"
+telemetry_file = "afklm_api_key_telemetry.csv"
+min_call_interval = 1.1  # seconds, API limited to 1 call / s
+max_call_interval = 60
+interval_safety_margin = 1.05
+interval_decrease = 0.9  # applied after each successful call
+quota_reserve = 1  # calls kept unused on a key before rotating
+max_rate_limited_retries = 5  # consecutive 429 on a page before the query is failed
+
+quota_headers = {
+    "qps_allotted": ["X-Plan-QPS-Allotted", "X-RateLimit-Limit-Second"],
+    "qps_current": ["X-Plan-QPS-Current"],
+    "quota_allotted": ["X-Plan-Quota-Allotted", "X-RateLimit-Limit-Day"],
+    "quota_current": ["X-Plan-Quota-Current"],
+    "quota_remaining": ["X-RateLimit-Remaining-Day"],
+    "quota_reset": ["X-Plan-Quota-Reset", "X-RateLimit-Reset"],
+    "retry_after": ["Retry-After"],
+}
+
+# key_desc -> {'interval', 'quota_allotted', 'quota_current', 'quota_remaining', 'retry_after', ...}
+pacing_state = {}
+telemetry = []
+
+
+
+def read_quota_headers(headers) -> dict:
+    values = {}
+    for name, header_names in quota_headers.items():
+        for header_name in header_names:
+            value = headers.get(header_name)
+            if value is None:
+                continue
+            try:
+                values[name] = float(value)
+            except ValueError:
+                values[name] = value
+            break
+    return values
+
+
+def key_state(key_desc:str) -> dict:
+    return pacing_state.setdefault(key_desc, {'interval': min_call_interval, 'retry_after': 0})
+
+
+def lowest_safe_interval(state:dict) -> float:
+    qps_allotted = state.get('qps_allotted')
+    if isinstance(qps_allotted, float) and qps_allotted > 0:
+        return max(interval_safety_margin / qps_allotted, min_call_interval)
+    return min_call_interval
+
+
+def update_pacing(key_desc:str, response, latency:float = None) -> dict:
+    # Updates the key's pacing state from a response and records a telemetry row
+    state = key_state(key_desc)
+    values = read_quota_headers(response.headers)
+    state.update(values)
+    # call count told by this response only (a response without quota headers must not reuse an older one)
+    state['quota_count'] = None
+
+    if isinstance(state.get('quota_allotted'), float) and isinstance(values.get('quota_current'), float):
+        state['quota_remaining'] = state['quota_allotted'] - values['quota_current']
+    if isinstance(values.get('quota_current'), float):
+        state['quota_count'] = values['quota_current']
+    elif isinstance(state.get('quota_allotted'), float) and isinstance(values.get('quota_remaining'), float):
+        state['quota_count'] = state['quota_allotted'] - values['quota_remaining']
+
+    if response.status_code == 429:
+        state['interval'] = min(state['interval'] * 2, max_call_interval)
+        state['retry_after'] = values['retry_after'] if isinstance(values.get('retry_after'), float) else state['interval']
+    else:
+        state['interval'] = max(state['interval'] * interval_decrease, lowest_safe_interval(state))
+        state['retry_after'] = 0
+
+    telemetry.append({
+        'timestamp': datetime.datetime.now().isoformat(),
+        'key_desc': key_desc,
+        'status': response.status_code,
+        'latency': latency,
+        'interval': state['interval'],
+        'error_code': response.headers.get('X-Mashery-Error-Code', ''),
+    } | {name: state.get(name, '') for name in quota_headers})
+
+    return state
+
+
+def wait_for_next_call(key_desc:str, last_call_time:datetime.datetime, time_delay_query:float = 0) -> None:
+    state = key_state(key_desc)
+    wait = max(state['interval'], state['retry_after']) + time_delay_query
+    elapsed = (datetime.datetime.now() - last_call_time).total_seconds()
+    if wait > elapsed:
+        time.sleep(wait - elapsed)
+    return None
+
+
+def server_call_count(key_desc:str, nb_calls_today:int) -> int:
+    # Calls made today with the key according to the server when the last response tells it, else the local count
+    quota_count = key_state(key_desc).get('quota_count')
+    if isinstance(quota_count, float):
+        return int(quota_count)
+    return nb_calls_today
+
+
+def quota_exhausted(response) -> bool:
+    # Daily quota of the key consumed (Mashery "Developer Over Rate"), not the per-second limit ("Developer Over Qps")
+    error_code = response.headers.get('X-Mashery-Error-Code', '')
+    if error_code:
+        return error_code == "ERR_403_DEVELOPER_OVER_RATE"
+    return ("Developer" in response.text) and ("Qps" not in response.text)
+
+
+def quota_nearly_exhausted(key_desc:str) -> bool:
+    remaining = key_state(key_desc).get('quota_remaining')
+    return isinstance(remaining, float) and remaining <= quota_reserve
+
+
+def save_telemetry() -> None:
+    global telemetry
+    if len(telemetry) == 0:
+        return None
+
+    df_telemetry = pd.DataFrame(telemetry)
+    if exists(path_telemetry, telemetry_file):
+        df_telemetry = pd.concat([import_csv(path_telemetry, telemetry_file), df_telemetry], ignore_index=True)
+    save_csv(df_telemetry, path_telemetry, telemetry_file)
+    telemetry = []
+    return None
@@ -0,0 +1,152 @@
+"""
+Packing of the page blobs stored by the collector into daily archives.
+
+The pages of past days are rolled into one archive object per day (or per route and day) with a sidecar
+offset index, so a single page is still fetched with one ranged read (read_archived_page in afklm_common.py).
+
+Archive layout (under path_archive_storage):
+- date=YYYY-MM-DD.pack (or date=YYYY-MM-DD/route=ORIGIN-DESTINATION.pack): the stored payloads concatenated,
+  one per page, as they were stored (gzip or zstd frames, see afklm_codecs.py, of JSON or msgpack pages);
+  uncompressed pages are gzipped
+- <archive>.index.csv: name, offset, length, updated, generation of every page in the archive
+
+An archive is only readable through its index: once zstd or msgpack pages are packed it is no longer a gzip
+file. Pages added later to an already packed day are appended to the end of the archive (GCS compose in the
+cloud), so existing offsets never move.
+
+open_json and the "already retrieved" check of the collector read both the loose blobs and the archives.
+Loose blobs are only deleted after packing when delete_packed_pages is set.
+"""
+
+### Library import
+import pandas as pd
+import datetime
+import gzip
+import os
+
+import afklm_common
+from afklm_common import (
+    info_message, list_json_files, read_bytes, parse_page_name, load_archive_catalog,
+    import_csv, save_csv, exists, blob_path,
+    path_data_storage, path_archive_storage,
+)
+from afklm_codecs import detect_codec
+
+
+### Script parameters
+archive_granularity = "day"  # "day" or "route_day"
+min_age_days_to_pack = 2  # pages of more recent days are still being re-fetched (_sched, _updSchedD1)
+delete_packed_pages = False
+
+
+
+def archive_name(page_info:dict) -> str:
+    if archive_granularity == "route_day":
+        return f"date={page_info['date']}/route={page_info.get('origin', '')}-{page_info.get('destination', '')}.pack"
+    return f"date={page_info['date']}.pack"
+
+
+def archive_size(archive:str) -> int:
+    if not exists(path_archive_storage, archive):
+        return 0
+    if afklm_common.in_cloud:
+        blob = afklm_common.bucket.blob(blob_path(path_archive_storage, archive))
+        blob.reload()
+        return blob.size
+    return os.path.getsize(blob_path(path_archive_storage, archive))
+
+
+def append_to_archive(payload:bytes, archive:str) -> int:
+    # Appends payload to the archive and returns the offset it was written at
+    offset = archive_size(archive)
+
+    if afklm_common.in_cloud:
+        target = afklm_common.bucket.blob(blob_path(path_archive_storage, archive))
+        if offset == 0:
+            target.upload_from_string(payload)
+        else:
+            part = afklm_common.bucket.blob(blob_path(path_archive_storage, archive + ".part"))
+            part.upload_from_string(payload)
+            target.compose([target, part])
+            part.delete()
+
+    else:
+        os.makedirs(os.path.dirname(blob_path(path_archive_storage, archive)) or '.', exist_ok=True)
+        with open(blob_path(path_archive_storage, archive), 'ab') as f:
+            f.write(payload)
+
+    return offset
+
+
+def pages_to_pack() -> pd.DataFrame:
+    # Loose pages of days older than min_age_days_to_pack not yet packed (same name and generation)
+    catalog = load_archive_catalog(refresh=True)
+    last_day = (datetime.datetime.now().date() - datetime.timedelta(days=min_age_days_to_pack)).isoformat()
+
+    rows = []
+    for val in list_json_files(path_data_storage, include_archives=False):
+        page_info = parse_page_name(val['name'])
+        if page_info is None or page_info['date'] == '' or page_info['date'] > last_day:
+            continue
+        if catalog.get(val['name'], {}).get('generation') == str(val['generation']):
+            continue
+        rows.append(val | {'archive': archive_name(page_info)})
+
+    return pd.DataFrame(rows, columns=['name', 'path', 'size', 'updated', 'generation', 'archive'])
+
+
+def pack_archive(archive:str, pages:pd.DataFrame) -> pd.DataFrame:
+    members = []
+    for page in pages.itertuples():
+        payload = read_bytes(path_data_storage, page.path)
+        if detect_codec(payload) == "none":
+            payload = gzip.compress(payload)
+        members.append(payload)
+
+    offset = append_to_archive(b''.join(members), archive)
+
+    df_index = pages[['name', 'updated', 'generation']].copy()
+    df_index['length'] = [len(payload) for payload in members]
+    df_index['offset'] = offset + df_index['length'].cumsum() - df_index['length']
+
+    index_file = archive + ".index.csv"
+    if exists(path_archive_storage, index_file):
+        df_index = pd.concat([import_csv(path_archive_storage, index_file), df_index], ignore_index=True)
+    df_index = df_index.drop_duplicates('name', keep='last')[['name', 'offset', 'length', 'updated', 'generation']]
+    save_csv(df_index, path_archive_storage, index_file)
+
+    return df_index
+
+
+def delete_pages(pages:pd.DataFrame) -> None:
+    for path in pages['path']:
+        if afklm_common.in_cloud:
+            afklm_common.bucket.blob(blob_path(path_data_storage, path)).delete()
+        else:
+            os.remove(blob_path(path_data_storage, path))
+    return None
+
+
+def run_page_archive() -> None:
+    pages = pages_to_pack()
+    info_message(f"{len(pages)} pages to pack into {pages['archive'].nunique()} archives")
+
+    for archive, archive_pages in pages.groupby('archive'):
+        pack_archive(archive, archive_pages)
+        info_message(f"{archive}: {len(archive_pages)} pages packed", 'green')
+
+    # Pages are only removed once every index has been written
+    load_archive_catalog(refresh=True)
+    if delete_packed_pages:
+        delete_pages(pages)
+        info_message(f"{len(pages)} loose pages deleted", 'yellow')
+
+    return None
+
+
+def main():
+    run_page_archive()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Gap-aware page cursor for the collector fetch loop.
+
+The missing pages of a query, holes left by earlier failures included, are computed from the listing of the
+stored pages (catalog) and the state CSV (totalPages), so that the loop only iterates over the gaps.
+"""
+
+### Library import
+import re
+
+from afklm_common import parse_page_name, json_root
+
+
+
+def page_kind(date_diff:int) -> str:
+    # Suffix of the page file name depending on the day of the query relative to today
+    if date_diff > 0:
+        return "sched"
+    if date_diff == 0:
+        return "updSchedD1"
+    return ""
+
+
+def page_file_name(call_parameters_url:str, pageNumber:int, kind:str) -> str:
+    suffix = f"_{kind}" if kind else ""
+    return f"{json_root}{re.sub(':', '_', call_parameters_url)}_{pageNumber}{suffix}.json"
+
+
+def build_page_catalog(json_list:list) -> dict:
+    # {(call parameters as in the file name, kind): {page numbers stored}} built in one pass over the listing
+    catalog = {}
+    for name in json_list:
+        page_info = parse_page_name(name)
+        if page_info is None:
+            continue
+        catalog.setdefault((page_info['call_parameters'], page_info['kind']), {})[page_info['pageNumber']] = name
+    return catalog
+
+
+def stored_pages(catalog:dict, call_parameters_url:str, kind:str) -> dict:
+    # {page number: file name} of the pages already stored for a query
+    return catalog.setdefault((re.sub(':', '_', call_parameters_url), kind), {})
+
+
+def known_total_pages(totalPages) -> int:
+    # totalPages from the state CSV, None if not known yet
+    if totalPages in ('', None) or totalPages != totalPages:
+        return None
+    return int(float(totalPages))
+
+
+def missing_pages(stored:dict, total_pages:int, pageNumberStart:int = 0, max_page_to_fetch:int = None) -> list:
+    # Page numbers still to fetch; with an unknown total only the first missing page can be known
+    last_page = total_pages if total_pages is not None else max(stored, default=pageNumberStart - 1) + 2
+    if max_page_to_fetch is not None:
+        last_page = min(last_page, max_page_to_fetch)
+    return [page for page in range(pageNumberStart, last_page) if page not in stored]
+
+
+def next_missing_page(stored:dict, total_pages:int, pageNumberStart:int = 0, max_page_to_fetch:int = None):
+    pages = missing_pages(stored, total_pages, pageNumberStart, max_page_to_fetch)
+    return pages[0] if pages else None
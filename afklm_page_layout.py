@@ -0,0 +1,105 @@
+"""
+Migration of the page blobs between the flat and the partitioned layouts.
+
+In the partitioned layout a page is stored under the prefix of its day and route, with the same file name:
+    data/date=YYYY-MM-DD/route=ORIGIN-DESTINATION/afklm_api_data_collection_..._<page>.json.gz
+so list_page_partitions (afklm_common.py) lists only the prefixes needed.
+
+The pages are moved in parallel (copy then delete in the cloud, rename locally); the cloud copy keeps the
+generation and time of the original page in its metadata, so the incremental stages do not process it again.
+The migration can be interrupted and re-run at any time, both layouts are read while it runs.
+
+Set page_layout = "partitioned" in afklm_common.py once the migration is started, so the collector writes the
+new pages at their target place and the listings and incremental stages read the same layout.
+
+Usage:
+    python afklm_page_layout.py [partitioned|flat]
+"""
+
+### Library import
+import pandas as pd
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import afklm_common
+from afklm_common import (
+    info_message, list_files, is_page_file, page_path, blob_path, refresh_listings, path_data_storage,
+    version_metadata, observed_at_metadata,
+)
+
+try:
+    from google.api_core.exceptions import NotFound, PreconditionFailed
+except ImportError:
+    NotFound = PreconditionFailed = OSError
+
+
+### Script parameters
+target_layout = "partitioned"  # "partitioned" or "flat"
+migration_workers = 16
+max_pages_per_run = None  # to spread a large migration over several runs
+
+
+
+def pages_to_move(layout:str) -> pd.DataFrame:
+    # every page blob (a page found at both places is listed twice) with its path in the target layout
+    files = [val for val in list_files(path_data_storage) if is_page_file(val['name'].rsplit('/', 1)[-1])]
+    pages = pd.DataFrame(files, columns=['name', 'generation']).rename(columns={'name': 'path'})
+    # generation and time the incremental stages know the page by, kept by the copy (see rewrite_page)
+    pages['identity'] = [
+        {version_metadata: str(val['generation']), observed_at_metadata: str(val['updated'])} | (val.get('metadata') or {})
+        for val in files
+    ]
+    pages['name'] = pages['path'].str.rsplit('/', n=1).str[-1]
+    pages['target'] = [page_path(name, layout) for name in pages['name']]
+    return pages[pages['path'] != pages['target']].reset_index(drop=True)
+
+
+def move_page(path:str, target:str, generation, identity:dict = None) -> str:
+    if afklm_common.in_cloud:
+        source = afklm_common.bucket.blob(blob_path(path_data_storage, path))
+        try:
+            # only copied if no page at the target yet (an interrupted run may have copied it already)
+            copy = afklm_common.bucket.copy_blob(source, afklm_common.bucket, blob_path(path_data_storage, target), if_generation_match=0)
+            if identity:
+                copy.metadata = identity
+                copy.patch()
+        except PreconditionFailed:
+            pass
+        try:
+            source.delete(if_generation_match=generation)
+        except (NotFound, PreconditionFailed):
+            return "skipped"
+        return "moved"
+
+    source, destination = blob_path(path_data_storage, path), blob_path(path_data_storage, target)
+    if not os.path.exists(source):
+        return "skipped"
+    if os.path.exists(destination):
+        os.remove(source)
+        return "moved"
+    os.renames(source, destination)
+    return "moved"
+
+
+def migrate_pages(layout:str = target_layout) -> pd.Series:
+    pages = pages_to_move(layout)
+    if max_pages_per_run is not None:
+        pages = pages.head(max_pages_per_run)
+    info_message(f"{len(pages)} pages to move to the {layout} layout")
+
+    with ThreadPoolExecutor(max_workers=migration_workers) as executor:
+        results = list(executor.map(move_page, pages['path'], pages['target'], pages['generation'], pages['identity']))
+
+    refresh_listings()
+    summary = pd.Series(results, dtype=str).value_counts()
+    info_message(f"migration to the {layout} layout: {summary.to_dict()}", 'green')
+    return summary
+
+
+def main():
+    migrate_pages(sys.argv[1] if len(sys.argv) > 1 else target_layout)
+
+
+if __name__ == "__main__":
+    main()
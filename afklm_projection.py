@@ -0,0 +1,118 @@
+"""
+Field projection of the stored pages: only the attributes we consume are kept.
+
+With page_projection set in the collector, a page is reduced at write time to the JSON paths of
+projection_spec ("[]" walks every element of a list). By default the spec is made of the paths read by
+afklm_flights.py plus the page block, i.e. everything the derived stages use.
+
+A sample of the pages (raw_sample_rate, chosen from the page name so that a page is always treated the same
+way) keeps the full raw payload, to still be able to look at new fields. Slim pages carry a "_projection" key
+with the id of the spec they were reduced with; a page reduced with another spec is projected again (the
+paths dropped by the former spec cannot come back).
+
+The pages packed into an archive (afklm_page_archive.py) are read from it, even when the loose blob was kept,
+so only the loose pages never packed are projected afterwards, rewritten in place (rewrite_page keeps the
+generation and updated time the incremental stages key on):
+    python afklm_projection.py rewrite
+"""
+
+### Library import
+import pandas as pd
+import hashlib
+import sys
+
+from afklm_common import info_message, list_json_files, load_archive_catalog, read_bytes, rewrite_page, path_data_storage
+from afklm_codecs import detect_codec, detect_format, decode_bytes, deserialize, encode_page
+from afklm_flights import flight_fields, leg_fields
+
+
+### Script parameters
+projection_spec = (
+    ["page"]
+    + [f"operationalFlights[].{path}" for path in flight_fields.values()]
+    + [f"operationalFlights[].flightLegs[].{path}" for path in leg_fields.values()]
+)
+raw_sample_rate = 0.01
+max_pages_per_run = None
+
+
+
+def projection_id(spec:list = projection_spec) -> str:
+    return hashlib.sha1("\n".join(sorted(spec)).encode()).hexdigest()[:8]
+
+
+def projection_tree(spec:list) -> dict:
+    # {"operationalFlights[]": {"flightNumber": True, ...}, "page": True}: True keeps the whole value
+    tree = {}
+    for path in spec:
+        node = tree
+        keys = path.split('.')
+        for key in keys[:-1]:
+            child = node.setdefault(key, {})
+            if child is True:
+                break
+            node = child
+        else:
+            node[keys[-1]] = True
+    return tree
+
+
+def project(value, tree):
+    if tree is True or not isinstance(value, dict):
+        return value
+
+    projected = {}
+    for key, subtree in tree.items():
+        if key.endswith("[]"):
+            items = value.get(key[:-2])
+            if isinstance(items, list):
+                projected[key[:-2]] = [project(item, subtree) for item in items]
+        elif key in value:
+            projected[key] = project(value[key], subtree)
+    return projected
+
+
+def keep_raw(file_name:str) -> bool:
+    # deterministic sample of the pages kept with their full payload
+    return int(hashlib.sha1(file_name.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF < raw_sample_rate
+
+
+def project_page(data:dict, file_name:str, spec:list = projection_spec) -> dict:
+    if keep_raw(file_name) or data.get('_projection') == projection_id(spec):
+        return data
+    return project(data, projection_tree(spec)) | {'_projection': projection_id(spec)}
+
+
+def rewrite_pages(spec:list = projection_spec) -> pd.DataFrame:
+    archived = load_archive_catalog(refresh=True)
+    pages = [page for page in list_json_files(path_data_storage, include_archives=False) if page['name'] not in archived]
+    if max_pages_per_run is not None:
+        pages = pages[:max_pages_per_run]
+    info_message(f"{len(pages)} loose pages to project, {len(archived)} archived pages left out")
+
+    results = []
+    for page in pages:
+        payload = read_bytes(path_data_storage, page['path'])
+        raw = decode_bytes(payload)
+        data = deserialize(raw)
+        projected = project_page(data, page['name'], spec)
+        if projected is data:
+            results.append({'name': page['name'], 'bytes_before': len(payload), 'bytes_after': len(payload)})
+            continue
+
+        new_payload = encode_page(projected, detect_codec(payload), detect_format(raw))
+        rewrite_page(new_payload, page)
+        results.append({'name': page['name'], 'bytes_before': len(payload), 'bytes_after': len(new_payload)})
+
+    df = pd.DataFrame(results, columns=['name', 'bytes_before', 'bytes_after'])
+    info_message(f"{df['bytes_before'].sum()} bytes -> {df['bytes_after'].sum()} bytes", 'green')
+    return df
+
+
+def main():
+    if sys.argv[1:] == ["rewrite"]:
+        rewrite_pages()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Planner collapsing the route-day rows of the call-parameter files into fewer, broader API queries.
+
+Each parameter row queries one origin / destination pair for one day, so a hub with 200 spokes costs 200+ calls
+a day. The flightstatus API also accepts broader filters: a query on the origin only (or the destination only)
+returns every flight of the day out of (into) that airport, in pages of page_size flights.
+
+1. plan: for every day, the pending route rows (never queried, only origin / destination / day set) are covered
+   with a greedy weighted set cover over the candidate queries (the route itself, its origin only, its
+   destination only). The cost of a query is its estimated number of pages, from the median totalFlights of
+   each route in the state CSVs; a broad query also returns the routes we do not track (broad_query_overhead).
+   The chosen broad queries are written as parameter rows to planned_parameter_file, that the collector picks
+   up like any df_call_parameters*.csv file (but never extends to new dates: only the planner writes it), and
+   the covered route rows are marked as planned in their message, so that the collector skips them.
+2. split_back: once a broad query is complete, its pages are split locally per route and the covered route
+   rows get their bookkeeping (response, totalFlights, completion). Coverage is recorded per refresh window
+   (sched, updSchedD1, final): when the broad query is retrieved again with a later page kind, its new pages
+   are split again. If it failed before any split, the route rows are released and will be queried one by one.
+
+The plan ledger (path_plan/plan_file) lists every broad query with the route rows it covers, its status and
+the windows split so far.
+
+Usage:
+    python afklm_query_planner.py [plan|split_back]
+"""
+
+### Library import
+import pandas as pd
+import numpy as np
+import datetime
+import re
+import sys
+
+from afklm_common import (
+    info_message, list_files, list_page_partitions, open_json, import_csv, save_csv, exists, page_kinds,
+    path_data_storage, path_call_parameter_file_folder,
+)
+from afklm_flights import flight_legs_dataframe
+from afklm_page_cursor import build_page_catalog
+from afklm_retry import response_status, classify_failure
+from afklm_tables import import_table, save_table
+
+
+### Script parameters
+page_size = 100  # flights per page returned by the API
+default_route_flights = 10  # estimate for a route without history
+broad_query_overhead = 1.5  # flights of the routes we do not track returned by a broad query
+min_routes_per_broad_query = 3
+planned_parameter_file = "df_call_parameters_planned.csv"
+path_plan = "derived"
+plan_file = "afklm_query_plan.csv"
+
+route_columns = ['origin', 'destination', 'startRange', 'endRange']
+state_columns = [
+    "call_parameters", "response", "message", "timestamp", "nb_of_pages_already_retrieved",
+    "totalPages", "completion", "totalFlights", "retry_count", "next_retry",
+]
+plan_columns = ['call_parameters', 'date', 'kind', 'airport', 'estimated_pages', 'routes', 'status', 'windows']
+covered_messages = ("planned in ", "covered by ")
+
+
+
+def call_parameters_url(row:dict, columns:list) -> str:
+    # same query string as the collector: non-empty parameters in the column order of the file
+    return "&".join(f"{col}={row[col]}" for col in columns if col not in state_columns and str(row.get(col, '')) not in ('', 'nan'))
+
+
+def covered_by_plan(message) -> bool:
+    # route row queried through a broad query, never on its own
+    return str(message).startswith(covered_messages)
+
+
+def estimated_pages(flights:float) -> int:
+    return max(1, int(np.ceil(flights / page_size)))
+
+
+def load_parameter_tables() -> dict:
+    files = [
+        val['name'] for val in list_files(path_call_parameter_file_folder)
+        if 'df_call_parameters' in val['name'] and val['name'].endswith(".csv") and val['name'] != planned_parameter_file
+    ]
+    return {name: import_table(path_call_parameter_file_folder, name, typed=False).fillna('').astype(str) for name in files}
+
+
+def load_plan() -> pd.DataFrame:
+    if exists(path_plan, plan_file):
+        return import_csv(path_plan, plan_file).reindex(columns=plan_columns).fillna('').astype(str)
+    return pd.DataFrame(columns=plan_columns)
+
+
+def route_flights_history(tables:dict) -> pd.Series:
+    # median totalFlights per (origin, destination) over the queries already done
+    rows = pd.concat([df.reindex(columns=['origin', 'destination', 'totalFlights']) for df in tables.values()], ignore_index=True)
+    rows['totalFlights'] = pd.to_numeric(rows['totalFlights'], errors='coerce')
+    return rows.dropna().groupby(['origin', 'destination'])['totalFlights'].median()
+
+
+def pending_route_days(tables:dict) -> pd.DataFrame:
+    # rows never queried, with only origin / destination and a one-day window set
+    pending = []
+    for name, df in tables.items():
+        other_parameters = [col for col in df.columns if col not in route_columns + state_columns]
+        is_pending = (
+            (df['origin'].astype(str) != '') & (df['destination'].astype(str) != '')
+            & (df['startRange'].astype(str).str[:10] == df['endRange'].astype(str).str[:10])
+            & (df.get('response', pd.Series('', index=df.index)).astype(str) == '')
+            & (df.get('completion', pd.Series('', index=df.index)).astype(str) == '')
+            & (df.get('message', pd.Series('', index=df.index)).astype(str) == '')
+            & (df[other_parameters].astype(str) == '').all(axis=1)
+        )
+        rows = df.loc[is_pending, route_columns].astype(str).assign(file=name)
+        pending.append(rows)
+    pending = pd.concat(pending, ignore_index=True) if pending else pd.DataFrame(columns=route_columns + ['file'])
+    pending['date'] = pending['startRange'].str[:10]
+    return pending
+
+
+def plan_day(wanted:pd.DataFrame, flights:pd.Series) -> list:
+    # greedy weighted set cover of the wanted routes of one day: [(kind, airport or route, routes covered, pages)]
+    route_flights = {route: flights.get(route, default_route_flights) for route in zip(wanted['origin'], wanted['destination'])}
+    known = flights.to_dict() | route_flights
+
+    candidates = [('route', f"{origin}-{destination}", {(origin, destination)}, estimated_pages(count)) for (origin, destination), count in route_flights.items()]
+    for kind, position in (('origin', 0), ('destination', 1)):
+        for airport in set(route[position] for route in route_flights):
+            covered = set(route for route in route_flights if route[position] == airport)
+            traffic = sum(count for route, count in known.items() if route[position] == airport) * broad_query_overhead
+            if len(covered) >= min_routes_per_broad_query:
+                candidates.append((kind, airport, covered, estimated_pages(traffic)))
+
+    plan, uncovered = [], set(route_flights)
+    while uncovered:
+        kind, key, covered, pages = min(
+            (candidate for candidate in candidates if candidate[2] & uncovered),
+            key=lambda candidate: (candidate[3] / len(candidate[2] & uncovered), candidate[0] == 'route'),
+        )
+        plan.append((kind, key, covered & uncovered, pages))
+        uncovered -= covered
+    return plan
+
+
+def plan_queries() -> pd.DataFrame:
+    tables = load_parameter_tables()
+    pending = pending_route_days(tables)
+    flights = route_flights_history(tables)
+    info_message(f"{len(pending)} pending route-days to plan")
+    if len(pending) == 0:
+        return load_plan()
+
+    columns = list(next(iter(tables.values())).columns)
+    planned_rows, ledger = [], []
+    for date, wanted in pending.groupby('date'):
+        for kind, airport, covered, pages in plan_day(wanted, flights):
+            if kind == 'route':
+                continue
+            row = {col: '' for col in columns} | {kind: airport, 'startRange': f"{date}T00:00:00Z", 'endRange': f"{date}T23:59:59Z"}
+            call_parameters = call_parameters_url(row, columns)
+            planned_rows.append(row)
+            covered_rows = wanted[[route in covered for route in zip(wanted['origin'], wanted['destination'])]]
+            ledger.append({
+                'call_parameters': call_parameters, 'date': date, 'kind': kind, 'airport': airport, 'estimated_pages': pages,
+                'routes': ";".join(f"{val.file}|{val.origin}|{val.destination}|{val.startRange}" for val in covered_rows.itertuples()),
+                'status': 'planned', 'windows': '',
+            })
+
+            # covered route rows are skipped by the collector until split_back
+            for file, rows in covered_rows.groupby('file'):
+                df = tables[file]
+                mask = df['startRange'].astype(str).isin(rows['startRange']) & pd.Series(
+                    list(zip(df['origin'], df['destination'])), index=df.index).isin(list(zip(rows['origin'], rows['destination'])))
+                df.loc[mask, 'message'] = f"{covered_messages[0]}{call_parameters}"
+
+    ledger = pd.DataFrame(ledger, columns=plan_columns)
+    info_message(f"{len(ledger)} broad queries planned, covering {ledger['routes'].str.count(';').add(1).sum() if len(ledger) else 0} route-days", 'green')
+    if len(ledger) == 0:
+        return load_plan()
+
+    # parameter rows first, then the route rows and the ledger
+    df_planned = pd.DataFrame(planned_rows, columns=columns)
+    if exists(path_call_parameter_file_folder, planned_parameter_file):
+        df_planned = pd.concat([import_table(path_call_parameter_file_folder, planned_parameter_file, typed=False).fillna('').astype(str), df_planned], ignore_index=True)
+    save_table(df_planned, path_call_parameter_file_folder, planned_parameter_file)
+    for file, df in tables.items():
+        save_table(df, path_call_parameter_file_folder, file)
+
+    ledger = pd.concat([load_plan(), ledger], ignore_index=True)
+    save_csv(ledger, path_plan, plan_file)
+    return ledger
+
+
+def broad_query_pages(catalog:dict, call_parameters:str) -> tuple:
+    # (window, pages) of the most final kind available (past window > updSchedD1 > sched)
+    key = re.sub(':', '_', call_parameters)
+    kinds = [kind for kind in page_kinds if (key, kind) in catalog]
+    if not kinds:
+        return '', []
+    kind = max(kinds, key=lambda kind: page_kinds[kind])
+    return kind or "final", list(catalog[(key, kind)].values())
+
+
+def split_back() -> pd.DataFrame:
+    ledger = load_plan()
+    open_plans = ledger[ledger['status'] != 'released']
+    if len(open_plans) == 0 or not exists(path_call_parameter_file_folder, planned_parameter_file):
+        return ledger
+
+    df_planned = import_table(path_call_parameter_file_folder, planned_parameter_file, typed=False).fillna('').astype(str)
+    state = df_planned.drop_duplicates('call_parameters', keep='last').set_index('call_parameters')
+    tables = load_parameter_tables()
+    catalog = build_page_catalog([val['name'] for val in list_page_partitions(open_plans['date'].unique().tolist(), path_data_storage=path_data_storage)])
+    now = datetime.datetime.now().isoformat()
+
+    for index, plan in open_plans.iterrows():
+        if plan['call_parameters'] not in state.index:
+            continue
+        broad = state.loc[plan['call_parameters']]
+        failed = classify_failure(response_status(broad['response'])) != "none" and str(broad.get('next_retry', '')) == ''
+        complete = pd.to_numeric(broad['completion'], errors='coerce') == 100
+        window, pages = broad_query_pages(catalog, plan['call_parameters']) if complete else ('', [])
+        windows = [val for val in plan['windows'].split(';') if val != '']
+        if complete and (window == '' or window in windows):
+            continue
+        if not complete and not (failed and plan['status'] == 'planned'):
+            continue
+
+        counts = pd.Series(dtype=int)
+        legs = [flight_legs_dataframe(open_json(path_data_storage, name)) for name in pages]
+        if legs:
+            counts = pd.concat(legs, ignore_index=True).drop_duplicates('flight_key').groupby(['origin', 'destination']).size()
+
+        for route in plan['routes'].split(';'):
+            file, origin, destination, start_range = route.split('|')
+            df = tables.get(file)
+            if df is None:
+                continue
+            mask = (df['origin'].astype(str) == origin) & (df['destination'].astype(str) == destination) & (df['startRange'].astype(str) == start_range)
+            if complete:
+                df.loc[mask, ['response', 'message', 'timestamp', 'totalFlights', 'completion']] = [
+                    str(broad['response']), f"{covered_messages[1]}{plan['call_parameters']} ({window})", now,
+                    str(int(counts.get((origin, destination), 0))), '100']
+            else:
+                # queried one by one from now on (and never planned again)
+                df.loc[mask, ['message', 'completion']] = [f"released from {plan['call_parameters']}", '']
+        ledger.loc[index, ['status', 'windows']] = ['split', ";".join(windows + [window])] if complete else ['released', '']
+
+    for file, df in tables.items():
+        save_table(df, path_call_parameter_file_folder, file)
+    save_csv(ledger, path_plan, plan_file)
+    info_message(ledger['status'].value_counts().to_string(), 'green')
+    return ledger
+
+
+def main():
+    if sys.argv[1:] == ["split_back"]:
+        split_back()
+    else:
+        plan_queries()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Lightweight query-state records for the fetch loop of the collector.
+
+QueryState keeps the parameters of a row (dict) and its state columns as __slots__ attributes. The rows of a
+parameter file are turned into records once, updated in place by the loop, and turned back into a DataFrame
+in bulk only when the state is checkpointed (query_table before save_csv), every state_checkpoint_pages pages
+of the collector.
+
+Usage:
+    python afklm_query_state.py  # per-page cost of the loop bookkeeping, state CSV saves included
+"""
+
+### Library import
+import pandas as pd
+import os
+import tempfile
+import time
+
+from afklm_common import info_message
+
+
+### Script parameters
+benchmark_rows = 2000
+benchmark_pages = 500
+benchmark_checkpoint_pages = 20  # state_checkpoint_pages of the collector
+
+state_columns = [
+    "call_parameters", "response", "message", "timestamp",
+    "nb_of_pages_already_retrieved", "totalPages", "completion", "totalFlights",
+    "retry_count", "next_retry",
+]
+
+
+
+class QueryState:
+    __slots__ = ["parameters"] + state_columns
+
+    def __init__(self, parameters:dict, **state):
+        self.parameters = parameters
+        for col in state_columns:
+            setattr(self, col, state.get(col, ''))
+
+    def as_record(self) -> dict:
+        return self.parameters | {col: getattr(self, col) for col in state_columns}
+
+
+
+def query_states_from_table(df:pd.DataFrame, non_parameters:list) -> list:
+    # One QueryState per row of a parameter file (NaN read as ''), duplicated parameters kept once (last row)
+    states = {}
+    for record in df.fillna('').to_dict(orient="records"):
+        parameters = {key: val for key, val in record.items() if key not in non_parameters}
+        state = {key: val for key, val in record.items() if key in state_columns}
+        key = tuple(str(val) for val in parameters.values())
+        states.pop(key, None)
+        states[key] = QueryState(parameters, **state)
+    return list(states.values())
+
+
+def query_table(states:list, columns:list) -> pd.DataFrame:
+    # State table of the records, built column by column, with the columns of the file first
+    parameter_columns = list(states[0].parameters) if states else [col for col in columns if col not in state_columns]
+    table = {col: [state.parameters[col] for state in states] for col in parameter_columns}
+    table |= {col: [getattr(state, col) for state in states] for col in state_columns}
+    columns = list(columns) + [col for col in table if col not in columns]
+    return pd.DataFrame(table, columns=columns).fillna('')
+
+
+
+def benchmark_table() -> pd.DataFrame:
+    dates = pd.date_range("2025-07-01", periods=benchmark_rows, freq="h").strftime("%Y-%m-%dT%H:00:00Z")
+    df = pd.DataFrame({'destination': 'AMS', 'origin': 'SVQ', 'endRange': dates, 'startRange': dates})
+    for col in state_columns:
+        df[col] = ''
+    # columns as read from a state CSV with fillna('') (mixed values)
+    return df.astype(object)
+
+
+def page_update_dataframe(df_call_parameters:pd.DataFrame, df_call_parameters_new:pd.DataFrame, i:int) -> pd.DataFrame:
+    # per-page work of the former loop (without the API call and the save)
+    df_subset = df_call_parameters.iloc[[i]].copy(deep=True).reset_index().drop(['index'], axis=1)
+    parameter_list = df_subset.drop(state_columns, axis=1, errors='ignore').columns.to_list()
+    dict_call_parameters = df_subset.drop(state_columns, axis=1, errors='ignore').to_dict(orient="list")
+    call_parameters_url = "&".join([key + "=" + str(val[0]) for key, val in dict_call_parameters.items() if val[0] != ''])
+    df_subset['endRange'].item() < df_subset['startRange'].item()
+    df_subset.loc[0, ['timestamp']] = "2025-07-01T00:00:00"
+    df_subset.loc[0, ['call_parameters']] = call_parameters_url
+    df_subset.loc[0, ['nb_of_pages_already_retrieved']] = 1.0
+    df_subset.loc[0, ['response']] = "<Response [200]>"
+    df_subset.loc[0, ['totalPages']] = 1.0
+    df_subset.loc[0, ['totalFlights']] = 10.0
+    df_subset.loc[0, ['completion']] = 100.0
+    df_subset.loc[0, ['message']] = ""
+    df_subset.loc[0, 'retry_count'] = ''
+    df_subset.loc[0, 'next_retry'] = ''
+    df_call_parameters_new = pd.concat([df_call_parameters_new, df_subset], ignore_index=True)
+    return df_call_parameters_new.drop_duplicates(subset=parameter_list, keep='last').fillna('')
+
+
+def page_update_records(query:QueryState) -> None:
+    call_parameters_url = "&".join([key + "=" + str(val) for key, val in query.parameters.items() if val != ''])
+    query.parameters['endRange'] < query.parameters['startRange']
+    query.timestamp = "2025-07-01T00:00:00"
+    query.call_parameters = call_parameters_url
+    query.nb_of_pages_already_retrieved = 1.0
+    query.response = "<Response [200]>"
+    query.totalPages = 1.0
+    query.totalFlights = 10.0
+    query.completion = 100.0
+    query.message = ""
+    query.retry_count = ''
+    query.next_retry = ''
+    return None
+
+
+def run_benchmark() -> pd.DataFrame:
+    # end-to-end bookkeeping per page: record updates, plus query_table and the CSV write of each checkpoint
+    # (written to a local temporary folder, a GCS upload adds its round trip to every checkpoint)
+    df = benchmark_table()
+    pages = min(benchmark_pages, benchmark_rows)
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        path_csv = os.path.join(folder, "df_call_parameters.csv")
+
+        start = time.perf_counter()
+        df_new = df.copy(deep=True)
+        for i in range(pages):
+            df_new = page_update_dataframe(df, df_new, i)
+            df_new.to_csv(path_csv, index=False)
+        results.append({'loop': 'one-row DataFrame, saved every page', 'seconds': time.perf_counter() - start})
+
+        for checkpoint_pages in (1, benchmark_checkpoint_pages):
+            start = time.perf_counter()
+            states = query_states_from_table(df, state_columns)
+            for i in range(pages):
+                page_update_records(states[i])
+                if (i + 1) % checkpoint_pages == 0 or i == pages - 1:
+                    query_table(states, df.columns).to_csv(path_csv, index=False)
+            results.append({'loop': f'QueryState, saved every {checkpoint_pages} pages', 'seconds': time.perf_counter() - start})
+
+    results = pd.DataFrame(results)
+    results['ms_per_page'] = 1e3 * results['seconds'] / pages
+    info_message(f"{pages} pages over a state table of {benchmark_rows} rows")
+    info_message(results.to_string(index=False))
+    return results
+
+
+def main():
+    run_benchmark()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Adaptive refresh of the future and D-1 windows, from the change rate observed on each route.
+
+1. learn: from the pages processed by afklm_snapshot_diff.py and its change logs, the share of refreshes (a
+   window retrieved again with a later page kind) that brought a change, per route, Beta-smoothed towards the
+   rate over all routes (prior_weight pseudo-refreshes).
+2. plan: every complete row of today and the future days is a candidate. Its chance of having changed since
+   its pages were fetched grows with their age: 1 - (1 - p) ** (age / change_horizon_days), p being the route
+   change probability (full p once the pages are change_horizon_days old, or when today's window only has
+   older-kind pages). Candidates are ranked by that chance per estimated page and reopened while
+   refresh_quota_share of the calls left today lasts; pages younger than min_refresh_age_days and chances
+   under min_change_probability are skipped. A reopened future window is retrieved again as _sched pages.
+
+Every decision (refresh, skip_recent, skip_low_probability, skip_budget) is written with its inputs to
+path_refresh/afklm_refresh_decisions_<run>.csv for audit.
+
+Usage:
+    python afklm_refresh_policy.py learn  # change probability of every route
+    python afklm_refresh_policy.py plan <calls left>
+"""
+
+### Library import
+import pandas as pd
+import datetime
+import sys
+
+from afklm_common import (
+    info_message, list_files, list_json_files, parse_page_name, page_kinds, import_parquet, save_csv,
+    load_processed_pages, path_call_parameter_file_folder, path_data_storage,
+)
+from afklm_page_cursor import build_page_catalog, page_kind, known_total_pages
+from afklm_query_planner import load_parameter_tables, call_parameters_url
+from afklm_tables import save_table
+from afklm_snapshot_diff import path_changes, path_derived, processed_file
+
+
+### Script parameters
+prior_weight = 5  # pseudo-refreshes of the prior
+default_change_rate = 0.5  # prior when no refresh was observed yet
+min_change_probability = 0.05
+change_horizon_days = 7  # age of the pages at which the route change probability fully applies
+min_refresh_age_days = 1
+refresh_message = "refresh "  # message of the reopened rows, their stored pages are retrieved again
+refresh_quota_share = 0.5  # share of the calls left today usable by refreshes
+path_refresh = "derived/refresh"
+
+decision_columns = [
+    'file', 'call_parameters', 'origin', 'destination', 'date', 'from_kind', 'to_kind', 'page_age_days',
+    'refreshes_observed', 'changed_refreshes', 'change_probability', 'window_change_probability',
+    'estimated_pages', 'score', 'decision',
+]
+
+
+
+def refresh_requested(message) -> bool:
+    # row reopened by plan_refreshes: the collector retrieves its pages again even if they are stored
+    return str(message).startswith(refresh_message)
+
+
+def page_windows(names) -> pd.DataFrame:
+    # (origin, destination, date, kind) of the page names
+    infos = [parse_page_name(name) for name in names]
+    return pd.DataFrame(
+        [(name, info.get('origin', ''), info.get('destination', ''), info['date'], info['kind'])
+         for name, info in zip(names, infos) if info is not None],
+        columns=['page', 'origin', 'destination', 'date', 'kind'])
+
+
+def load_changes() -> pd.DataFrame:
+    files = [val['name'] for val in list_files(path_changes) if val['name'].endswith(".parquet")]
+    if not files:
+        return pd.DataFrame(columns=['page', 'change_type'])
+    return pd.concat([import_parquet(path_changes, name)[['page', 'change_type']] for name in files], ignore_index=True)
+
+
+def route_change_rates() -> pd.DataFrame:
+    # refreshes observed and changed per (origin, destination), with the smoothed change probability
+    windows = page_windows(load_processed_pages(path_derived, processed_file)['name'].tolist())
+    windows = windows[(windows['origin'] != '') & (windows['destination'] != '')]
+    snapshots = windows.drop_duplicates(['origin', 'destination', 'date', 'kind']).copy()
+    snapshots['kind_rank'] = snapshots['kind'].map(page_kinds)
+    first_rank = snapshots.groupby(['origin', 'destination', 'date'])['kind_rank'].transform('min')
+    refreshes = snapshots[snapshots['kind_rank'] > first_rank]
+
+    # a refresh changed when one of its pages brought a change (a flight appearing in a refresh included)
+    changed_pages = set(load_changes()['page'])
+    changed = windows[windows['page'].isin(changed_pages)].drop_duplicates(['origin', 'destination', 'date', 'kind'])
+    changed = refreshes.merge(changed[['origin', 'destination', 'date', 'kind']], on=['origin', 'destination', 'date', 'kind'])
+
+    rates = pd.concat([
+        refreshes.groupby(['origin', 'destination']).size().rename('refreshes_observed'),
+        changed.groupby(['origin', 'destination']).size().rename('changed_refreshes'),
+    ], axis=1).fillna(0).astype(int)
+
+    prior = rates['changed_refreshes'].sum() / rates['refreshes_observed'].sum() if rates['refreshes_observed'].sum() else default_change_rate
+    rates['change_probability'] = (rates['changed_refreshes'] + prior * prior_weight) / (rates['refreshes_observed'] + prior_weight)
+    rates.attrs['prior'] = prior
+    return rates
+
+
+def refresh_candidates(tables:dict, catalog:dict, today:datetime.date, page_times:dict = None) -> pd.DataFrame:
+    # complete rows of today and the future days with stored pages, with the age (days) of their latest pages.
+    # page_times: page name -> time it was stored (updated of the listing), age 0 when unknown
+    page_times = page_times or {}
+    candidates = []
+    for name, df in tables.items():
+        columns = list(df.columns)
+        is_candidate = (
+            (df['origin'] != '') & (df['destination'] != '')
+            & (pd.to_numeric(df['completion'], errors='coerce') == 100)
+            & (df['startRange'].str[:10] >= today.isoformat())
+        )
+        for index, row in df[is_candidate].iterrows():
+            date_diff = (datetime.date.fromisoformat(row['startRange'][:10]) - today).days
+            call_parameters = row['call_parameters'] or call_parameters_url(row, columns)
+            key = call_parameters.replace(':', '_')
+            stored_kinds = [kind for kind in page_kinds if catalog.get((key, kind))]
+            if not stored_kinds:
+                continue
+            from_kind = max(stored_kinds, key=page_kinds.get)
+            stored_at = [page_times[page] for page in catalog[(key, from_kind)].values() if page_times.get(page)]
+            page_age = (today - datetime.datetime.fromisoformat(str(max(stored_at))).date()).days if stored_at else 0
+            candidates.append({
+                'file': name, 'index': index, 'call_parameters': call_parameters,
+                'origin': row['origin'], 'destination': row['destination'], 'date': row['startRange'][:10],
+                'from_kind': from_kind, 'to_kind': page_kind(date_diff), 'page_age_days': page_age,
+                'estimated_pages': max(1, known_total_pages(row['totalPages']) or 1),
+            })
+    return pd.DataFrame(candidates, columns=['file', 'index', 'call_parameters', 'origin', 'destination', 'date', 'from_kind', 'to_kind', 'page_age_days', 'estimated_pages'])
+
+
+def decide_refreshes(candidates:pd.DataFrame, rates:pd.DataFrame, nb_calls_left:int) -> pd.DataFrame:
+    prior = rates.attrs.get('prior', default_change_rate)
+    df = candidates.merge(rates.reset_index(), how='left', on=['origin', 'destination'])
+    df[['refreshes_observed', 'changed_refreshes']] = df[['refreshes_observed', 'changed_refreshes']].fillna(0).astype(int)
+    df['change_probability'] = df['change_probability'].fillna(prior)
+    if 'page_age_days' not in df.columns:
+        df['page_age_days'] = change_horizon_days
+    if 'from_kind' not in df.columns:
+        df['from_kind'] = df['to_kind'] = ''
+
+    # chance of a change since the pages were fetched, the full route probability for a new page kind
+    upgrade = df['from_kind'].map(page_kinds) < df['to_kind'].map(page_kinds)
+    exposure = (df['page_age_days'] / change_horizon_days).clip(upper=1).where(~upgrade, 1)
+    df['window_change_probability'] = 1 - (1 - df['change_probability']) ** exposure
+    df['score'] = df['window_change_probability'] / df['estimated_pages']
+    df = df.sort_values(['score', 'date'], ascending=[False, True], kind='stable').reset_index(drop=True)
+
+    budget = int(nb_calls_left * refresh_quota_share)
+    decisions = []
+    for row in df.itertuples():
+        if (row.page_age_days < min_refresh_age_days) and not upgrade[row.Index]:
+            decisions.append('skip_recent')
+        elif row.window_change_probability < min_change_probability:
+            decisions.append('skip_low_probability')
+        elif row.estimated_pages <= budget:
+            decisions.append('refresh')
+            budget -= row.estimated_pages
+        else:
+            decisions.append('skip_budget')
+    df['decision'] = decisions
+    return df
+
+
+def plan_refreshes(nb_calls_left:int, today:datetime.date = None) -> pd.DataFrame:
+    today = today or datetime.datetime.now().date()
+    tables = load_parameter_tables()
+    pages = list_json_files(path_data_storage)
+    catalog = build_page_catalog([val['name'] for val in pages])
+    rates = route_change_rates()
+    candidates = refresh_candidates(tables, catalog, today, {val['name']: val['updated'] for val in pages})
+    decisions = decide_refreshes(candidates, rates, nb_calls_left)
+    info_message(f"{len(decisions)} windows to consider for a refresh, {nb_calls_left} calls left today, prior change rate {rates.attrs['prior']:.2f}")
+
+    # reopened rows are retrieved again by the collector, as pages of today's kind (over the stored ones)
+    refreshed = decisions[decisions['decision'] == 'refresh']
+    for file, rows in refreshed.groupby('file'):
+        df = tables[file]
+        df.loc[rows['index'], ['nb_of_pages_already_retrieved', 'totalPages', 'completion']] = ''
+        df.loc[rows['index'], 'message'] = [
+            f"{refresh_message}{val.from_kind} -> {val.to_kind} ({val.page_age_days} days old, p={val.window_change_probability:.2f})"
+            for val in rows.itertuples()]
+        save_table(df, path_call_parameter_file_folder, file)
+
+    run_id = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    save_csv(decisions[decision_columns], path_refresh, f"afklm_refresh_decisions_{run_id}.csv")
+    if len(decisions):
+        info_message(decisions['decision'].value_counts().to_string(), 'green')
+    return decisions
+
+
+def main():
+    if sys.argv[1:2] == ["plan"]:
+        plan_refreshes(int(sys.argv[2]) if len(sys.argv) > 2 else 100)
+    else:
+        info_message(route_change_rates().sort_values('change_probability').to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Failure classification and retry scheduling for the collector.
+
+Failed queries are classified and rescheduled in later runs with an exponential backoff:
+
+- server_error (5xx, 408) and rate_limited (429): transient, retried up to max_retries times
+- flight_not_found (404): retried a few times, the flights may not be published yet
+- other_error (other 4xx): not retried
+
+The retry state is kept in the call-parameter CSV (retry_count and next_retry columns, see non_parameters in
+the collector). Retries only use up to retry_quota_share of the calls left on a key, so they never starve the
+new queries of the day.
+"""
+
+### Library import
+import datetime
+import re
+
+
+### Script parameters
+max_retries = {
+    "server_error": 5,
+    "rate_limited": 10,
+    "flight_not_found": 2,
+    "other_error": 0,
+}
+retry_backoff = datetime.timedelta(hours=2)  # doubled after each failed attempt
+max_retry_backoff = datetime.timedelta(days=4)
+retry_quota_share = 0.25
+
+retry_columns = ["retry_count", "next_retry"]
+
+
+
+def response_status(response_text:str) -> int:
+    # "<Response [503]>" -> 503, 0 when the query was never sent
+    match_error = re.search("\\d\\d\\d", str(response_text))
+    return 0 if match_error is None else int(match_error[0])
+
+
+def classify_failure(status:int) -> str:
+    if status == 0 or 200 <= status < 300:
+        return "none"
+    if status == 429:
+        return "rate_limited"
+    if status >= 500 or status == 408:
+        return "server_error"
+    if status == 404:
+        return "flight_not_found"
+    return "other_error"
+
+
+def retry_count_value(retry_count) -> int:
+    if retry_count in ('', None) or retry_count != retry_count:
+        return 0
+    return int(float(retry_count))
+
+
+def schedule_retry(status:int, retry_count, now:datetime.datetime = None) -> tuple:
+    # New (retry_count, next_retry) after a failure; next_retry is '' when no retry is left
+    now = now or datetime.datetime.now()
+    failure_class = classify_failure(status)
+    retry_count = retry_count_value(retry_count) + 1
+
+    if retry_count > max_retries.get(failure_class, 0):
+        return retry_count, ''
+
+    backoff = min(retry_backoff * 2 ** (retry_count - 1), max_retry_backoff)
+    return retry_count, (now + backoff).isoformat(timespec='seconds')
+
+
+def retry_decision(response_text:str, retry_count, next_retry, skip_failed:dict, now:datetime.datetime = None) -> tuple:
+    # (skip, message) for a query given its previous response and retry state.
+    # skip_failed: failure class -> skip option of the collector (False = always retry as before)
+    now = now or datetime.datetime.now()
+    failure_class = classify_failure(response_status(response_text))
+
+    if failure_class == "none" or not skip_failed.get(failure_class, True):
+        return False, ""
+
+    if next_retry in ('', None) or next_retry != next_retry:
+        if (retry_count_value(retry_count) == 0) & (max_retries.get(failure_class, 0) > 0):
+            # failed before the retry scheduling existed
+            return False, f"retry of a query previously failed ({failure_class})"
+        return True, f"skipped because previously failed ({failure_class}) and no retry left"
+
+    if datetime.datetime.fromisoformat(str(next_retry)) > now:
+        return True, f"skipped because previously failed ({failure_class}), retry {retry_count_value(retry_count) + 1} scheduled at {next_retry}"
+
+    return False, f"retry {retry_count_value(retry_count) + 1} of a query previously failed ({failure_class})"
+
+
+def retry_budget(nb_calls_left:int) -> int:
+    return int(nb_calls_left * retry_quota_share)
@@ -0,0 +1,135 @@
+"""
+Discovery of new routes to query from the flights already collected.
+
+Pipeline version of the former commented block of afklm_api_data_collection.py (MongoDB export anti-joined
+with the destination / origin pairs of the call parameters, filtered by the wiki IATA list):
+1. route pairs and distinct flight counts of the stored pages, updated incrementally (only the new pages of
+   the scan window are opened, the flight keys already counted are kept; the first run reads every page),
+   or read from a Parquet file with origin / destination columns (e.g. the flight state of afklm_snapshot_diff.py)
+2. hash anti-join with the (origin, destination) pairs of every df_call_parameters*.csv
+3. optional filter on an IATA airport list, ranking by observed flight volume
+4. the top max_new_routes are appended as new rows to discovered_parameter_file, with a window on today that
+   the collector date extension then carries forward
+"""
+
+### Library import
+import pandas as pd
+import datetime
+
+from afklm_common import (
+    info_message, list_files, list_json_files, list_scan_pages, open_json, import_csv, save_csv, import_parquet, save_parquet,
+    exists, path_data_storage, path_call_parameter_file_folder,
+)
+from afklm_flights import flight_legs_dataframe
+from afklm_tables import import_table, save_table
+
+
+### Script parameters
+route_source = "pages"  # "pages" or "parquet"
+route_parquet_folder = "derived"
+route_parquet_file = "afklm_snapshot_diff_state.parquet"
+path_derived = "derived"
+route_counts_file = "afklm_route_counts.parquet"
+route_flights_file = "afklm_route_flight_keys.parquet"
+route_processed_file = "afklm_route_counts_processed.csv"
+iata_list_file = None  # e.g. "../../1_data_collection/df_iata_icao_wiki_final_world.csv" (column 'iata')
+discovered_parameter_file = "df_call_parameters_discovered.csv"
+max_new_routes = 50
+min_flights = 1
+
+
+
+def route_counts(flights:pd.DataFrame) -> pd.DataFrame:
+    return flights.groupby(['origin', 'destination']).size().rename('flights').reset_index()
+
+
+def update_route_counts() -> pd.DataFrame:
+    # Distinct flights per (origin, destination) over the stored pages, only the pages not processed yet are opened.
+    # The same flight is seen again in later snapshots (sched, D-1, final): the flight keys already counted are kept.
+    flights = import_parquet(path_derived, route_flights_file) if exists(path_derived, route_flights_file) else pd.DataFrame(columns=['flight_key', 'origin', 'destination'])
+    # counted again from every page when the flight keys were not kept yet
+    processed = set(import_csv(path_derived, route_processed_file)['name']) if exists(path_derived, route_processed_file) and exists(path_derived, route_flights_file) else set()
+
+    # first run or rebuild: every stored page, then the scan window of the incremental stages (afklm_common.py)
+    pages = list_scan_pages(path_data_storage) if processed else list_json_files(path_data_storage)
+    new_pages = [val['name'] for val in pages if val['name'] not in processed]
+    info_message(f"{len(new_pages)} new pages to count routes from")
+    if len(new_pages) == 0:
+        return route_counts(flights)
+
+    legs = pd.concat([flight_legs_dataframe(open_json(path_data_storage, name)) for name in new_pages], ignore_index=True)
+    flights = pd.concat([flights, legs[['flight_key', 'origin', 'destination']]], ignore_index=True).drop_duplicates('flight_key')
+    counts = route_counts(flights)
+
+    save_parquet(flights, path_derived, route_flights_file)
+    save_parquet(counts, path_derived, route_counts_file)
+    save_csv(pd.DataFrame({'name': sorted(processed | set(new_pages))}), path_derived, route_processed_file)
+    return counts
+
+
+def observed_routes() -> pd.DataFrame:
+    if route_source == "parquet":
+        df = import_parquet(route_parquet_folder, route_parquet_file)
+        if 'flight_key' in df.columns and 'destination' not in df.columns:
+            df[['origin', 'destination']] = df['flight_key'].str.split('+', expand=True)[[3, 4]]
+        return route_counts(df)
+    return update_route_counts()
+
+
+def existing_routes() -> tuple:
+    # (origin, destination) pairs already queried and the columns of the parameter files
+    files = [
+        val['name'] for val in list_files(path_call_parameter_file_folder)
+        if 'df_call_parameters' in val['name'] and val['name'].endswith(".csv")
+    ]
+    tables = [import_table(path_call_parameter_file_folder, name, typed=False) for name in files]
+    columns = tables[0].columns if tables else pd.Index(['destination', 'origin', 'endRange', 'startRange'])
+    routes = pd.concat([df.reindex(columns=['origin', 'destination']) for df in tables] or [pd.DataFrame(columns=['origin', 'destination'])])
+    return routes.dropna().astype(str).drop_duplicates(), columns
+
+
+def discover_routes() -> pd.DataFrame:
+    observed = observed_routes()
+    observed = observed[(observed['origin'] != '') & (observed['destination'] != '') & (observed['flights'] >= min_flights)]
+    routes_done, _ = existing_routes()
+
+    # hash anti-join on the route pair
+    anti_join = observed.merge(routes_done, how='left', on=['origin', 'destination'], indicator=True)
+    anti_join = anti_join[anti_join['_merge'] == 'left_only'].drop('_merge', axis=1)
+
+    if iata_list_file is not None:
+        iata = set(pd.read_csv(iata_list_file)['iata'].dropna())
+        anti_join = anti_join[anti_join['origin'].isin(iata) & anti_join['destination'].isin(iata)]
+
+    return anti_join.sort_values('flights', ascending=False).head(max_new_routes).reset_index(drop=True)
+
+
+def append_discovered_routes(new_routes:pd.DataFrame) -> pd.DataFrame:
+    _, columns = existing_routes()
+    today = datetime.datetime.now().date().isoformat()
+
+    df_new = new_routes[['origin', 'destination']].reindex(columns=columns).fillna('')
+    df_new['startRange'] = f"{today}T00:00:00Z"
+    df_new['endRange'] = f"{today}T23:59:59Z"
+
+    if exists(path_call_parameter_file_folder, discovered_parameter_file):
+        df_new = pd.concat([import_table(path_call_parameter_file_folder, discovered_parameter_file, typed=False), df_new], ignore_index=True)
+    save_table(df_new.fillna(''), path_call_parameter_file_folder, discovered_parameter_file)
+    return df_new
+
+
+def run_route_discovery() -> pd.DataFrame:
+    new_routes = discover_routes()
+    info_message(f"{len(new_routes)} new routes discovered", 'green')
+    if len(new_routes) > 0:
+        info_message(new_routes.to_string())
+        append_discovered_routes(new_routes)
+    return new_routes
+
+
+def main():
+    run_route_discovery()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+Virtual-clock simulator of the collector runs, to compare scheduling and pacing policies without real quota.
+
+Each simulated day calls run_collection of afklm_api_data_collection_gcp_v1.py itself, in a scratch working
+folder (path_simulation/<policy>, local storage) seeded with a call-parameter CSV and nb_api_keys keys, so the
+date extension, the page kinds (future windows as _sched pages), the key rotation on the quota headers and on
+"Developer Over Rate", the retries and their share of the calls and the pacing are the collector's. Only
+requests.get and the clock are replaced:
+- the simulated API answers from a world of route-days, counts the calls of every key per day (quota headers,
+  403 once max_daily_api_call is reached) and draws transient server errors and rate limiting
+- the virtual clock replaces datetime in the collector, afklm_pacing.py, afklm_retry.py and afklm_tables.py;
+  the pacing waits and the call latencies only advance it, so a simulated week runs in seconds
+
+Worlds:
+- "synthetic": synthetic_routes routes, pages and flights drawn for every route-day
+- "recorded": the route-days of the state CSVs with their recorded totalPages and totalFlights. The pages
+  themselves are not replayed: their flights are placeholders, and a route-day without recorded totalFlights
+  gets totalPages * flights_per_page flights (counted in flights_estimated)
+
+A policy is a set of settings of the collector modules ("module.attribute": value) applied during its runs.
+For each policy the report gives the calls used, the pages stored (future windows included), the queries
+completed with their flights, the failed calls and the simulated wall time.
+
+Usage:
+    python afklm_run_simulator.py [synthetic|recorded]
+"""
+
+### Library import
+import pandas as pd
+import numpy as np
+import contextlib
+import datetime
+import importlib
+import os
+import shutil
+import sys
+import time
+import types
+import urllib.parse
+
+import afklm_common
+import afklm_pacing
+import afklm_retry
+import afklm_tables
+from afklm_common import info_message, list_json_files, parse_page_name, path_call_parameter_file_folder
+from afklm_tables import import_table
+
+
+### Script parameters
+collector_module = "afklm_api_data_collection_gcp_v1"
+path_simulation = "simulation"  # scratch working folder of the simulated runs
+simulation_file = "df_call_parameters_simulation.csv"
+simulated_days = 7
+run_time = datetime.time(6)  # virtual time of the daily run
+nb_api_keys = 10
+max_daily_api_call = 100
+future_days = 3  # future windows of the date extension (future_days_to_retrieve of the collector)
+world_source = "synthetic"  # "synthetic" or "recorded"
+synthetic_routes = 200
+synthetic_past_days = 3
+synthetic_server_error_rate = 0.03
+synthetic_rate_limit_rate = 0.01
+synthetic_qps_allotted = 1
+call_latency = 0.4  # seconds
+flights_per_page = 100
+random_seed = 0
+quiet_collector = True  # collector messages not printed during the simulated runs
+
+no_retries = {failure: 0 for failure in afklm_retry.max_retries}
+fixed_interval = {"afklm_pacing.interval_decrease": 1, "afklm_pacing.max_call_interval": afklm_pacing.min_call_interval}
+
+# settings of the collector modules applied during the runs of each policy ("collector" is the collector module)
+policies = {
+    "baseline": fixed_interval | {"afklm_retry.max_retries": no_retries, "afklm_pacing.quota_reserve": -1},
+    "retry_backoff": fixed_interval,
+    "adaptive_pacing": {},
+}
+
+
+
+class VirtualClock:
+
+    def __init__(self, start:datetime.datetime):
+        self.now = start
+        self.elapsed = 0.0
+
+    def advance(self, seconds:float) -> None:
+        self.now += datetime.timedelta(seconds=seconds)
+        self.elapsed += max(seconds, 0)
+
+
+class VirtualDatetime(datetime.datetime):
+    # datetime.datetime whose now() is the virtual clock
+    clock = None
+
+    @classmethod
+    def now(cls, tz=None):
+        if tz is None:
+            return cls.clock.now
+        return cls.clock.now.replace(tzinfo=datetime.timezone.utc).astimezone(tz)
+
+
+class SimulatedResponse:
+    # the parts of requests.Response read by the collector and afklm_pacing.py
+
+    def __init__(self, status_code:int, headers:dict = None, data:dict = None, text:str = ""):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.data = data
+        self.text = text
+        self.elapsed = datetime.timedelta(seconds=call_latency)
+
+    def __bool__(self) -> bool:
+        return self.status_code < 400
+
+    def __repr__(self) -> str:
+        return f"<Response [{self.status_code}]>"
+
+    def json(self) -> dict:
+        return self.data
+
+
+class SimulatedApi:
+    # stand-in of requests for the collector: get() answers the flightstatus queries from the world
+
+    def __init__(self, world:pd.DataFrame, clock:VirtualClock, rng:np.random.Generator):
+        self.world = world.set_index(['origin', 'destination', 'date'])
+        self.clock = clock
+        self.rng = rng
+        self.calls = {}  # (API key, day) -> calls
+        self.stats = {'calls': 0, 'pages': 0, 'server_errors': 0, 'rate_limited': 0, 'quota_stops': 0, 'not_found': 0}
+
+    def get(self, url:str, headers:dict = None, **kwargs) -> SimulatedResponse:
+        self.clock.advance(call_latency)
+        self.stats['calls'] += 1
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+        day = (headers['API-Key'], self.clock.now.date())
+        quota_headers = {
+            "X-Plan-QPS-Allotted": str(synthetic_qps_allotted),
+            "X-Plan-Quota-Allotted": str(max_daily_api_call),
+            "X-Plan-Quota-Current": str(min(self.calls.get(day, 0) + 1, max_daily_api_call)),
+        }
+        if self.calls.get(day, 0) >= max_daily_api_call:
+            self.stats['quota_stops'] += 1
+            return SimulatedResponse(403, {"X-Mashery-Error-Code": "ERR_403_DEVELOPER_OVER_RATE"}, text="<h1>Developer Over Rate</h1>")
+        self.calls[day] = self.calls.get(day, 0) + 1
+
+        draw = self.rng.random()
+        if draw < synthetic_rate_limit_rate:
+            self.stats['rate_limited'] += 1
+            return SimulatedResponse(429, quota_headers | {"Retry-After": "2"}, text="Developer Over Qps")
+        if draw < synthetic_rate_limit_rate + synthetic_server_error_rate:
+            self.stats['server_errors'] += 1
+            return SimulatedResponse(503, quota_headers, text="Service Unavailable")
+
+        key = (query.get('origin', ''), query.get('destination', ''), query.get('startRange', '')[:10])
+        if key not in self.world.index:
+            self.stats['not_found'] += 1
+            return SimulatedResponse(404, quota_headers, text="No flights found")
+        window = self.world.loc[key]
+        page_number = int(query.get('pageNumber', 0))
+        nb_flights = int(np.clip(window['totalFlights'] - page_number * flights_per_page, 0, flights_per_page))
+        self.stats['pages'] += 1
+        return SimulatedResponse(200, quota_headers, {
+            'page': {'pageNumber': page_number, 'pageSize': flights_per_page, 'totalPages': int(window['totalPages']), 'fullCount': int(window['totalFlights'])},
+            'operationalFlights': [{'id': f"{'-'.join(key)}-{page_number}-{flight}"} for flight in range(nb_flights)],
+        })
+
+
+
+def synthetic_world(start:datetime.date) -> pd.DataFrame:
+    # route-days from synthetic_past_days before the start to the last future window of the simulation
+    dates = [start + datetime.timedelta(days=day) for day in range(-synthetic_past_days, simulated_days + future_days + 1)]
+    world = pd.DataFrame(
+        [(f"R{route:03d}", "AMS", date.isoformat()) for route in range(synthetic_routes) for date in dates],
+        columns=['origin', 'destination', 'date'],
+    )
+    rng = np.random.default_rng(random_seed)
+    world['totalPages'] = rng.choice([1, 1, 1, 2, 2, 3, 5], size=len(world))
+    world['totalFlights'] = (world['totalPages'] - 1) * flights_per_page + rng.integers(1, flights_per_page, size=len(world))
+    world['flights_estimated'] = False
+    return world
+
+
+def recorded_world() -> pd.DataFrame:
+    # route-days of the state CSVs (of the current working folder) with a known number of pages
+    columns = ['origin', 'destination', 'startRange', 'totalPages', 'totalFlights']
+    files = [val['name'] for val in afklm_common.list_files(path_call_parameter_file_folder)
+             if 'df_call_parameters' in val['name'] and val['name'].endswith(".csv")]
+    world = pd.concat(
+        [import_table(path_call_parameter_file_folder, name, typed=False).reindex(columns=columns) for name in files] or [pd.DataFrame(columns=columns)],
+        ignore_index=True,
+    )
+    world['date'] = world['startRange'].astype(str).str[:10]
+    world[['totalPages', 'totalFlights']] = world[['totalPages', 'totalFlights']].apply(pd.to_numeric, errors='coerce')
+    world = world[world['totalPages'].notna() & world['origin'].notna()].sort_values('totalFlights', na_position='first')
+    world = world.drop_duplicates(['origin', 'destination', 'date'], keep='last')
+    world['flights_estimated'] = world['totalFlights'].isna()
+    world['totalFlights'] = world['totalFlights'].fillna(world['totalPages'] * flights_per_page)
+    return world[['origin', 'destination', 'date', 'totalPages', 'totalFlights', 'flights_estimated']].astype(
+        {'totalPages': int, 'totalFlights': int}).reset_index(drop=True)
+
+
+def seed_state(world:pd.DataFrame, collector, start:datetime.date) -> None:
+    # call-parameter CSV and API keys of a fresh simulation folder (current working folder)
+    if world_source == "synthetic":
+        # one window per route, the date extension of the collector adds the following days
+        rows = world[world['date'] == (start - datetime.timedelta(days=synthetic_past_days)).isoformat()]
+    else:
+        rows = world
+    df = pd.DataFrame({
+        'origin': rows['origin'].values, 'destination': rows['destination'].values,
+        'startRange': rows['date'].values + "T00:00:00Z", 'endRange': rows['date'].values + "T23:59:59Z",
+    })
+    for column in collector.non_parameters:
+        df[column] = ''
+    os.makedirs(collector.api_key_list_folder, exist_ok=True)
+    os.makedirs(collector.path_data_storage, exist_ok=True)
+    afklm_common.save_csv(df, collector.path_call_parameter_file_folder, simulation_file)
+    afklm_common.save_csv(pd.DataFrame({
+        'key_desc': [f"key_{key}" for key in range(nb_api_keys)], 'api_key': [f"simulated_{key}" for key in range(nb_api_keys)],
+        'nb_calls_today': 0, 'timestamp': (start - datetime.timedelta(days=1)).isoformat(),
+    }), collector.api_key_list_folder, "afklm_api_keys.csv")
+    return None
+
+
+def load_collector():
+    # imported once: the module sets up its clients and changes the working directory at import
+    cwd = os.getcwd()
+    try:
+        return importlib.import_module(collector_module)
+    finally:
+        os.chdir(cwd)
+
+
+@contextlib.contextmanager
+def settings_applied(settings:dict, collector):
+    modules = {'collector': collector}
+    previous = []
+    try:
+        for name, value in settings.items():
+            module_name, attribute = name.rsplit('.', 1)
+            module = modules.get(module_name) or sys.modules[module_name]
+            previous.append((module, attribute, getattr(module, attribute)))
+            setattr(module, attribute, value)
+        yield
+    finally:
+        for module, attribute, value in reversed(previous):
+            setattr(module, attribute, value)
+
+
+@contextlib.contextmanager
+def simulated_environment(collector, api:SimulatedApi, clock:VirtualClock, folder:str):
+    # collector and its helpers on local storage in folder, with the simulated API and the virtual clock
+    VirtualDatetime.clock = clock
+    virtual_datetime = types.ModuleType("datetime")
+    virtual_datetime.__dict__.update({name: value for name, value in vars(datetime).items() if not name.startswith('__')})
+    virtual_datetime.datetime = VirtualDatetime
+    virtual_time = types.ModuleType("time")
+    virtual_time.__dict__.update({name: value for name, value in vars(time).items() if not name.startswith('__')})
+    virtual_time.sleep = clock.advance
+
+    settings = {
+        'collector.requests': types.SimpleNamespace(get=api.get),
+        'collector.datetime': virtual_datetime,
+        'collector.in_cloud': False,
+        'collector.max_daily_api_call': max_daily_api_call,
+        'collector.future_days_to_retrieve': future_days,
+        'collector.add_new_dates_csv_parameters': world_source == "synthetic",
+        'collector.refresh_policy': False,
+        'collector.publish_flights': False,
+        'collector.memory_profiling': False,
+        'afklm_common.in_cloud': False,
+        'afklm_pacing.datetime': virtual_datetime,
+        'afklm_pacing.time': virtual_time,
+        'afklm_pacing.pacing_state': {},
+        'afklm_pacing.telemetry': [],
+        'afklm_retry.datetime': virtual_datetime,
+        'afklm_tables.datetime': virtual_datetime,
+    }
+    if quiet_collector:
+        settings['collector.info_message'] = lambda *args, **kwargs: None
+
+    cwd = os.getcwd()
+    os.makedirs(folder, exist_ok=True)
+    os.chdir(folder)
+    collector.table_cache.clear()
+    afklm_common.refresh_listings()
+    afklm_common.page_locations.clear()
+    afklm_common.blob_generations.clear()
+    try:
+        with settings_applied(settings, collector):
+            yield
+    finally:
+        os.chdir(cwd)
+        collector.table_cache.clear()
+        afklm_common.refresh_listings()
+        afklm_common.page_locations.clear()
+        afklm_common.blob_generations.clear()
+
+
+def simulate_policy(name:str, policy:dict, world:pd.DataFrame, start:datetime.datetime, collector) -> dict:
+    folder = os.path.join(path_simulation, name)
+    shutil.rmtree(folder, ignore_errors=True)
+    clock = VirtualClock(start)
+    api = SimulatedApi(world, clock, np.random.default_rng(random_seed))
+
+    with simulated_environment(collector, api, clock, folder), settings_applied(policy, collector):
+        seed_state(world, collector, start.date())
+        for day in range(simulated_days):
+            # a new day's run starts with the pacing state of a new process (or of the daemon's quota reset)
+            clock.now = max(clock.now, start + datetime.timedelta(days=day))
+            afklm_pacing.pacing_state.clear()
+            collector.run_collection()
+
+        df_state = afklm_common.import_csv(collector.path_call_parameter_file_folder, simulation_file)
+        pages = [parse_page_name(val['name']) for val in list_json_files(collector.path_data_storage, include_archives=False)]
+
+    complete = pd.to_numeric(df_state['completion'], errors='coerce') == 100
+    complete_windows = df_state.loc[complete, ['origin', 'destination', 'startRange']].astype(str).assign(date=lambda df: df['startRange'].str[:10])
+    estimated = complete_windows.merge(world, on=['origin', 'destination', 'date'])['flights_estimated'].sum()
+    return api.stats | {
+        'pages_stored': len(pages),
+        'sched_pages_stored': sum(page['kind'] == "sched" for page in pages),
+        'complete_queries': int(complete.sum()),
+        'flights': int(pd.to_numeric(df_state.loc[complete, 'totalFlights'], errors='coerce').sum()),
+        'flights_estimated': int(estimated),
+        'pending_retries': int((df_state['next_retry'].fillna('').astype(str) != '').sum()),
+        'simulated_hours': round(clock.elapsed / 3600, 2),
+    }
+
+
+def run_simulation(policies:dict = policies) -> pd.DataFrame:
+    global path_simulation
+    path_simulation = os.path.abspath(path_simulation)
+    start = datetime.datetime.combine(datetime.datetime.now().date(), run_time)
+    world = synthetic_world(start.date()) if world_source == "synthetic" else recorded_world()
+    collector = load_collector()
+    info_message(f"Simulating {simulated_days} days, {nb_api_keys} keys, {len(world)} route-days ({world_source})")
+
+    results = pd.DataFrame({name: simulate_policy(name, policy, world, start, collector) for name, policy in policies.items()}).T
+    info_message(results.to_string(), 'green')
+    return results
+
+
+def main():
+    global world_source
+    if sys.argv[1:2] in (["synthetic"], ["recorded"]):
+        world_source = sys.argv[1]
+    run_simulation()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Incremental diff of the flightstatus snapshots stored by the collector.
+
+The same flights are retrieved several times: in the future windows (_sched pages), on D-1 (_updSchedD1 pages)
+and once the window is past. This script matches the flights of the newly arrived pages with the last known
+state of each flight (flight identity = schedule date, airline, flight number and leg route) and appends the
+differences to a columnar change log:
+
+- new_flight: first time the flight leg is seen
+- time_change: scheduled / latest published / actual departure or arrival time changed
+- status_change: flight or leg public status changed
+- aircraft_swap: aircraft registration or type changed
+
+Only the pages of the scan window (scan_days_back, scan_days_ahead of afklm_common.py) not processed yet
+(name + generation) are opened. Outputs (under path_derived):
+- changes/afklm_flight_changes_<run>.parquet: one file per run with the change records
+- afklm_snapshot_diff_state.parquet: last known state of every flight leg
+- afklm_snapshot_diff_processed.csv: pages already processed
+"""
+
+### Library import
+import pandas as pd
+import datetime
+
+from afklm_common import (
+    info_message, list_scan_pages, open_json, parse_page_name, page_kinds, import_parquet, save_parquet, exists,
+    load_processed_pages, unprocessed_pages, save_processed_pages, path_data_storage,
+)
+from afklm_flights import flight_legs_dataframe, state_fields
+
+
+### Script parameters
+path_derived = "derived"
+path_changes = "derived/changes"
+processed_file = "afklm_snapshot_diff_processed.csv"
+state_file = "afklm_snapshot_diff_state.parquet"
+max_pages_per_run = 100000
+
+change_types = {
+    "flightStatusPublic": "status_change",
+    "legStatusPublic": "status_change",
+    "scheduledDeparture": "time_change",
+    "latestPublishedDeparture": "time_change",
+    "actualDeparture": "time_change",
+    "scheduledArrival": "time_change",
+    "latestPublishedArrival": "time_change",
+    "actualArrival": "time_change",
+    "aircraftRegistration": "aircraft_swap",
+    "aircraftTypeCode": "aircraft_swap",
+}
+
+change_columns = ["flight_key", "change_type", "field", "old_value", "new_value", "page", "observed_at"]
+
+
+
+def load_last_state() -> pd.DataFrame:
+    if exists(path_derived, state_file):
+        return import_parquet(path_derived, state_file)
+    return pd.DataFrame(columns=['flight_key'] + state_fields + ['page', 'observed_at'])
+
+
+def list_new_pages(processed:pd.DataFrame) -> pd.DataFrame:
+    # Pages not yet processed, in snapshot order (time of storage then sched < updSchedD1 < past window)
+    pages = unprocessed_pages(pd.DataFrame(list_scan_pages(path_data_storage), columns=['name', 'size', 'updated', 'generation']), processed)
+
+    pages['kind'] = pages['name'].map(lambda name: (parse_page_name(name) or {}).get('kind'))
+    pages = pages[pages['kind'].notna()]
+    pages['kind_rank'] = pages['kind'].map(page_kinds)
+
+    return pages.sort_values(['updated', 'kind_rank', 'name']).head(max_pages_per_run).reset_index(drop=True)
+
+
+def load_page_legs(pages:pd.DataFrame) -> pd.DataFrame:
+    legs = []
+    for page in pages.itertuples():
+        data = open_json(path_data_storage, page.name)
+        legs.append(flight_legs_dataframe(data, page=page.name, observed_at=page.updated))
+
+    if len(legs) == 0:
+        return load_last_state().iloc[0:0]
+    return pd.concat(legs, ignore_index=True)
+
+
+def diff_snapshots(last_state:pd.DataFrame, legs:pd.DataFrame) -> tuple:
+    # Returns (change records, new last state)
+    combined = pd.concat([last_state.assign(_order=-1), legs.assign(_order=range(len(legs)))], ignore_index=True)
+    combined = combined[['flight_key'] + state_fields + ['page', 'observed_at', '_order']].fillna('')
+    combined = combined.sort_values(['flight_key', '_order'], kind='stable').reset_index(drop=True)
+
+    is_new_row = combined['_order'] >= 0
+    previous = combined.groupby('flight_key').shift()
+    first_seen = is_new_row & previous['_order'].isna()
+
+    changes = [
+        combined.loc[first_seen, ['flight_key', 'page', 'observed_at']].assign(
+            change_type='new_flight', field='', old_value='', new_value='')
+    ]
+    for field in state_fields:
+        changed = is_new_row & ~first_seen & (previous[field] != combined[field])
+        changes.append(
+            combined.loc[changed, ['flight_key', 'page', 'observed_at']].assign(
+                change_type=change_types[field], field=field,
+                old_value=previous.loc[changed, field], new_value=combined.loc[changed, field])
+        )
+
+    df_changes = pd.concat(changes, ignore_index=True)[change_columns].sort_values(['observed_at', 'flight_key'])
+    new_state = combined.drop_duplicates('flight_key', keep='last').drop('_order', axis=1)
+
+    return df_changes.reset_index(drop=True), new_state.reset_index(drop=True)
+
+
+def run_snapshot_diff() -> pd.DataFrame:
+    processed = load_processed_pages(path_derived, processed_file)
+    pages = list_new_pages(processed)
+    info_message(f"{len(pages)} new pages to diff")
+    if len(pages) == 0:
+        return pd.DataFrame(columns=change_columns)
+
+    df_changes, new_state = diff_snapshots(load_last_state(), load_page_legs(pages))
+
+    # Change log first, then state and processed pages: a crash before the end only reprocesses pages
+    run_id = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    save_parquet(df_changes, path_changes, f"afklm_flight_changes_{run_id}.parquet")
+    save_parquet(new_state, path_derived, state_file)
+
+    save_processed_pages(processed, pages, run_id, path_derived, processed_file)
+
+    info_message(f"{len(df_changes)} changes written", 'green')
+    info_message(df_changes['change_type'].value_counts().to_string())
+    return df_changes
+
+
+def main():
+    run_snapshot_diff()
+
+
+if __name__ == "__main__":
+    main()
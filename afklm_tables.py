@@ -0,0 +1,190 @@
+"""
+Typed representation of the call-parameter and API key tables.
+
+Read from CSV, these tables are object columns: airport, carrier and response codes are Python strings and the
+ISO dates are strings parsed again wherever they are needed. The schemas below turn them into compact typed
+tables:
+- airport / carrier / filter codes and response strings: categorical
+- startRange / endRange / timestamp: datetime64
+- page and flight counts: nullable integers
+
+The collector keeps the typed tables in its table cache and the loaders of the call-parameter files
+(afklm_query_planner.py, afklm_route_discovery.py, afklm_coverage_report.py) read them through import_table.
+The CSV files stay the reference; with table_format = "parquet" a typed Parquet copy is written next to each
+CSV and read instead of it while it is at least as recent (generation) as the CSV.
+parse_iso_dates and extend_date_ranges handle the date columns of the string form in one vectorized pass.
+
+Usage:
+    python afklm_tables.py  # writes the Parquet copies of every call-parameter CSV
+"""
+
+### Library import
+import pandas as pd
+import numpy as np
+import datetime
+from io import BytesIO
+
+from afklm_common import (
+    info_message, list_files, import_csv, save_csv, import_parquet, save_parquet,
+    path_call_parameter_file_folder,
+)
+
+
+### Script parameters
+table_format = "csv"  # "csv" or "parquet" (typed Parquet copy next to each CSV)
+iso_format = "%Y-%m-%dT%H:%M:%SZ"
+
+call_parameters_schema = {
+    "aircraftRegistration": "category",
+    "aircraftType": "category",
+    "arrivalCity": "category",
+    "carrierCode": "category",
+    "consumerHost": "category",
+    "departureCity": "category",
+    "destination": "category",
+    "flightNumber": "category",
+    "movementType": "category",
+    "operatingAirlineCode": "category",
+    "operationalSuffix": "category",
+    "origin": "category",
+    "serviceType": "category",
+    "timeOriginType": "category",
+    "timeType": "category",
+    "endRange": "datetime64[ns]",
+    "startRange": "datetime64[ns]",
+    "call_parameters": "string",
+    "response": "category",
+    "message": "string",
+    "timestamp": "datetime64[ns]",
+    "nb_of_pages_already_retrieved": "Int32",
+    "totalPages": "Int32",
+    "completion": "Int32",  # integer percentage
+    "totalFlights": "Int32",
+    "retry_count": "Int32",
+    "next_retry": "string",
+}
+
+api_keys_schema = {
+    "key_desc": "category",
+    "api_key": "string",
+    "nb_calls_today": "Int32",
+    "timestamp": "datetime64[ns]",
+}
+
+
+
+def table_schema(path_file:str) -> dict:
+    # schema of a table from its file name, None for the other CSVs
+    if 'df_call_parameters' in path_file:
+        return call_parameters_schema
+    if 'api_keys' in path_file:
+        return api_keys_schema
+    return None
+
+
+def parse_iso_dates(values:pd.Series) -> pd.Series:
+    # "2025-07-23T23:59:59Z" strings (or '') -> naive datetime64, parsed once for the whole column
+    values = values.astype('string').str.replace('Z', '', regex=False).replace('', pd.NA)
+    return pd.to_datetime(values, format='ISO8601', errors='coerce').astype('datetime64[ns]')
+
+
+def typed_table(df:pd.DataFrame, schema:dict) -> pd.DataFrame:
+    df = df.copy()
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        if dtype.startswith("datetime64"):
+            df[column] = parse_iso_dates(df[column])
+        elif dtype in ("Int32", "Float32"):
+            df[column] = pd.to_numeric(df[column].replace('', np.nan), errors='coerce').astype(dtype)
+        else:
+            df[column] = df[column].replace('', pd.NA).astype('string').astype(dtype)
+    return df
+
+
+def untyped_table(df:pd.DataFrame, schema:dict) -> pd.DataFrame:
+    # Back to the form read from the collector CSVs: object columns, NaN for missing values
+    df = df.copy()
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if dtype.startswith("datetime64") and column != "timestamp":
+            values = values.dt.strftime(iso_format)
+        elif dtype.startswith("datetime64"):
+            values = values.map(lambda val: val.isoformat() if pd.notna(val) else np.nan)
+        values = values.astype(object)
+        df[column] = values.where(values.notna(), np.nan)
+    return df
+
+
+def read_table(payload:bytes, path_file:str, table_format:str = "csv") -> pd.DataFrame:
+    # typed table of a CSV (or Parquet copy) payload, the raw CSV read for the tables without schema
+    if table_format == "parquet":
+        return pd.read_parquet(BytesIO(payload))
+    df = pd.read_csv(BytesIO(payload), encoding="utf-8", low_memory=False)
+    schema = table_schema(path_file)
+    return typed_table(df, schema) if schema is not None else df
+
+
+def csv_table(df:pd.DataFrame, path_file:str) -> pd.DataFrame:
+    schema = table_schema(path_file)
+    return untyped_table(df, schema) if schema is not None else df.copy()
+
+
+def parquet_name(path_file:str) -> str:
+    return path_file.removesuffix(".csv") + ".parquet"
+
+
+def import_table(path_folder:str, path_file:str, typed:bool = True) -> pd.DataFrame:
+    # Parquet copy if it is at least as recent as the CSV, CSV otherwise; typed=False: form of the CSV
+    generations = {val['name']: val['generation'] for val in list_files(path_folder)}
+    parquet_generation = generations.get(parquet_name(path_file))
+    if table_format == "parquet" and parquet_generation is not None and int(parquet_generation) >= int(generations.get(path_file, 0)):
+        df = import_parquet(path_folder, parquet_name(path_file))
+    else:
+        df = typed_table(import_csv(path_folder, path_file), table_schema(path_file) or {})
+    return df if typed else csv_table(df, path_file)
+
+
+def save_table(df:pd.DataFrame, path_folder:str, path_file:str) -> None:
+    # CSV (and Parquet copy) of a table given in its typed or CSV form
+    schema = table_schema(path_file) or {}
+    save_csv(untyped_table(typed_table(df, schema), schema), path_folder, path_file)
+    if table_format == "parquet":
+        save_parquet(typed_table(df, schema), path_folder, parquet_name(path_file))
+    return None
+
+
+def extend_date_ranges(df_root:pd.DataFrame, future_days_to_retrieve:int, today:datetime.date = None) -> pd.DataFrame:
+    # One new daily window per missing day for each root row, until endRange reaches today + future days:
+    # [endRange + 1s, endRange + 1 day], repeated.
+    today = today or datetime.datetime.now().date()
+    endRange = parse_iso_dates(df_root['endRange'])
+    nb_days = (future_days_to_retrieve - (endRange.dt.normalize() - pd.Timestamp(today)).dt.days).clip(lower=0)
+    nb_days = nb_days.fillna(0).astype(int).to_numpy()
+
+    rows = np.repeat(np.arange(len(df_root)), nb_days)
+    day_offset = np.arange(len(rows)) - np.repeat(np.cumsum(nb_days) - nb_days, nb_days)
+
+    df_new = df_root.iloc[rows].reset_index(drop=True)
+    new_end = endRange.iloc[rows].reset_index(drop=True) + pd.to_timedelta(day_offset + 1, unit='D')
+    df_new['startRange'] = (new_end - pd.Timedelta(days=1) + pd.Timedelta(seconds=1)).dt.strftime(iso_format)
+    df_new['endRange'] = new_end.dt.strftime(iso_format)
+    return df_new
+
+
+def main():
+    for val in list_files(path_call_parameter_file_folder):
+        if 'df_call_parameters' not in val['name'] or not val['name'].endswith(".csv"):
+            continue
+        df = import_csv(path_call_parameter_file_folder, val['name'])
+        typed = typed_table(df, call_parameters_schema)
+        save_parquet(typed, path_call_parameter_file_folder, parquet_name(val['name']))
+        info_message(
+            f"{parquet_name(val['name'])}: {len(df)} rows, {df.memory_usage(deep=True).sum() / 1e6:.1f} MB as read from CSV, "
+            f"{typed.memory_usage(deep=True).sum() / 1e6:.1f} MB typed", 'green')
+
+
+if __name__ == "__main__":
+    main()
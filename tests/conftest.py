@@ -0,0 +1,128 @@
+import datetime
+import inspect
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import afklm_blob_cache
+import afklm_common
+import afklm_logging
+
+
+@pytest.fixture(autouse=True)
+def console_logging(monkeypatch):
+    # messages on the console only, the listener stopped so a test never logs to the output of another
+    monkeypatch.setattr(afklm_logging, "json_lines", False)
+    yield
+    afklm_logging.stop_logging()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # local storage in an empty folder, with the listings and catalogs of afklm_common reset
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(afklm_common, "in_cloud", False)
+    monkeypatch.setattr(afklm_common, "archive_catalog", None)
+    afklm_common.listing_cache.clear()
+    afklm_common.listing_times.clear()
+    afklm_common.page_locations.clear()
+    afklm_common.blob_generations.clear()
+    return tmp_path
+
+
+class FakeBlob:
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.metadata = None
+        stored = bucket.objects.get(name)
+        self.generation = stored['generation'] if stored else None
+        self.size = len(stored['payload']) if stored else None
+        self.updated = stored['updated'] if stored else None
+
+    def upload_from_string(self, payload, content_type=None):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.bucket.generation += 1
+        self.bucket.objects[self.name] = {
+            'payload': payload, 'generation': self.bucket.generation, 'metadata': self.metadata,
+            'updated': datetime.datetime.now(datetime.timezone.utc),
+        }
+        self.generation, self.size = self.bucket.generation, len(payload)
+
+    def upload_from_file(self, file):
+        self.upload_from_string(file.read())
+
+    def download_as_bytes(self, start=None, end=None):
+        stored = self.bucket.objects[self.name]
+        self.bucket.downloads.append((self.name, start, end))
+        self.generation = stored['generation']
+        return stored['payload'] if start is None else stored['payload'][start:end + 1]
+
+    def exists(self):
+        return self.name in self.bucket.objects
+
+    def delete(self, if_generation_match=None):
+        del self.bucket.objects[self.name]
+
+    def patch(self):
+        self.bucket.objects[self.name]['metadata'] = self.metadata
+
+    def reload(self):
+        self.size = len(self.bucket.objects[self.name]['payload'])
+
+    def compose(self, sources):
+        self.upload_from_string(b"".join(self.bucket.objects[source.name]['payload'] for source in sources))
+
+
+class FakeBucket:
+    # In-memory stand-in of a google.cloud.storage bucket and client (blob, list_blobs, copy_blob)
+
+    def __init__(self):
+        self.objects = {}
+        self.generation = 1000
+        self.downloads = []
+        self.listed_prefixes = []
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, bucket, prefix=""):
+        self.listed_prefixes.append(prefix)
+        blobs = []
+        for name in sorted(self.objects):
+            if name.startswith(prefix):
+                blob = FakeBlob(self, name)
+                blob.metadata = self.objects[name]['metadata']
+                blobs.append(blob)
+        return blobs
+
+    def copy_blob(self, source, bucket, new_name, if_generation_match=None):
+        blob = FakeBlob(self, new_name)
+        blob.metadata = self.objects[source.name]['metadata']
+        blob.upload_from_string(self.objects[source.name]['payload'])
+        return blob
+
+
+@pytest.fixture
+def cloud(workdir, monkeypatch):
+    # afklm_common (and the modules given to it) working against an in-memory bucket
+    fake = FakeBucket()
+    monkeypatch.setattr(afklm_common, "in_cloud", True)
+    monkeypatch.setattr(afklm_common, "bucket", fake)
+    monkeypatch.setattr(afklm_common, "client_storage", fake)
+    # bucket = bucket defaults were bound to None at import
+    for function in vars(afklm_common).values():
+        if inspect.isfunction(function) and function.__defaults__ and 'bucket' in inspect.signature(function).parameters:
+            names = [name for name, val in inspect.signature(function).parameters.items() if val.default is not inspect.Parameter.empty]
+            defaults = list(function.__defaults__)
+            defaults[names.index('bucket')] = fake
+            monkeypatch.setattr(function, "__defaults__", tuple(defaults))
+    monkeypatch.setattr(afklm_blob_cache, "cache_dir", str(workdir / "blob_cache"))
+    monkeypatch.setattr(afklm_blob_cache, "cache_index", None)
+    monkeypatch.setattr(afklm_blob_cache, "cache_stats", dict.fromkeys(afklm_blob_cache.cache_stats, 0))
+    return fake
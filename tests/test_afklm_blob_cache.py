@@ -0,0 +1,42 @@
+import afklm_blob_cache
+import afklm_common
+
+
+def test_ranged_reads_download_and_cache_the_range_only(cloud):
+    afklm_common.write_bytes(b"0123456789", "archives", "day.bin")
+
+    assert afklm_common.read_range("archives", "day.bin", 2, 3) == b"234"
+    assert afklm_common.read_range("archives", "day.bin", 2, 3) == b"234"
+
+    assert cloud.downloads == [("archives/day.bin", 2, 4)]
+    assert afklm_blob_cache.cache_stats['hits'] == 1
+    assert afklm_blob_cache.cache_summary()['cached_bytes'] == 3
+
+
+def test_whole_archive_serves_later_ranges(cloud, monkeypatch):
+    monkeypatch.setattr(afklm_blob_cache, "cache_whole_archives", True)
+    afklm_common.write_bytes(b"0123456789", "archives", "day.bin")
+
+    assert afklm_common.read_range("archives", "day.bin", 2, 3) == b"234"
+    assert afklm_common.read_range("archives", "day.bin", 5, 2) == b"56"
+    assert cloud.downloads == [("archives/day.bin", None, None)]
+
+
+def test_unknown_generation_is_not_cached(cloud):
+    afklm_common.write_bytes(b"page", "data", "page.json")
+    afklm_common.blob_generations.clear()
+
+    afklm_common.read_bytes("data", "page.json")
+    afklm_common.read_bytes("data", "page.json")
+
+    assert len(cloud.downloads) == 2
+    assert afklm_blob_cache.cache_summary()['entries'] == 0
+
+
+def test_rewritten_blob_is_read_under_its_new_generation(cloud):
+    afklm_common.write_bytes(b"first", "data", "page.json")
+    assert afklm_common.read_bytes("data", "page.json") == b"first"
+    afklm_common.write_bytes(b"second", "data", "page.json")
+    assert afklm_common.read_bytes("data", "page.json") == b"second"
+    assert afklm_common.read_bytes("data", "page.json") == b"second"
+    assert len(cloud.downloads) == 2
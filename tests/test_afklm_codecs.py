@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+import afklm_codecs
+
+zstandard = pytest.importorskip("zstandard")
+
+
+def sample_pages(airline, count=300):
+    return [
+        json.dumps({"operationalFlights": [{"flightNumber": i, "airline": {"code": airline, "name": f"{airline} airline {i % 7}"},
+                                            "route": [f"{airline}{i % 13}", f"AMS{i % 5}"]}]}).encode()
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def no_dictionaries(workdir, monkeypatch):
+    monkeypatch.setattr(afklm_codecs, "dictionaries", {})
+    monkeypatch.setattr(afklm_codecs, "latest_checked_at", None)
+
+
+def test_latest_dictionary_is_the_last_stored_whatever_its_id(no_dictionaries):
+    first = zstandard.train_dictionary(2048, sample_pages("KL"))
+    second = zstandard.train_dictionary(2048, sample_pages("AF"))
+    for dictionary in (first, second):
+        afklm_codecs.store_dictionary(dictionary)
+    afklm_codecs.dictionaries.clear()
+
+    assert afklm_codecs.load_dictionary().dict_id() == second.dict_id()
+
+    # pages encoded with the former dictionary still decode with it
+    afklm_codecs.dictionaries.clear()
+    afklm_codecs.store_dictionary(first)
+    payload = afklm_codecs.encode_page({"flight": 1}, "zstd")
+    afklm_codecs.store_dictionary(second)
+    afklm_codecs.dictionaries.clear()
+    assert afklm_codecs.decode_page(payload) == {"flight": 1}
+
+
+def test_no_dictionary_before_training(no_dictionaries):
+    assert afklm_codecs.load_dictionary() is None
+    assert afklm_codecs.decode_page(afklm_codecs.encode_page({"a": 1}, "zstd", "json")) == {"a": 1}
+
+
+def test_codec_detection():
+    for codec in ("gzip", "none"):
+        payload = afklm_codecs.encode_page({"a": [1, 2]}, codec, "json")
+        assert afklm_codecs.detect_codec(payload) == codec
+        assert afklm_codecs.decode_page(payload) == {"a": [1, 2]}
+
+
+def test_warm_process_picks_up_a_dictionary_trained_elsewhere(no_dictionaries, monkeypatch):
+    first = zstandard.train_dictionary(2048, sample_pages("KL"))
+    second = zstandard.train_dictionary(2048, sample_pages("AF"))
+    afklm_codecs.store_dictionary(first)
+
+    # pointer moved by another process: kept until latest_dictionary_max_age, then read again
+    afklm_codecs.write_bytes(second.as_bytes(), afklm_codecs.path_codecs, f"zstd_dict_{second.dict_id()}.bin")
+    afklm_codecs.write_bytes(str(second.dict_id()).encode(), afklm_codecs.path_codecs, afklm_codecs.latest_dictionary_file)
+    assert afklm_codecs.load_dictionary().dict_id() == first.dict_id()
+
+    monkeypatch.setattr(afklm_codecs, "latest_checked_at", afklm_codecs.latest_checked_at - afklm_codecs.latest_dictionary_max_age)
+    assert afklm_codecs.load_dictionary().dict_id() == second.dict_id()
+    assert zstandard.get_frame_parameters(afklm_codecs.encode_page({"a": 1}, "zstd")).dict_id == second.dict_id()
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd", "none"])
+def test_msgpack_pages_round_trip(no_dictionaries, codec):
+    pytest.importorskip("msgpack")
+    data = {"page": {"totalPages": 2}, "operationalFlights": [{"flightNumber": 1234, "route": ["SVQ", "AMS"], "haul": None}]}
+    payload = afklm_codecs.encode_page(data, codec, "msgpack")
+
+    assert afklm_codecs.detect_codec(payload) == codec
+    assert afklm_codecs.detect_format(afklm_codecs.decode_bytes(payload)) == "msgpack"
+    assert afklm_codecs.decode_page(payload) == data
+    assert afklm_codecs.page_extension("msgpack", codec) == {"gzip": ".msgpack.gz", "zstd": ".msgpack.zst", "none": ".msgpack"}[codec]
+
+
+def test_format_detected_from_the_first_byte():
+    assert afklm_codecs.detect_format(b'  \n{"a": 1}') == "json"
+    assert afklm_codecs.detect_format(b'[1, 2]') == "json"
+    # anything else is read as msgpack (a map starts with 0x80-0x8f, 0xde or 0xdf)
+    assert afklm_codecs.detect_format(b'\x81\xa1a\x01') == "msgpack"
+    assert afklm_codecs.detect_format(b'') == "msgpack"
@@ -0,0 +1,98 @@
+import datetime
+import importlib
+import json
+import sys
+import types
+import urllib.error
+import urllib.request
+
+import pytest
+
+import afklm_common
+import afklm_pacing
+
+
+@pytest.fixture
+def daemon(workdir, monkeypatch):
+    # daemon module imported against a fake collector (the real one sets up clients at import) and a fake clock
+    collector = types.ModuleType("afklm_api_data_collection_gcp_v1")
+    collector.runs = []
+
+    def run_collection(**options):
+        if collector.fail:
+            raise RuntimeError("quota exhausted on every key")
+        collector.runs.append(options)
+
+    collector.run_collection = run_collection
+    collector.fail = False
+    monkeypatch.setitem(sys.modules, "afklm_api_data_collection_gcp_v1", collector)
+    monkeypatch.delitem(sys.modules, "afklm_collector_daemon", raising=False)
+    module = importlib.import_module("afklm_collector_daemon")
+
+    clock = {'now': datetime.datetime(2025, 7, 20, 12, 0)}
+    monkeypatch.setattr(module, "utc_now", lambda: clock['now'])
+    module.schedule_jobs(clock['now'])
+    return module, collector, clock
+
+
+def test_jobs_run_when_due_with_their_options(daemon):
+    module, collector, clock = daemon
+    assert {name: val['next_run'] for name, val in module.daemon_status['jobs'].items()} == {
+        'quota_reset': datetime.datetime(2025, 7, 21, 0, 5),
+        'd1_refresh': datetime.datetime(2025, 7, 20, 18, 0),
+        'retry_sweep': datetime.datetime(2025, 7, 20, 16, 0),
+    }
+    assert module.run_due_jobs(clock['now']) == module.poll_interval
+    assert collector.runs == []
+
+    clock['now'] = datetime.datetime(2025, 7, 20, 16, 0)
+    module.run_due_jobs(clock['now'])
+    assert collector.runs == [{'daily_steps': False, 'retries_only': True}]
+    assert module.daemon_status['jobs']['retry_sweep']['next_run'] == datetime.datetime(2025, 7, 20, 20, 0)
+
+    # the D-1 window is the UTC day of the clock
+    clock['now'] = datetime.datetime(2025, 7, 20, 18, 0, 10)
+    assert module.run_due_jobs(clock['now']) == module.poll_interval
+    assert collector.runs[-1] == {'daily_steps': False, 'dates': ["2025-07-20"], 'reopen_complete': True}
+    assert module.daemon_status['jobs']['d1_refresh']['next_run'] == datetime.datetime(2025, 7, 21, 18, 0)
+    assert module.daemon_status['last_run']['status'] == "ok"
+
+
+def test_quota_reset_clears_daily_state_before_a_full_run(daemon, monkeypatch):
+    module, collector, clock = daemon
+    monkeypatch.setitem(afklm_pacing.pacing_state, "key_1", {'interval': 5, 'retry_after': 0})
+    monkeypatch.setitem(afklm_common.listing_cache, "data", {"a.json": {}})
+
+    clock['now'] = datetime.datetime(2025, 7, 21, 0, 5)
+    module.run_due_jobs(clock['now'])
+    assert collector.runs[0] == {}  # the overdue d1_refresh and retry_sweep follow
+    assert afklm_pacing.pacing_state == {}
+    assert afklm_common.listing_cache == {}
+    assert module.daemon_status['jobs']['quota_reset']['next_run'] == datetime.datetime(2025, 7, 22, 0, 5)
+
+
+def test_failed_run_recorded_and_scheduler_goes_on(daemon):
+    module, collector, clock = daemon
+    collector.fail = True
+    clock['now'] = datetime.datetime(2025, 7, 20, 16, 0)
+    module.run_due_jobs(clock['now'])
+    assert module.daemon_status['last_run']['status'] == "error"
+    assert "quota exhausted" in module.daemon_status['last_error']['error']
+    assert module.daemon_status['state'] == "idle"
+    assert module.daemon_status['jobs']['retry_sweep']['last_run'] == clock['now']
+
+
+def test_health_endpoint_returns_status(daemon, monkeypatch):
+    module, collector, clock = daemon
+    monkeypatch.setattr(module, "health_port", 0)
+    server = module.start_health_server()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/health") as response:
+            status = json.loads(response.read())
+        assert status['jobs']['d1_refresh']['next_run'] == "2025-07-20 18:00:00"
+        assert status['runs'] == 0
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
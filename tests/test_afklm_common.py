@@ -0,0 +1,35 @@
+import os
+
+import afklm_common
+
+
+def write_page(folder, name):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name), "wb") as file:
+        file.write(b"{}")
+
+
+def test_warm_listing_sees_other_processes_once_expired(workdir, monkeypatch):
+    monkeypatch.setattr(afklm_common, "keep_listing_warm", True)
+    monkeypatch.setattr(afklm_common, "listing_max_age", 3600)
+    write_page("data", "a.json")
+    assert [val['name'] for val in afklm_common.list_files("data")] == ["a.json"]
+
+    # written by another process: not in the warm listing until it expires
+    write_page("data", "b.json")
+    assert [val['name'] for val in afklm_common.list_files("data")] == ["a.json"]
+
+    monkeypatch.setitem(afklm_common.listing_times, "data", afklm_common.listing_times["data"] - 3600)
+    assert [val['name'] for val in afklm_common.list_files("data")] == ["a.json", "b.json"]
+
+
+def test_warm_listing_kept_without_max_age(workdir, monkeypatch):
+    monkeypatch.setattr(afklm_common, "keep_listing_warm", True)
+    monkeypatch.setattr(afklm_common, "listing_max_age", None)
+    write_page("data", "a.json")
+    afklm_common.list_files("data")
+    write_page("data", "b.json")
+    assert [val['name'] for val in afklm_common.list_files("data")] == ["a.json"]
+
+    afklm_common.refresh_listings()
+    assert [val['name'] for val in afklm_common.list_files("data")] == ["a.json", "b.json"]
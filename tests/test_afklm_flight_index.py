@@ -0,0 +1,59 @@
+import gzip
+import json
+import os
+
+import numpy as np
+import pytest
+
+import afklm_common
+import afklm_flight_index as flight_index
+
+page_name = "afklm_api_data_collection_origin=SVQ&destination=AMS&startRange=2025-07-21T00_00_00Z&endRange=2025-07-21T23_59_59Z_0.json.gz"
+
+
+def store_page(flight_numbers, generation):
+    page = {"operationalFlights": [
+        {"flightNumber": number, "flightScheduleDate": "2025-07-21", "airline": {"code": "KL"},
+         "flightLegs": [{"departureInformation": {"airport": {"code": "SVQ"}}, "arrivalInformation": {"airport": {"code": "AMS"}},
+                         "aircraft": {"registration": "PHBEF"}}]}
+        for number in flight_numbers]}
+    afklm_common.write_bytes(gzip.compress(json.dumps(page).encode()), "data", page_name)
+    os.utime(f"data/{page_name}", ns=(generation, generation))
+
+
+def test_page_stored_again_replaces_its_entries(workdir):
+    store_page([1234, 5678], 1)
+    flight_index.build_index()
+    store_page([5678], 2)
+    flight_index.build_index()
+
+    assert flight_index.lookup_flights("flight", "KL1234") == []
+    assert [flight['flightNumber'] for flight in flight_index.lookup_flights("flight", "KL5678")] == [5678]
+    assert flight_index.load_pages()['page_id'].tolist() == [1]
+
+
+def test_merge_drops_the_entries_of_superseded_pages(workdir, monkeypatch):
+    monkeypatch.setattr(flight_index, "max_segments", 1)
+    store_page([1234], 1)
+    flight_index.build_index()
+    store_page([1234], 2)
+    flight_index.build_index()
+
+    files = flight_index.segment_files("flight")
+    assert len(files) == 1
+    assert np.load(files[0])['page'].tolist() == [1]
+    assert len(flight_index.lookup("route", "SVQ-AMS")) == 1
+
+
+def test_page_ids_are_not_reused_after_an_interrupted_build(workdir):
+    store_page([1234], 1)
+    flight_index.build_index()
+    os.remove(f"{flight_index.path_index}/pages.csv")
+    assert flight_index.next_page_id(flight_index.load_pages()) == 1
+
+
+def test_keys_longer_than_the_key_size(workdir):
+    store_page([1234], 1)
+    flight_index.build_index()
+    with pytest.raises(ValueError):
+        flight_index.lookup("flight", "KL1234567890123")
@@ -0,0 +1,21 @@
+import pandas as pd
+
+import afklm_flight_state
+
+
+def leg(key, kind, observed_at, status):
+    row = dict.fromkeys(afklm_flight_state.state_columns, '')
+    return row | {
+        'flight_key': key, 'flightScheduleDate': "2025-07-21", 'kind': kind, 'observed_at': observed_at,
+        'legStatusPublic': status, 'page': f"{key}_{kind}",
+    }
+
+
+def test_latest_observation_wins_and_kinds_break_ties():
+    current = afklm_flight_state.typed_state(pd.DataFrame([leg("F1", "", "2025-07-21T20:00:00Z", "ARRIVED"), leg("F2", "sched", "2025-07-21T08:00:00Z", "SCHEDULED")]))
+    new = afklm_flight_state.typed_state(pd.DataFrame([
+        leg("F1", "updSchedD1", "2025-07-21T08:00:00Z", "SCHEDULED"),  # late page, older observation
+        leg("F2", "updSchedD1", "2025-07-21T08:00:00Z", "DELAYED"),  # same time, later kind
+    ]))
+    state = afklm_flight_state.merge_state(current, new)
+    assert state.set_index('flight_key')['legStatusPublic'].astype(str).to_dict() == {"F1": "ARRIVED", "F2": "DELAYED"}
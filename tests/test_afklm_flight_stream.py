@@ -0,0 +1,188 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import afklm_flight_stream
+
+
+class FakeSink:
+    # records the batches; write blocks while `release` is not set
+
+    def __init__(self):
+        self.batches = []
+        self.closed = False
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def write(self, lines):
+        self.writing.set()
+        self.release.wait()
+        self.batches.append([json.loads(line) for line in lines])
+
+    def close(self):
+        self.closed = True
+
+
+def page(*numbers):
+    return {'operationalFlights': [{'flightNumber': number} for number in numbers]}
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    assert condition()
+
+
+@pytest.fixture
+def stream(workdir, monkeypatch):
+    monkeypatch.setattr(afklm_flight_stream, "stream_stats", dict.fromkeys(afklm_flight_stream.stream_stats, 0))
+    monkeypatch.setattr(afklm_flight_stream, "flush_interval", 60)
+    yield afklm_flight_stream
+    afklm_flight_stream.stop_stream()
+
+
+def test_records_written_by_batches_and_rest_on_stop(stream, monkeypatch):
+    monkeypatch.setattr(stream, "batch_size", 4)
+    sink = FakeSink()
+    stream.start_stream(sink)
+    for numbers in [(1, 2), (3, 4), (5, 6)]:
+        assert stream.publish_page(page(*numbers), f"page_{numbers[0]}.json", "sched", "origin=AMS")
+
+    wait_for(lambda: len(sink.batches) == 1)
+    stats = stream.stop_stream()
+    assert [[val['flight']['flightNumber'] for val in batch] for batch in sink.batches] == [[1, 2, 3, 4], [5, 6]]
+    assert sink.batches[0][0]['page'] == "page_1.json" and sink.batches[0][0]['kind'] == "sched"
+    assert sink.closed
+    assert (stats['pages'], stats['records'], stats['batches']) == (3, 6, 2)
+
+
+def test_partial_batch_written_after_flush_interval(stream, monkeypatch):
+    monkeypatch.setattr(stream, "flush_interval", 0.05)
+    sink = FakeSink()
+    stream.start_stream(sink)
+    stream.publish_page(page(1), "page_0.json")
+    wait_for(lambda: len(sink.batches) == 1)
+    assert stream.stream_thread is not None
+
+
+def fill_queue(stream, sink):
+    # worker stuck writing the first page, the second one fills the queue (batch_size = queue_max_pages = 1)
+    sink.release.clear()
+    stream.start_stream(sink)
+    assert stream.publish_page(page(1), "page_0.json")
+    sink.writing.wait(5)
+    assert stream.publish_page(page(2), "page_1.json")
+
+
+def test_full_queue_drops_the_page(stream, monkeypatch):
+    monkeypatch.setattr(stream, "backpressure", "drop")
+    monkeypatch.setattr(stream, "batch_size", 1)
+    monkeypatch.setattr(stream, "queue_max_pages", 1)
+    sink = FakeSink()
+    fill_queue(stream, sink)
+
+    assert not stream.publish_page(page(3), "page_2.json")
+    assert stream.stream_stats['dropped_pages'] == 1
+    sink.release.set()
+    stream.stop_stream()
+    assert [batch[0]['flight']['flightNumber'] for batch in sink.batches] == [1, 2]
+
+
+def test_full_queue_blocks_until_the_sink_catches_up(stream, monkeypatch):
+    monkeypatch.setattr(stream, "backpressure", "block")
+    monkeypatch.setattr(stream, "block_timeout", 5)
+    monkeypatch.setattr(stream, "batch_size", 1)
+    monkeypatch.setattr(stream, "queue_max_pages", 1)
+    sink = FakeSink()
+    fill_queue(stream, sink)
+
+    threading.Timer(0.1, sink.release.set).start()
+    assert stream.publish_page(page(3), "page_2.json")
+    stream.stop_stream()
+    assert [batch[0]['flight']['flightNumber'] for batch in sink.batches] == [1, 2, 3]
+    assert stream.stream_stats['dropped_pages'] == 0
+
+
+def test_full_queue_blocks_then_drops_after_timeout(stream, monkeypatch):
+    monkeypatch.setattr(stream, "backpressure", "block")
+    monkeypatch.setattr(stream, "block_timeout", 0.05)
+    monkeypatch.setattr(stream, "batch_size", 1)
+    monkeypatch.setattr(stream, "queue_max_pages", 1)
+    sink = FakeSink()
+    fill_queue(stream, sink)
+
+    assert not stream.publish_page(page(3), "page_2.json")
+    assert stream.stream_stats['dropped_pages'] == 1
+    sink.release.set()
+
+
+def test_stream_restarted_with_a_single_exit_hook(stream, monkeypatch):
+    hooks = []
+    monkeypatch.setattr(stream, "exit_hook_registered", False)
+    monkeypatch.setattr(stream.atexit, "register", hooks.append)
+    for number in range(2):
+        sink = FakeSink()
+        stream.start_stream(sink)
+        stream.publish_page(page(number), f"page_{number}.json")
+        stream.stop_stream()
+        assert sink.closed and [batch[0]['flight']['flightNumber'] for batch in sink.batches] == [number]
+    assert hooks == [stream.stop_stream]
+
+
+def test_file_sink_appends_ndjson(stream, monkeypatch):
+    monkeypatch.setattr(stream, "path_stream", "stream/flights.ndjson")
+    stream.start_stream()
+    stream.publish_page(page(1, 2), "page_0.json")
+    stream.stop_stream()
+    with open("stream/flights.ndjson") as file:
+        assert [json.loads(line)['flight']['flightNumber'] for line in file] == [1, 2]
+
+
+def test_socket_sink_sends_to_the_listener_and_counts_errors_without_one(stream, workdir):
+    path = str(workdir / "flights.sock")
+    sink = stream.UnixSocketSink(path)
+    stream.write_batch(sink, [b'{"a": 1}\n'])
+    assert stream.stream_stats['sink_errors'] == 1
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    received = []
+
+    def accept():
+        connection, _ = server.accept()
+        with connection, connection.makefile('rb') as lines:
+            received.extend(lines)
+
+    consumer = threading.Thread(target=accept)
+    consumer.start()
+    stream.write_batch(sink, [b'{"a": 1}\n', b'{"a": 2}\n'])
+    sink.close()
+    consumer.join(5)
+    server.close()
+    os.remove(path)
+    assert received == [b'{"a": 1}\n', b'{"a": 2}\n']
+    assert stream.stream_stats['batches'] == 1
+
+
+def test_broker_sink_publishes_record_by_record(stream, workdir):
+    published = []
+
+    class Publisher:
+        def publish(self, topic, data):
+            published.append((topic, data))
+
+    stream.BrokerSink(Publisher(), "flights").write([b'{"a": 1}\n', b'{"a": 2}\n'])
+    assert published == [("flights", b'{"a": 1}'), ("flights", b'{"a": 2}')]
+
+    local = stream.LocalTopicPublisher(str(workdir / "topics"))
+    sink = stream.BrokerSink(local, "flights")
+    sink.write([b'{"a": 1}\n'])
+    sink.close()
+    assert (workdir / "topics" / "flights.ndjson").read_bytes() == b'{"a": 1}\n'
@@ -0,0 +1,37 @@
+import json
+import logging
+
+import afklm_common
+import afklm_logging
+
+
+def test_json_lines_written_under_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(afklm_logging, "json_lines", True)
+    afklm_logging.stop_logging()
+    afklm_logging.start_logging()
+    try:
+        afklm_common.info_message("diffs written")
+        afklm_logging.log_message("page stored", 'green', page=3)
+        afklm_logging.flush_logging()
+    finally:
+        afklm_logging.stop_logging()
+
+    files = list((tmp_path / afklm_logging.path_logs).glob("*.jsonl"))
+    assert len(files) == 1
+    entries = [json.loads(line) for line in files[0].read_text().splitlines()]
+    assert entries[-2]['message'] == "diffs written"
+    assert entries[-1]['message'] == "page stored" and entries[-1]['page'] == 3
+
+
+def test_extra_handlers_not_shared_between_starts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(afklm_logging, "json_lines", False)
+    afklm_logging.stop_logging()
+    try:
+        afklm_logging.start_logging([logging.NullHandler()])
+        afklm_logging.stop_logging()
+        afklm_logging.start_logging()
+        assert len(afklm_logging.listener.handlers) == 1
+    finally:
+        afklm_logging.stop_logging()
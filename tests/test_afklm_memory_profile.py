@@ -0,0 +1,42 @@
+import pytest
+
+import afklm_memory_profile
+
+
+@pytest.fixture
+def profiling(workdir, monkeypatch):
+    monkeypatch.setattr(afklm_memory_profile, "memory_profiling", True)
+    afklm_memory_profile.tracemalloc.start()
+    yield afklm_memory_profile
+    afklm_memory_profile.tracemalloc.stop()
+    afklm_memory_profile.stage_records.clear()
+    afklm_memory_profile.stage_occurrences.clear()
+    afklm_memory_profile.last_snapshot.clear()
+
+
+def test_report_starts_the_records_of_the_next_run(profiling):
+    for run in range(2):
+        for _ in range(3):
+            with profiling.profile_stage("fetch"):
+                pass
+        summary = profiling.save_memory_report()
+        assert summary['occurrences'].tolist() == [3]
+        assert profiling.stage_records == []
+
+
+def test_nested_stage_keeps_the_peak_of_the_enclosing_one(profiling):
+    with profiling.profile_stage("fetch"):
+        payload = bytearray(5_000_000)
+        del payload
+        with profiling.profile_stage("encode"):
+            small = bytearray(10_000)
+        del small
+
+    records = {val['stage']: val for val in profiling.stage_records}
+    assert records['fetch']['traced_peak'] >= 5_000_000
+    assert records['encode']['traced_peak'] - records['encode']['traced_after'] < 1_000_000
+    assert profiling.active_stages == []
+
+    summary = profiling.memory_summary(profiling.pd.DataFrame(profiling.stage_records))
+    assert summary['stage'].tolist() == ["encode", "fetch"]
+    assert summary['growth_per_occurrence'].tolist() == [0.0, 0.0]
@@ -0,0 +1,29 @@
+import pandas as pd
+
+import afklm_otp_aggregates
+
+
+def contribution(key, kind, observed_at, arr_delay):
+    return {
+        'flight_key': key, 'flightScheduleDate': "2025-07-21", 'airlineCode': "KL", 'origin': "SVQ", 'destination': "AMS",
+        'observed_at': pd.Timestamp(observed_at, tz="UTC"), 'kind_rank': kind,
+    } | dict.fromkeys(afklm_otp_aggregates.metric_columns, 0) | {'flights': 1, 'arrived': 1, 'arr_delay_minutes': arr_delay}
+
+
+def test_newer_snapshot_retracts_the_previous_contribution():
+    current = pd.DataFrame([contribution("F1", 0, "2025-07-21T08:00", 0), contribution("F2", 2, "2025-07-21T08:00", 5)])
+    new = pd.DataFrame([contribution("F1", 2, "2025-07-21T20:00", 40)])
+    contributions, delta = afklm_otp_aggregates.merge_contributions(current, new)
+
+    assert contributions.set_index('flight_key')['arr_delay_minutes'].to_dict() == {"F1": 40, "F2": 5}
+    totals = delta[afklm_otp_aggregates.metric_columns].sum()
+    assert totals['flights'] == 0 and totals['arr_delay_minutes'] == 40
+
+
+def test_late_older_snapshot_is_ignored():
+    current = pd.DataFrame([contribution("F1", 2, "2025-07-21T20:00", 40)])
+    new = pd.DataFrame([contribution("F1", 0, "2025-07-21T08:00", 0)])
+    contributions, delta = afklm_otp_aggregates.merge_contributions(current, new)
+
+    assert contributions['arr_delay_minutes'].tolist() == [40]
+    assert delta[afklm_otp_aggregates.metric_columns].abs().sum().sum() == 0
@@ -0,0 +1,49 @@
+import afklm_pacing
+
+
+class Response:
+
+    def __init__(self, status_code, headers=None, text=""):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = text
+
+
+def setup_function():
+    afklm_pacing.pacing_state = {}
+    afklm_pacing.telemetry = []
+
+
+def test_call_count_not_reused_from_an_older_response():
+    afklm_pacing.update_pacing("key", Response(200, {"X-Plan-Quota-Allotted": "100", "X-Plan-Quota-Current": "40"}))
+    assert afklm_pacing.server_call_count("key", 12) == 40
+
+    afklm_pacing.update_pacing("key", Response(429))
+    assert afklm_pacing.server_call_count("key", 41) == 41
+
+
+def test_generic_rate_limit_headers_are_not_read_as_daily_quota():
+    afklm_pacing.update_pacing("key", Response(200, {"X-RateLimit-Limit": "1", "X-RateLimit-Remaining": "0"}))
+    assert not afklm_pacing.quota_nearly_exhausted("key")
+    assert afklm_pacing.server_call_count("key", 3) == 3
+
+
+def test_daily_quota_headers():
+    afklm_pacing.update_pacing("key", Response(200, {"X-RateLimit-Limit-Day": "100", "X-RateLimit-Remaining-Day": "1"}))
+    assert afklm_pacing.server_call_count("key", 3) == 99
+    assert afklm_pacing.quota_nearly_exhausted("key")
+
+
+def test_quota_exhausted_on_daily_limit_only():
+    assert afklm_pacing.quota_exhausted(Response(403, {"X-Mashery-Error-Code": "ERR_403_DEVELOPER_OVER_RATE"}))
+    assert not afklm_pacing.quota_exhausted(Response(429, {"X-Mashery-Error-Code": "ERR_403_DEVELOPER_OVER_QPS"}))
+    assert afklm_pacing.quota_exhausted(Response(429, text="<h1>Developer Over Rate</h1>"))
+    assert not afklm_pacing.quota_exhausted(Response(429, text="<h1>Developer Over Qps</h1>"))
+    assert not afklm_pacing.quota_exhausted(Response(503, text="Service Unavailable"))
+
+
+def test_rate_limited_interval_doubles_up_to_the_cap():
+    for _ in range(20):
+        state = afklm_pacing.update_pacing("key", Response(429))
+    assert state['interval'] == afklm_pacing.max_call_interval
+    assert afklm_pacing.update_pacing("key", Response(429, {"Retry-After": "3"}))['retry_after'] == 3.0
@@ -0,0 +1,56 @@
+import pytest
+
+import afklm_codecs
+import afklm_common
+import afklm_page_archive
+
+
+def page_name(date, origin, extension):
+    return f"afklm_api_data_collection_origin={origin}&destination=AMS&startRange={date}T00_00_00Z&endRange={date}T23_59_59Z_0{extension}"
+
+
+@pytest.fixture(params=["workdir", "cloud"])
+def storage(request, monkeypatch):
+    # same packing against the local folder and the in-memory bucket (compose for the appends)
+    request.getfixturevalue(request.param)
+    monkeypatch.setattr(afklm_codecs, "dictionaries", {})
+    monkeypatch.setattr(afklm_page_archive, "delete_packed_pages", True)
+    return request.param
+
+
+def store(pages):
+    for name, (data, codec, page_format) in pages.items():
+        afklm_common.write_bytes(afklm_codecs.encode_page(data, codec, page_format), "data", name)
+
+
+def test_mixed_codec_archive_round_trip_and_repack(storage):
+    pytest.importorskip("zstandard")
+    pytest.importorskip("msgpack")
+    pages = {
+        page_name("2025-07-10", "SVQ", ".json.gz"): ({'flights': [1]}, "gzip", "json"),
+        page_name("2025-07-10", "LHR", ".msgpack.zst"): ({'flights': [2]}, "zstd", "msgpack"),
+        page_name("2025-07-10", "CDG", ".json"): ({'flights': [3]}, "none", "json"),
+    }
+    store(pages)
+    afklm_page_archive.run_page_archive()
+
+    assert afklm_common.list_json_files(include_archives=False) == []
+    for name, (data, _, _) in pages.items():
+        assert afklm_common.open_json("data", name) == data
+
+    # a new page of the packed day and a page stored again are appended, the other offsets stay
+    offsets = {name: val['offset'] for name, val in afklm_common.load_archive_catalog().items()}
+    packed_size = max(val['offset'] + val['length'] for val in afklm_common.load_archive_catalog().values())
+    added = {
+        page_name("2025-07-10", "FRA", ".msgpack.gz"): ({'flights': [4]}, "gzip", "msgpack"),
+        page_name("2025-07-10", "SVQ", ".json.gz"): ({'flights': [1, 5]}, "gzip", "json"),
+    }
+    store(added)
+    afklm_page_archive.run_page_archive()
+
+    catalog = afklm_common.load_archive_catalog()
+    assert len(catalog) == 4
+    assert all(catalog[name]['offset'] == offsets[name] for name in pages if name not in added)
+    assert min(catalog[name]['offset'] for name in added) == packed_size
+    for name, (data, _, _) in (pages | added).items():
+        assert afklm_common.open_json("data", name) == data
@@ -0,0 +1,24 @@
+import afklm_page_cursor
+
+
+def test_only_the_holes_are_fetched():
+    stored = {0: "p0", 1: "p1", 3: "p3"}
+    assert afklm_page_cursor.missing_pages(stored, 5) == [2, 4]
+    assert afklm_page_cursor.next_missing_page(stored, 5) == 2
+    assert afklm_page_cursor.next_missing_page(stored, 5, max_page_to_fetch=2) is None
+    assert afklm_page_cursor.next_missing_page({0: "p0", 1: "p1"}, 2) is None
+
+
+def test_unknown_total_only_gives_the_next_page():
+    assert afklm_page_cursor.missing_pages({}, None) == [0]
+    assert afklm_page_cursor.missing_pages({0: "p0", 1: "p1"}, afklm_page_cursor.known_total_pages('')) == [2]
+    assert afklm_page_cursor.known_total_pages(3.0) == 3
+
+
+def test_catalog_keys_the_pages_by_query_and_kind():
+    url = "origin=SVQ&destination=AMS&startRange=2025-07-21T00:00:00Z"
+    names = [afklm_page_cursor.page_file_name(url, page, kind) + ".gz" for page, kind in ((0, "sched"), (1, "sched"), (0, ""))]
+    catalog = afklm_page_cursor.build_page_catalog(names + ["afklm_api_keys.csv"])
+    assert sorted(afklm_page_cursor.stored_pages(catalog, url, "sched")) == [0, 1]
+    assert sorted(afklm_page_cursor.stored_pages(catalog, url, "")) == [0]
+    assert afklm_page_cursor.stored_pages(catalog, url, "updSchedD1") == {}
@@ -0,0 +1,52 @@
+import afklm_common
+import afklm_page_layout
+
+
+def page_name(date, origin="SVQ", destination="AMS", kind="_sched"):
+    return f"afklm_api_data_collection_origin={origin}&destination={destination}&startRange={date}T00_00_00Z&endRange={date}T23_59_59Z_0{kind}.json.gz"
+
+
+def store(names, layout):
+    for name in names:
+        afklm_common.write_bytes(b"page", "data", afklm_common.page_path(name, layout))
+
+
+def test_partitioned_listing_lists_only_the_prefixes_of_the_days(cloud, monkeypatch):
+    monkeypatch.setattr(afklm_common, "page_layout", "partitioned")
+    names = [page_name("2025-07-21"), page_name("2025-07-21", "AMS", "CDG"), page_name("2025-07-22")]
+    store(names, "partitioned")
+
+    pages = afklm_common.list_page_partitions(["2025-07-21"])
+
+    assert [val['name'] for val in pages] == sorted(names[:2])
+    assert [prefix for prefix in cloud.listed_prefixes if prefix.startswith("data/")] == ["data/date=2025-07-21/"]
+    assert [val['name'] for val in afklm_common.list_page_partitions(["2025-07-21"], routes=["AMS-CDG"])] == [names[1]]
+
+
+def test_flat_listing_is_filtered_and_keeps_archived_pages(workdir, monkeypatch):
+    names = [page_name("2025-07-21"), page_name("2025-07-22")]
+    store(names[:1], "flat")
+    archived = {names[1]: {'archive': "a", 'offset': 0, 'length': 4, 'updated': "u", 'generation': "1"}}
+    monkeypatch.setattr(afklm_common, "archive_catalog", archived)
+
+    assert [val['name'] for val in afklm_common.list_page_partitions(["2025-07-22"])] == [names[1]]
+    assert afklm_common.list_page_partitions(["2025-07-22"], include_archives=False) == []
+
+
+def test_scan_window_of_the_incremental_stages(workdir, monkeypatch):
+    monkeypatch.setattr(afklm_common, "scan_days_back", 1)
+    monkeypatch.setattr(afklm_common, "scan_days_ahead", 1)
+    today = afklm_common.datetime.date(2025, 7, 21)
+    assert afklm_common.scan_dates(today) == ["2025-07-20", "2025-07-21", "2025-07-22"]
+
+
+def test_migration_keeps_the_page_identity(cloud, monkeypatch):
+    name = page_name("2025-07-21")
+    store([name], "flat")
+    before = afklm_common.list_json_files(include_archives=False)
+
+    afklm_page_layout.migrate_pages("partitioned")
+
+    after = afklm_common.list_json_files(include_archives=False)
+    assert after[0]['path'] == afklm_common.page_path(name, "partitioned")
+    assert (after[0]['generation'], after[0]['updated']) == (str(before[0]['generation']), before[0]['updated'])
@@ -0,0 +1,67 @@
+import gzip
+import json
+
+import afklm_common
+import afklm_projection
+import afklm_snapshot_diff
+
+
+page_name = "afklm_api_data_collection_origin=SVQ&destination=AMS&startRange=2025-07-21T00_00_00Z&endRange=2025-07-21T23_59_59Z_0_sched.json.gz"
+page = {
+    "page": {"totalPages": 1, "fullCount": 1},
+    "operationalFlights": [{
+        "flightNumber": 1234, "flightScheduleDate": "2025-07-21", "airline": {"code": "KL", "name": "KLM"},
+        "flightLegs": [{"departureInformation": {"airport": {"code": "SVQ", "name": "Sevilla"}}, "arrivalInformation": {"airport": {"code": "AMS"}}}],
+    }],
+}
+
+
+def stored_pages():
+    return [(val['name'], str(val['generation']), val['updated']) for val in afklm_common.list_json_files(include_archives=False)]
+
+
+def test_project_keeps_only_the_spec_paths():
+    projected = afklm_projection.project_page(page, "not_sampled", ["operationalFlights[].flightNumber", "page"])
+    assert projected["operationalFlights"] == [{"flightNumber": 1234}]
+    assert projected["page"] == page["page"]
+    assert afklm_projection.project_page(projected, "not_sampled", ["operationalFlights[].flightNumber", "page"]) is projected
+
+
+def test_page_of_a_former_spec_projected_again():
+    former = afklm_projection.project_page(page, "not_sampled", ["operationalFlights[].flightNumber", "operationalFlights[].airline", "page"])
+    projected = afklm_projection.project_page(former, "not_sampled", ["operationalFlights[].flightNumber", "page"])
+    assert projected["operationalFlights"] == [{"flightNumber": 1234}]
+    assert projected["_projection"] == afklm_projection.projection_id(["operationalFlights[].flightNumber", "page"])
+
+
+def check_rewrite_keeps_page_identity(monkeypatch):
+    monkeypatch.setattr(afklm_projection, "raw_sample_rate", 0)
+    afklm_common.write_bytes(gzip.compress(json.dumps(page).encode()), "data", page_name)
+    before = stored_pages()
+    processed = afklm_snapshot_diff.list_new_pages(afklm_common.load_processed_pages(afklm_snapshot_diff.path_derived, afklm_snapshot_diff.processed_file)).assign(processed_at="x")
+
+    afklm_projection.rewrite_pages()
+
+    assert stored_pages() == before
+    assert len(afklm_snapshot_diff.list_new_pages(processed)) == 0
+    assert "name" not in afklm_common.open_json("data", page_name)["operationalFlights"][0]["airline"]
+
+
+def test_rewrite_keeps_page_identity_locally(workdir, monkeypatch):
+    check_rewrite_keeps_page_identity(monkeypatch)
+
+
+def test_rewrite_keeps_page_identity_in_the_cloud(cloud, monkeypatch):
+    check_rewrite_keeps_page_identity(monkeypatch)
+    assert cloud.objects["data/" + page_name]['generation'] > 1001
+
+
+def test_archived_pages_left_out_of_the_rewrite(workdir, monkeypatch):
+    monkeypatch.setattr(afklm_projection, "raw_sample_rate", 0)
+    payload = gzip.compress(json.dumps(page).encode())
+    afklm_common.write_bytes(payload, "data", page_name)
+    archived = {page_name: {'archive': "date=2025-07-21.pack", 'offset': 0, 'length': len(payload), 'updated': "u", 'generation': "1"}}
+    monkeypatch.setattr(afklm_projection, "load_archive_catalog", lambda refresh=False: archived)
+
+    assert afklm_projection.rewrite_pages().empty
+    assert afklm_common.read_bytes("data", page_name) == payload
@@ -0,0 +1,83 @@
+import gzip
+import json
+
+import pandas as pd
+
+import afklm_common
+import afklm_query_planner as planner
+
+date = "2025-07-21"
+routes = [("AMS", "CDG"), ("AMS", "LHR"), ("AMS", "SVQ")]
+
+
+def write_route_rows():
+    df = pd.DataFrame(
+        [{'destination': destination, 'origin': origin, 'startRange': f"{date}T00:00:00Z", 'endRange': f"{date}T23:59:59Z"}
+         for origin, destination in routes]).assign(**dict.fromkeys(planner.state_columns, ''))
+    afklm_common.save_csv(df, "call_parameter_lists", "df_call_parameters_routes.csv")
+
+
+def route_rows():
+    return afklm_common.import_csv("call_parameter_lists", "df_call_parameters_routes.csv").fillna('').astype(str)
+
+
+def store_broad_pages(call_parameters, kind, flights):
+    page = {"operationalFlights": [
+        {"flightNumber": number, "flightScheduleDate": date, "airline": {"code": "KL"},
+         "flightLegs": [{"departureInformation": {"airport": {"code": origin}}, "arrivalInformation": {"airport": {"code": destination}}}]}
+        for number, (origin, destination) in enumerate(flights)]}
+    name = f"afklm_api_data_collection_{call_parameters.replace(':', '_')}_0{kind}.json.gz"
+    afklm_common.write_bytes(gzip.compress(json.dumps(page).encode()), "data", name)
+
+
+def complete_broad_query(call_parameters):
+    df = afklm_common.import_csv("call_parameter_lists", planner.planned_parameter_file).fillna('').astype(str)
+    df[['call_parameters', 'response', 'completion']] = [call_parameters, "<Response [200]>", '100']
+    afklm_common.save_csv(df, "call_parameter_lists", planner.planned_parameter_file)
+
+
+def test_plan_marks_route_rows_without_completing_them(workdir):
+    write_route_rows()
+
+    ledger = planner.plan_queries()
+
+    assert ledger[['kind', 'airport', 'status']].values.tolist() == [['origin', 'AMS', 'planned']]
+    df = route_rows()
+    assert (df['completion'] == '').all()
+    assert df['message'].map(planner.covered_by_plan).all()
+    assert len(planner.pending_route_days(planner.load_parameter_tables())) == 0
+
+
+def test_split_back_per_refresh_window(workdir):
+    write_route_rows()
+    call_parameters = planner.plan_queries()['call_parameters'].iloc[0]
+    complete_broad_query(call_parameters)
+
+    store_broad_pages(call_parameters, "_sched", routes[:2])
+    ledger = planner.split_back()
+    assert ledger[['status', 'windows']].values.tolist() == [['split', 'sched']]
+    df = route_rows()
+    assert df['totalFlights'].tolist() == ['1', '1', '0']
+    assert (df['completion'] == '100').all() and df['message'].map(planner.covered_by_plan).all()
+
+    # nothing new: nothing split again
+    planner.split_back()
+    assert planner.load_plan()['windows'].tolist() == ['sched']
+
+    # retrieved again on the day: the later window is split over the route rows
+    store_broad_pages(call_parameters, "_updSchedD1", routes)
+    ledger = planner.split_back()
+    assert ledger['windows'].tolist() == ['sched;updSchedD1']
+    assert route_rows()['totalFlights'].tolist() == ['1', '1', '1']
+    assert route_rows()['message'].str.endswith("(updSchedD1)").all()
+
+
+def test_failed_broad_query_releases_its_routes(workdir):
+    write_route_rows()
+    call_parameters = planner.plan_queries()['call_parameters'].iloc[0]
+    df = afklm_common.import_csv("call_parameter_lists", planner.planned_parameter_file).fillna('').astype(str)
+    df[['call_parameters', 'response']] = [call_parameters, "<Response [400]>"]
+    afklm_common.save_csv(df, "call_parameter_lists", planner.planned_parameter_file)
+
+    assert planner.split_back()['status'].tolist() == ['released']
+    assert not route_rows()['message'].map(planner.covered_by_plan).any()
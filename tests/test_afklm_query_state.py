@@ -0,0 +1,23 @@
+import pandas as pd
+
+import afklm_query_state
+
+
+def test_duplicated_parameters_kept_once_with_the_last_state():
+    df = pd.DataFrame({
+        'origin': ['AMS', 'CDG', 'AMS'],
+        'startRange': ['2025-07-01', '2025-07-01', '2025-07-01'],
+        'completion': ['', '100', '50'],
+    })
+    states = afklm_query_state.query_states_from_table(df, afklm_query_state.state_columns)
+    assert [(state.parameters['origin'], state.completion) for state in states] == [('CDG', '100'), ('AMS', '50')]
+
+
+def test_query_table_keeps_the_file_columns_first():
+    df = pd.DataFrame({'origin': ['AMS'], 'completion': [''], 'startRange': ['2025-07-01']})
+    states = afklm_query_state.query_states_from_table(df, afklm_query_state.state_columns)
+    states[0].completion = 100.0
+    table = afklm_query_state.query_table(states, df.columns)
+    assert list(table.columns[:3]) == ['origin', 'completion', 'startRange']
+    assert set(afklm_query_state.state_columns) <= set(table.columns)
+    assert table.loc[0, 'completion'] == 100.0
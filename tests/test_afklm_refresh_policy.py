@@ -0,0 +1,53 @@
+import datetime
+
+import pandas as pd
+
+import afklm_refresh_policy
+from afklm_page_cursor import build_page_catalog, page_file_name
+from afklm_query_planner import call_parameters_url
+
+
+def test_refreshes_ranked_by_change_probability_per_page_within_budget(monkeypatch):
+    monkeypatch.setattr(afklm_refresh_policy, "refresh_quota_share", 1)
+    monkeypatch.setattr(afklm_refresh_policy, "min_change_probability", 0.1)
+    candidates = pd.DataFrame([
+        {'origin': "SVQ", 'destination': "AMS", 'date': "2025-07-21", 'estimated_pages': 1},
+        {'origin': "CDG", 'destination': "JFK", 'date': "2025-07-21", 'estimated_pages': 4},
+        {'origin': "LHR", 'destination': "AMS", 'date': "2025-07-21", 'estimated_pages': 1},
+    ])
+    rates = pd.DataFrame(
+        {'refreshes_observed': [10, 10, 10], 'changed_refreshes': [5, 9, 0], 'change_probability': [0.5, 0.9, 0.05]},
+        index=pd.MultiIndex.from_tuples([("SVQ", "AMS"), ("CDG", "JFK"), ("LHR", "AMS")], names=['origin', 'destination']),
+    )
+    decisions = afklm_refresh_policy.decide_refreshes(candidates, rates, nb_calls_left=3)
+    assert decisions[['origin', 'decision']].values.tolist() == [
+        ["SVQ", "refresh"], ["CDG", "skip_budget"], ["LHR", "skip_low_probability"]]
+
+
+def test_future_sched_window_refetched_once_its_pages_are_old(monkeypatch):
+    monkeypatch.setattr(afklm_refresh_policy, "refresh_quota_share", 1)
+    today = datetime.date(2025, 7, 20)
+    columns = ['startRange', 'endRange', 'origin', 'destination', 'call_parameters', 'totalPages', 'completion']
+    df = pd.DataFrame([
+        ["2025-07-25T00:00:00Z", "2025-07-25T23:59:59Z", "SVQ", "AMS", "", "2", "100"],
+        ["2025-07-26T00:00:00Z", "2025-07-26T23:59:59Z", "SVQ", "AMS", "", "1", "100"],
+    ], columns=columns)
+    urls = [call_parameters_url(row, columns) for _, row in df.iterrows()]
+    page_times = {
+        page_file_name(urls[0], 0, "sched"): "2025-07-10T06:00:00+00:00",
+        page_file_name(urls[0], 1, "sched"): "2025-07-10T06:00:00+00:00",
+        page_file_name(urls[1], 0, "sched"): "2025-07-20T06:00:00+00:00",
+    }
+    catalog = build_page_catalog(list(page_times))
+
+    candidates = afklm_refresh_policy.refresh_candidates({"calls.csv": df}, catalog, today, page_times)
+    assert candidates[['date', 'from_kind', 'to_kind', 'page_age_days']].values.tolist() == [
+        ["2025-07-25", "sched", "sched", 10], ["2025-07-26", "sched", "sched", 0]]
+
+    rates = pd.DataFrame(
+        {'refreshes_observed': [10], 'changed_refreshes': [5], 'change_probability': [0.5]},
+        index=pd.MultiIndex.from_tuples([("SVQ", "AMS")], names=['origin', 'destination']),
+    )
+    decisions = afklm_refresh_policy.decide_refreshes(candidates, rates, nb_calls_left=10)
+    assert decisions[['date', 'decision']].values.tolist() == [["2025-07-25", "refresh"], ["2025-07-26", "skip_recent"]]
+    assert decisions.loc[0, 'window_change_probability'] == 0.5
@@ -0,0 +1,34 @@
+import datetime
+
+import afklm_retry
+
+
+now = datetime.datetime(2025, 7, 21, 12, 0, 0)
+skip_all = dict.fromkeys(afklm_retry.max_retries, True)
+
+
+def test_failures_are_classified_from_the_response():
+    statuses = {"<Response [200]>": "none", "": "none", "<Response [429]>": "rate_limited",
+                "<Response [503]>": "server_error", "<Response [408]>": "server_error",
+                "<Response [404]>": "flight_not_found", "<Response [403]>": "other_error"}
+    assert {text: afklm_retry.classify_failure(afklm_retry.response_status(text)) for text in statuses} == statuses
+
+
+def test_backoff_doubles_until_no_retry_is_left():
+    retry_count, next_retry = afklm_retry.schedule_retry(503, '', now)
+    assert (retry_count, next_retry) == (1, "2025-07-21T14:00:00")
+    retry_count, next_retry = afklm_retry.schedule_retry(503, 1.0, now)
+    assert (retry_count, next_retry) == (2, "2025-07-21T16:00:00")
+    assert afklm_retry.schedule_retry(503, afklm_retry.max_retries["server_error"], now)[1] == ''
+    assert afklm_retry.schedule_retry(403, '', now) == (1, '')
+
+
+def test_retry_only_once_due():
+    skip, _ = afklm_retry.retry_decision("<Response [503]>", 1, "2025-07-21T14:00:00", skip_all, now)
+    assert skip
+    skip, message = afklm_retry.retry_decision("<Response [503]>", 1, "2025-07-21T11:00:00", skip_all, now)
+    assert not skip and message.startswith("retry 2")
+    # no retry left
+    assert afklm_retry.retry_decision("<Response [503]>", 5, '', skip_all, now)[0]
+    # skip option off: always queried again, as before the retry scheduling
+    assert afklm_retry.retry_decision("<Response [403]>", 1, '', skip_all | {"other_error": False}, now) == (False, "")
@@ -0,0 +1,35 @@
+import gzip
+import json
+
+import afklm_common
+import afklm_route_discovery as route_discovery
+
+
+def store_page(kind, flights):
+    page = {"operationalFlights": [
+        {"flightNumber": number, "flightScheduleDate": "2025-07-21", "airline": {"code": "KL"},
+         "flightLegs": [{"departureInformation": {"airport": {"code": origin}}, "arrivalInformation": {"airport": {"code": destination}}}]}
+        for number, origin, destination in flights]}
+    name = f"afklm_api_data_collection_origin=SVQ&startRange=2025-07-21T00_00_00Z&endRange=2025-07-21T23_59_59Z_0{kind}.json.gz"
+    afklm_common.write_bytes(gzip.compress(json.dumps(page).encode()), "data", name)
+
+
+def test_flights_seen_in_later_snapshots_are_counted_once(workdir, monkeypatch):
+    monkeypatch.setattr(afklm_common, "scan_days_back", None)
+    store_page("_sched", [(1, "SVQ", "AMS"), (2, "SVQ", "CDG")])
+    route_discovery.update_route_counts()
+
+    store_page("_updSchedD1", [(1, "SVQ", "AMS"), (2, "SVQ", "CDG")])
+    store_page("", [(1, "SVQ", "AMS"), (3, "SVQ", "AMS")])
+    counts = route_discovery.update_route_counts()
+
+    assert counts.set_index(['origin', 'destination'])['flights'].to_dict() == {("SVQ", "AMS"): 2, ("SVQ", "CDG"): 1}
+
+
+def test_first_run_counts_the_pages_older_than_the_scan_window(workdir, monkeypatch):
+    monkeypatch.setattr(afklm_common, "scan_days_back", 1)
+    monkeypatch.setattr(afklm_common, "scan_days_ahead", 1)
+    store_page("", [(1, "SVQ", "AMS")])
+    counts = route_discovery.update_route_counts()
+
+    assert counts.set_index(['origin', 'destination'])['flights'].to_dict() == {("SVQ", "AMS"): 1}
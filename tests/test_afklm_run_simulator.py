@@ -0,0 +1,77 @@
+import datetime
+
+import google.auth
+import google.auth.exceptions
+import numpy as np
+import pandas as pd
+import pytest
+
+import afklm_common
+import afklm_logging
+import afklm_pacing
+import afklm_run_simulator
+
+
+@pytest.fixture
+def simulator(workdir, monkeypatch):
+    # the collector imported without cloud credentials (local storage), a small synthetic world
+    def no_credentials(*args, **kwargs):
+        raise google.auth.exceptions.DefaultCredentialsError("no credentials in the tests")
+
+    monkeypatch.setattr(google.auth, "default", no_credentials)
+    monkeypatch.setattr(afklm_logging, "json_lines", False)
+    for name, value in {
+        'path_simulation': str(workdir / "simulation"), 'synthetic_routes': 4, 'simulated_days': 3,
+        'nb_api_keys': 2, 'max_daily_api_call': 15, 'future_days': 2, 'synthetic_server_error_rate': 0.1,
+    }.items():
+        monkeypatch.setattr(afklm_run_simulator, name, value)
+    yield afklm_run_simulator
+    # logging started by the collector import, on the captured output of the test
+    afklm_logging.stop_logging()
+
+
+def test_policies_run_through_the_collector_loop(simulator):
+    results = simulator.run_simulation()
+    world = simulator.synthetic_world(datetime.date.today())
+
+    assert (results['calls'] <= 2 * 15 * 3).all()
+    # the gateway headers rotate the keys before "Developer Over Rate", unless the reserve is disabled
+    assert results.loc['adaptive_pacing', 'quota_stops'] == 0
+    assert results.loc['baseline', 'quota_stops'] > 0
+    assert results.loc['baseline', 'pending_retries'] == 0
+    assert (results['sched_pages_stored'] > 0).all()
+
+    # flights of the complete windows as recorded by the collector in its state CSV
+    df_state = afklm_common.import_csv(f"{simulator.path_simulation}/adaptive_pacing/call_parameter_lists", simulator.simulation_file)
+    df_state = df_state[pd.to_numeric(df_state['completion'], errors='coerce') == 100].assign(date=lambda df: df['startRange'].str[:10])
+    expected = df_state.merge(world, on=['origin', 'destination', 'date'])['totalFlights_y'].sum()
+    assert results.loc['adaptive_pacing', 'flights'] == expected > 0
+
+
+def test_api_stops_a_key_at_its_daily_quota(simulator, monkeypatch):
+    monkeypatch.setattr(simulator, "synthetic_server_error_rate", 0)
+    monkeypatch.setattr(simulator, "synthetic_rate_limit_rate", 0)
+    clock = simulator.VirtualClock(datetime.datetime(2025, 7, 21, 6))
+    world = pd.DataFrame([("SVQ", "AMS", "2025-07-21", 1, 12, False)],
+                         columns=['origin', 'destination', 'date', 'totalPages', 'totalFlights', 'flights_estimated'])
+    api = simulator.SimulatedApi(world, clock, np.random.default_rng(0))
+    url = "https://api?origin=SVQ&destination=AMS&startRange=2025-07-21T00:00:00Z&pageNumber=0"
+
+    responses = [api.get(url, headers={'API-Key': "k"}) for _ in range(16)]
+    assert [response.status_code for response in responses] == [200] * 15 + [403]
+    assert responses[0].json()['page']['fullCount'] == 12 and len(responses[0].json()['operationalFlights']) == 12
+    assert responses[14].headers["X-Plan-Quota-Current"] == "15"
+    assert afklm_pacing.quota_exhausted(responses[15])
+    assert clock.elapsed == pytest.approx(16 * simulator.call_latency)
+
+
+def test_recorded_world_flags_estimated_flights(workdir, monkeypatch):
+    afklm_common.save_csv(pd.DataFrame({
+        'origin': ["SVQ", "LHR"], 'destination': ["AMS", "AMS"],
+        'startRange': ["2025-07-21T00:00:00Z", "2025-07-21T00:00:00Z"], 'endRange': ["2025-07-21T23:59:59Z", "2025-07-21T23:59:59Z"],
+        'totalPages': [2, 3], 'totalFlights': [150, None], 'completion': [100, 100],
+    }), afklm_common.path_call_parameter_file_folder, "df_call_parameters_test.csv")
+
+    world = afklm_run_simulator.recorded_world().set_index('origin')
+    assert world.loc["SVQ", ['totalFlights', 'flights_estimated']].tolist() == [150, False]
+    assert world.loc["LHR", ['totalFlights', 'flights_estimated']].tolist() == [300, True]
@@ -0,0 +1,56 @@
+import gzip
+import json
+import os
+
+import pandas as pd
+
+import afklm_common
+import afklm_snapshot_diff
+
+
+page_name = "afklm_api_data_collection_origin=SVQ&destination=AMS&startRange=2025-07-21T00_00_00Z&endRange=2025-07-21T23_59_59Z_0{}.json.gz"
+
+
+def store_page(kind, status, mtime):
+    page = {"operationalFlights": [{
+        "flightNumber": 1234, "flightScheduleDate": "2025-07-21", "airline": {"code": "KL"}, "flightStatusPublic": status,
+        "flightLegs": [{"departureInformation": {"airport": {"code": "SVQ"}}, "arrivalInformation": {"airport": {"code": "AMS"}}}],
+    }]}
+    name = page_name.format(kind)
+    afklm_common.write_bytes(gzip.compress(json.dumps(page).encode()), "data", name)
+    os.utime(os.path.join("data", name), ns=(mtime, mtime))
+    return name
+
+
+def legs(*snapshots):
+    return pd.DataFrame([
+        {'flight_key': key, 'page': page, 'observed_at': observed_at} | dict.fromkeys(afklm_snapshot_diff.state_fields, '') | {'flightStatusPublic': status}
+        for key, status, page, observed_at in snapshots
+    ])
+
+
+def test_changes_follow_the_snapshot_order():
+    last_state = legs(("F1", "SCHEDULED", "p0", "t0"))
+    new = legs(("F1", "DELAYED", "p1", "t1"), ("F2", "SCHEDULED", "p1", "t1"), ("F1", "ARRIVED", "p2", "t2"))
+    changes, state = afklm_snapshot_diff.diff_snapshots(last_state, new)
+
+    status_changes = changes[changes['field'] == 'flightStatusPublic']
+    assert list(zip(status_changes['old_value'], status_changes['new_value'])) == [("SCHEDULED", "DELAYED"), ("DELAYED", "ARRIVED")]
+    assert changes.loc[changes['change_type'] == 'new_flight', 'flight_key'].tolist() == ["F2"]
+    assert state.set_index('flight_key')['flightStatusPublic'].to_dict() == {"F1": "ARRIVED", "F2": "SCHEDULED"}
+
+
+def test_pages_processed_once_and_again_when_stored_again(workdir, monkeypatch):
+    monkeypatch.setattr(afklm_common, "scan_days_back", None)
+    store_page("_sched", "SCHEDULED", 1_000_000_000_000_000_000)
+    store_page("_updSchedD1", "DELAYED", 1_000_000_000_000_000_000)
+    changes = afklm_snapshot_diff.run_snapshot_diff()
+    # same storage time: the sched snapshot comes first
+    assert changes.loc[changes['field'] == 'flightStatusPublic', 'new_value'].tolist() == ["DELAYED"]
+    assert len(afklm_snapshot_diff.run_snapshot_diff()) == 0
+
+    name = store_page("_updSchedD1", "CANCELLED", 1_000_000_001_000_000_000)
+    changes = afklm_snapshot_diff.run_snapshot_diff()
+    assert changes[['field', 'old_value', 'new_value', 'page']].values.tolist() == [["flightStatusPublic", "DELAYED", "CANCELLED", name]]
+    processed = afklm_common.load_processed_pages(afklm_snapshot_diff.path_derived, afklm_snapshot_diff.processed_file)
+    assert len(processed) == 2
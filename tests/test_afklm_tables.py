@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import afklm_common
+import afklm_tables
+
+
+def parameter_table(rows):
+    dates = pd.date_range("2025-07-01", periods=rows, freq="h")
+    airports = np.array(["AMS", "CDG", "SVQ", "JFK", "LHR"])
+    return pd.DataFrame({
+        'origin': airports[np.arange(rows) % 5], 'destination': airports[(np.arange(rows) + 1) % 5],
+        'startRange': dates.strftime("%Y-%m-%dT%H:00:00Z"), 'endRange': dates.strftime("%Y-%m-%dT%H:59:59Z"),
+        'response': np.where(np.arange(rows) % 3, "<Response [200]>", None),
+        'timestamp': dates.map(lambda val: val.isoformat()),
+        'totalPages': np.where(np.arange(rows) % 3, 2.0, np.nan), 'completion': np.where(np.arange(rows) % 3, 100.0, np.nan),
+    }).astype({'origin': object, 'destination': object, 'startRange': object, 'endRange': object, 'response': object, 'timestamp': object})
+
+
+def test_typed_table_is_smaller_and_keeps_the_csv_form(workdir):
+    afklm_common.save_csv(parameter_table(20000), "parameters", "df_call_parameters.csv")
+    df = afklm_common.import_csv("parameters", "df_call_parameters.csv")
+    typed = afklm_tables.typed_table(df, afklm_tables.call_parameters_schema)
+
+    assert isinstance(typed['origin'].dtype, pd.CategoricalDtype)
+    assert typed['startRange'].dtype == 'datetime64[ns]'
+    assert typed['totalPages'].dtype == 'Int32' and typed['completion'].dtype == 'Int32'
+    assert typed.memory_usage(deep=True).sum() < df.memory_usage(deep=True).sum() / 3
+
+    back = afklm_tables.untyped_table(typed, afklm_tables.call_parameters_schema)
+    assert back['startRange'].tolist() == df['startRange'].tolist()
+    assert back['timestamp'].tolist() == df['timestamp'].tolist()
+    assert back['response'].isna().tolist() == df['response'].isna().tolist()
+    assert (back['totalPages'].astype(float).fillna(-1) == df['totalPages'].fillna(-1)).all()
+
+
+def test_parquet_copy_read_while_it_is_the_most_recent(workdir, monkeypatch):
+    monkeypatch.setattr(afklm_tables, "table_format", "parquet")
+    afklm_tables.save_table(parameter_table(10), "parameters", "df_call_parameters.csv")
+    assert os.path.exists("parameters/df_call_parameters.parquet")
+    typed = afklm_tables.import_table("parameters", "df_call_parameters.csv")
+    assert isinstance(typed['origin'].dtype, pd.CategoricalDtype)
+
+    # CSV written later by something else: the stale copy is ignored
+    df = parameter_table(10)
+    df.loc[0, 'origin'] = "BCN"
+    afklm_common.save_csv(df, "parameters", "df_call_parameters.csv")
+    parquet_time = os.stat("parameters/df_call_parameters.csv").st_mtime_ns - 1_000_000
+    os.utime("parameters/df_call_parameters.parquet", ns=(parquet_time, parquet_time))
+    assert afklm_tables.import_table("parameters", "df_call_parameters.csv", typed=False).loc[0, 'origin'] == "BCN"